@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+"""generate realistic terraform for benchmarking tf2sam
+
+each service is a lambda with an iam role and policy, log group, error
+alarm, security group, an sqs, dynamodb stream or sns event source and a
+route on a shared api gateway
+
+"""
+import argh
+import random
+
+
+API_SERVICES = 10
+
+
+def _role(name):
+    return '''resource "aws_iam_role" "%(name)s" {
+    name = "%(name)s"
+    assume_role_policy = <<EOF
+{
+  "Version": "2012-10-17",
+  "Statement": [
+    {
+      "Action": "sts:AssumeRole",
+      "Principal": {
+        "Service": "lambda.amazonaws.com"
+      },
+      "Effect": "Allow"
+    }
+  ]
+}
+EOF
+    tags = {
+        service = "%(name)s"
+    }
+}
+''' % {'name': name}
+
+
+def _policy(name, source_type, source):
+    return '''resource "aws_iam_role_policy" "%(name)s_policy" {
+    name = "%(name)s-policy"
+    role = "${aws_iam_role.%(name)s.id}"
+    policy = <<EOF
+{
+  "Version": "2012-10-17",
+  "Statement": [
+    {
+      "Effect": "Allow",
+      "Action": ["logs:*"],
+      "Resource": "*"
+    },
+    {
+      "Effect": "Allow",
+      "Action": ["%(action)s:*"],
+      "Resource": "${%(source_type)s.%(source)s.arn}"
+    }
+  ]
+}
+EOF
+}
+''' % {
+        'name': name,
+        'action': source_type.split('_')[1],
+        'source_type': source_type,
+        'source': source
+    }
+
+
+def _function(name, memory, timeout):
+    return '''resource "aws_lambda_function" "%(name)s" {
+    function_name = "%(name)s"
+    filename = "%(name)s.zip"
+    handler = "index.handler"
+    runtime = "python3.8"
+    memory_size = %(memory)s
+    timeout = %(timeout)s
+    role = "${aws_iam_role.%(name)s.arn}"
+    environment {
+        variables = {
+            SERVICE = "%(name)s"
+            STAGE = "${var.stage}"
+        }
+    }
+    vpc_config {
+        subnet_ids = ["${var.subnet_id}"]
+        security_group_ids = ["${aws_security_group.%(name)s.id}"]
+    }
+    tags = {
+        service = "%(name)s"
+    }
+    depends_on = ["aws_iam_role_policy.%(name)s_policy"]
+}
+''' % {'name': name, 'memory': memory, 'timeout': timeout}
+
+
+def _security_group(name, ports):
+    ingress = ''.join([
+        '''    ingress {
+        from_port = %(port)s
+        to_port = %(port)s
+        protocol = "tcp"
+        cidr_blocks = ["10.0.0.0/8"]
+    }
+''' % {'port': port} for port in ports
+    ])
+    return '''resource "aws_security_group" "%(name)s" {
+    name = "%(name)s"
+    description = "%(name)s security group"
+    vpc_id = "${var.vpc_id}"
+%(ingress)s    egress {
+        from_port = 0
+        to_port = 0
+        protocol = "-1"
+        cidr_blocks = ["0.0.0.0/0"]
+    }
+}
+''' % {'name': name, 'ingress': ingress}
+
+
+def _logs(name, retention):
+    return '''resource "aws_cloudwatch_log_group" "%(name)s_logs" {
+    name = "/aws/lambda/${aws_lambda_function.%(name)s.function_name}"
+    retention_in_days = %(retention)s
+}
+''' % {'name': name, 'retention': retention}
+
+
+def _alarm(name, topic):
+    return '''resource "aws_cloudwatch_metric_alarm" "%(name)s_errors" {
+    alarm_name = "%(name)s-errors"
+    comparison_operator = "GreaterThanThreshold"
+    evaluation_periods = 1
+    metric_name = "Errors"
+    namespace = "AWS/Lambda"
+    period = 60
+    statistic = "Sum"
+    threshold = 0
+    alarm_actions = ["${aws_sns_topic.%(topic)s.arn}"]
+    dimensions = {
+        FunctionName = "${aws_lambda_function.%(name)s.function_name}"
+    }
+}
+''' % {'name': name, 'topic': topic}
+
+
+def _topic(name):
+    return '''resource "aws_sns_topic" "%(name)s" {
+    name = "%(name)s"
+}
+''' % {'name': name}
+
+
+def _sqs_source(name):
+    return '''resource "aws_sqs_queue" "%(name)s_queue" {
+    name = "%(name)s-queue"
+    visibility_timeout_seconds = 60
+    message_retention_seconds = 86400
+}
+resource "aws_lambda_event_source_mapping" "%(name)s_queue" {
+    batch_size = 10
+    event_source_arn = "${aws_sqs_queue.%(name)s_queue.arn}"
+    function_name = "%(name)s"
+}
+''' % {'name': name}, 'aws_sqs_queue', '%s_queue' % name, 2
+
+
+def _dynamodb_source(name):
+    return '''resource "aws_dynamodb_table" "%(name)s_table" {
+    name = "%(name)s-table"
+    hash_key = "id"
+    range_key = "created"
+    stream_enabled = true
+    stream_view_type = "NEW_AND_OLD_IMAGES"
+    attribute {
+        name = "id"
+        type = "S"
+    }
+    attribute {
+        name = "created"
+        type = "N"
+    }
+    point_in_time_recovery {
+        enabled = true
+    }
+}
+resource "aws_lambda_event_source_mapping" "%(name)s_stream" {
+    batch_size = 100
+    starting_position = "LATEST"
+    event_source_arn = "${aws_dynamodb_table.%(name)s_table.stream_arn}"
+    function_name = "%(name)s"
+}
+''' % {'name': name}, 'aws_dynamodb_table', '%s_table' % name, 2
+
+
+def _sns_source(name):
+    return '''resource "aws_sns_topic" "%(name)s_events" {
+    name = "%(name)s-events"
+}
+resource "aws_sns_topic_subscription" "%(name)s_events" {
+    topic_arn = "${aws_sns_topic.%(name)s_events.arn}"
+    protocol = "lambda"
+    endpoint = "${aws_lambda_function.%(name)s.arn}"
+}
+resource "aws_lambda_permission" "%(name)s_events" {
+    statement_id = "AllowSNSInvoke"
+    action = "lambda:InvokeFunction"
+    function_name = "${aws_lambda_function.%(name)s.function_name}"
+    principal = "sns.amazonaws.com"
+    source_arn = "${aws_sns_topic.%(name)s_events.arn}"
+}
+''' % {'name': name}, 'aws_sns_topic', '%s_events' % name, 3
+
+
+def _api(api):
+    return '''resource "aws_api_gateway_rest_api" "%(api)s" {
+    name = "%(api)s"
+    binary_media_types = []
+}
+''' % {'api': api}
+
+
+def _api_route(api, name, parts):
+    out = []
+    parent = '${aws_api_gateway_rest_api.%s.root_resource_id}' % api
+    for i, part in enumerate(parts):
+        resource = '%s_r%s' % (name, i)
+        out.append('''resource "aws_api_gateway_resource" "%(resource)s" {
+    parent_id = "%(parent)s"
+    rest_api_id = "${aws_api_gateway_rest_api.%(api)s.id}"
+    path_part = "%(part)s"
+}
+''' % {'resource': resource, 'parent': parent, 'api': api, 'part': part})
+        parent = '${aws_api_gateway_resource.%s.id}' % resource
+    out.append('''resource "aws_api_gateway_method" "%(name)s_any" {
+    http_method = "ANY"
+    authorization = "NONE"
+    rest_api_id = "${aws_api_gateway_rest_api.%(api)s.id}"
+    resource_id = "${aws_api_gateway_resource.%(resource)s.id}"
+}
+resource "aws_api_gateway_integration" "%(name)s_any" {
+    resource_id = "${aws_api_gateway_resource.%(resource)s.id}"
+    uri = "%(uri)s"
+    http_method = "${aws_api_gateway_method.%(name)s_any.http_method}"
+    integration_http_method = "POST"
+    rest_api_id = "${aws_api_gateway_rest_api.%(api)s.id}"
+    type = "AWS_PROXY"
+}
+resource "aws_lambda_permission" "%(name)s_api" {
+    statement_id = "AllowAPIGatewayInvoke"
+    action = "lambda:InvokeFunction"
+    function_name = "${aws_lambda_function.%(name)s.function_name}"
+    principal = "apigateway.amazonaws.com"
+}
+''' % {
+        'name': name, 'api': api, 'resource': resource,
+        'uri': 'arn:aws:apigateway:${var.region}:lambda:path/2015-03-31/'
+        'functions/${aws_lambda_function.%s.arn}/invocations' % name
+    })
+    return ''.join(out), len(parts) + 3
+
+
+def _deployment(api, names):
+    return '''resource "aws_api_gateway_deployment" "%(api)s_dev" {
+    stage_name = "dev"
+    rest_api_id = "${aws_api_gateway_rest_api.%(api)s.id}"
+    depends_on = [%(depends_on)s]
+}
+''' % {
+        'api': api,
+        'depends_on': ', '.join([
+            '"aws_api_gateway_integration.%s_any"' % n for n in names
+        ])
+    }
+
+
+def generate(resources, seed=0):
+    """returns (terraform source, resource count) with at least resources
+
+    """
+    rnd = random.Random(seed)
+    out = []
+    count = 0
+    service = 0
+    while count < resources:
+        api = 'api%s' % (service // API_SERVICES)
+        names = []
+        out.append(_api(api))
+        alarms = '%s_alarms' % api
+        out.append(_topic(alarms))
+        count += 2
+        for i in range(API_SERVICES):
+            name = 'svc%s' % service
+            service += 1
+            names.append(name)
+            (source, source_type, source_name, n) = rnd.choice([
+                _sqs_source, _dynamodb_source, _sns_source
+            ])(name)
+            (route, route_n) = _api_route(api, name, [
+                'v%s' % rnd.randint(1, 2), name, '{proxy+}'
+            ][0:rnd.randint(1, 3)])
+            out += [
+                _role(name),
+                _policy(name, source_type, source_name),
+                _function(
+                    name, rnd.choice([128, 256, 512, 1024]),
+                    rnd.randint(3, 60)
+                ),
+                _security_group(name, rnd.sample(
+                    [80, 443, 5432, 6379], rnd.randint(1, 3)
+                )),
+                _logs(name, rnd.choice([7, 14, 30, 90])),
+                _alarm(name, alarms),
+                source,
+                route
+            ]
+            count += 6 + n + route_n
+            if count >= resources:
+                break
+        out.append(_deployment(api, names))
+        count += 1
+    return ''.join(out), count
+
+
+def write(file, resources, seed=0):
+    """write generated terraform to file, returns resource count
+
+    """
+    (source, count) = generate(resources, seed)
+    with open(file, 'w') as fh:
+        fh.write(source)
+    return count
+
+
+@argh.arg('file', help='terraform file to write')
+@argh.arg('-r', '--resources', help='minimum number of resources')
+@argh.arg('-s', '--seed', help='random seed')
+def main(file, resources=1000, seed=0):
+    'generate terraform file with realistic serverless resources'
+    print('written %s (%s resources)' % (
+        file, write(file, int(resources), int(seed))
+    ))
+
+
+if __name__ == '__main__':
+    argh.dispatch_command(main)
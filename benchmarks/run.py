@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""time and memory profile each stage of the tf2sam pipeline on generated
+terraform, comparing against stored baselines
+
+"""
+import argh
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+BASELINES_FILE = os.path.join(BENCH_DIR, 'baselines.json')
+SIZES = [100, 1000, 10000, 50000]
+sys.path.append(ROOT_DIR)
+
+import generate_tf  # noqa: E402
+import tf2sam as ts  # noqa: E402
+
+# stage name -> tf2sam function, stages nest so times are inclusive, eg
+# transform_resource includes _merge_resources
+STAGES = [
+    ('load_file', 'load_file'),
+    ('get_relationships', 'build_relationship_graph'),
+    ('transform_resource', 'transform_resources'),
+    ('_merge_resources', '_merge_resources'),
+    ('emit', 'emit_template')
+]
+
+
+class Recorder(object):
+    """records calls, inclusive seconds and peak traced memory per stage
+
+    """
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.stats = {}
+        self.stack = []
+
+    def wrap(self, stage, fn):
+        def _wrapped(*args, **kwargs):
+            self.enter(stage)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.exit(stage)
+        return _wrapped
+
+    def enter(self, stage):
+        frame = [stage, 0, 0]
+        if self.trace is True:
+            # peaks are tracked relative to memory in use on entry, the
+            # global peak is reset so parents take the max of their children
+            (frame[1], peak) = tracemalloc.get_traced_memory()
+            if len(self.stack) > 0:
+                self.stack[-1][2] = max(self.stack[-1][2], peak)
+            tracemalloc.reset_peak()
+        self.stack.append(frame)
+        frame.append(time.perf_counter())
+
+    def exit(self, stage):
+        (stage, current, peak, start) = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        s = self.stats.setdefault(stage, {
+            'calls': 0, 'seconds': 0.0, 'peak_mb': 0.0
+        })
+        s['calls'] += 1
+        s['seconds'] += elapsed
+        if self.trace is True:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            s['peak_mb'] = max(s['peak_mb'], (peak - current) / 1048576.0)
+            if len(self.stack) > 0:
+                self.stack[-1][2] = max(self.stack[-1][2], peak)
+
+
+def run_pipeline(file, trace=False):
+    """run load, build and emit on file with stages recorded
+
+    """
+    recorder = Recorder(trace)
+    ts.reset_config()
+    # load config before caching is turned off, or the first config() call
+    # in the timed section rebuilds and validates it
+    ts.config('template')
+    # time parsing rather than the parse cache
+    no_cache = os.environ.get('TF2SAM_NO_CACHE')
+    os.environ['TF2SAM_NO_CACHE'] = '1'
+    originals = {}
+    for (stage, fn_name) in STAGES:
+        originals[fn_name] = getattr(ts, fn_name)
+        setattr(ts, fn_name, recorder.wrap(stage, originals[fn_name]))
+    if trace is True:
+        tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        data = ts.load_file(file)
+        template = ts.build_template(data)
+        ts.emit_template(template, io.StringIO())
+        total = time.perf_counter() - start
+    finally:
+        if trace is True:
+            tracemalloc.stop()
+        for (fn_name, fn) in originals.items():
+            setattr(ts, fn_name, fn)
+        if no_cache is None:
+            os.environ.pop('TF2SAM_NO_CACHE')
+        else:
+            os.environ['TF2SAM_NO_CACHE'] = no_cache
+    stats = {
+        stage: recorder.stats[stage] for (stage, _) in STAGES
+        if stage in recorder.stats
+    }
+    stats['total'] = {
+        'calls': 1, 'seconds': total,
+        'peak_mb': max([s['peak_mb'] for s in stats.values()])
+    }
+    return len(template['Resources']), stats
+
+
+def bench(size, workdir, memory=True):
+    """benchmark a generated file with at least size resources
+
+    """
+    file = os.path.join(workdir, 'bench_%s.tf' % size)
+    resources = generate_tf.write(file, size)
+    (outputs, stats) = run_pipeline(file)
+    if memory is True:
+        (_, traced) = run_pipeline(file, trace=True)
+        for (stage, s) in traced.items():
+            stats[stage]['peak_mb'] = s['peak_mb']
+    for s in stats.values():
+        s['seconds'] = round(s['seconds'], 4)
+        s['peak_mb'] = round(s['peak_mb'], 2)
+    return {'resources': resources, 'outputs': outputs, 'stages': stats}
+
+
+def compare(results, baselines, tolerance):
+    """print results against baselines, returns list of regressions
+
+    """
+    regressions = []
+    for (size, result) in results.items():
+        baseline = baselines.get(size, {}).get('stages', {})
+        print('\n%s resources (%s in template)' % (
+            result['resources'], result['outputs']
+        ))
+        print('  %-20s %6s %10s %10s %10s %10s' % (
+            'stage', 'calls', 'seconds', 'baseline', 'peak mb', 'baseline'
+        ))
+        for (stage, s) in result['stages'].items():
+            b = baseline.get(stage)
+            flag = ''
+            if b is not None and b['seconds'] > 0:
+                ratio = s['seconds'] / b['seconds']
+                flag = '%.2fx' % ratio
+                if ratio > tolerance and s['seconds'] - b['seconds'] > 0.05:
+                    flag += ' SLOWER'
+                    regressions.append((size, stage, ratio))
+            print('  %-20s %6s %10.3f %10s %10.2f %10s %s' % (
+                stage, s['calls'], s['seconds'],
+                '-' if b is None else '%.3f' % b['seconds'],
+                s['peak_mb'],
+                '-' if b is None else '%.2f' % b['peak_mb'],
+                flag
+            ))
+    return regressions
+
+
+@argh.arg(
+    '-s', '--sizes', nargs='+', type=int,
+    help='minimum resource counts to benchmark'
+)
+@argh.arg('-m', '--no-memory', help='skip the tracemalloc pass')
+@argh.arg('-w', '--write', help='write results as the new baselines')
+@argh.arg(
+    '-t', '--tolerance', type=float,
+    help='fail if a stage is this many times slower than its baseline'
+)
+@argh.arg('-o', '--output', help='write results json to file')
+def main(sizes=SIZES, no_memory=False, write=False, tolerance=1.5,
+         output=None):
+    'benchmark tf2sam stages at increasing numbers of resources'
+    baselines = {}
+    if os.path.isfile(BASELINES_FILE):
+        with open(BASELINES_FILE) as fh:
+            baselines = json.load(fh)['results']
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            results[str(size)] = bench(size, workdir, not no_memory)
+    regressions = compare(results, baselines, tolerance)
+    doc = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }
+    if output is not None:
+        with open(output, 'w') as fh:
+            json.dump(doc, fh, indent=2)
+    if write is True:
+        baselines.update(results)
+        doc['results'] = baselines
+        with open(BASELINES_FILE, 'w') as fh:
+            json.dump(doc, fh, indent=2)
+            fh.write('\n')
+        print('\nwritten %s' % BASELINES_FILE)
+    elif len(regressions) > 0:
+        print('\n%s stages slower than baseline' % len(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    argh.dispatch_command(main)
@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    # config snapshots, hcl and incremental caches are written per test,
+    # not read from or left in the user's cache
+    monkeypatch.setenv('TF2SAM_CACHE_DIR', str(tmp_path / 'cache'))
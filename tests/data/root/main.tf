@@ -0,0 +1,36 @@
+resource "aws_iam_role" "lambda" {
+    name = "${local.service}-lambda"
+    assume_role_policy = <<EOF
+{
+  "Version": "2012-10-17",
+  "Statement": [
+    {
+      "Action": "sts:AssumeRole",
+      "Principal": {
+        "Service": "lambda.amazonaws.com"
+      },
+      "Effect": "Allow"
+    }
+  ]
+}
+EOF
+}
+resource "aws_lambda_function" "api" {
+    function_name = "${local.service}-api"
+    filename = "api.zip"
+    handler = "index.handler"
+    runtime = "python3.8"
+    role = "${aws_iam_role.lambda.arn}"
+    environment {
+        variables = {
+            QUEUE_URL = "${module.jobs.queue_url}"
+            STAGE = "${var.stage}"
+        }
+    }
+}
+module "jobs" {
+    source = "./modules/queue"
+    name = "${local.service}-jobs"
+    role = "${aws_iam_role.lambda.arn}"
+    visibility = 60
+}
@@ -0,0 +1,29 @@
+variable "name" {}
+variable "role" {}
+variable "visibility" {
+    default = 30
+}
+variable "retention" {
+    default = 86400
+}
+resource "aws_sqs_queue" "queue" {
+    name = "${var.name}"
+    visibility_timeout_seconds = "${var.visibility}"
+    message_retention_seconds = "${var.retention}"
+}
+resource "aws_lambda_function" "worker" {
+    function_name = "worker"
+    filename = "worker.zip"
+    handler = "worker.handler"
+    runtime = "python3.8"
+    role = "${var.role}"
+    depends_on = ["aws_sqs_queue.queue"]
+}
+resource "aws_lambda_event_source_mapping" "worker" {
+    batch_size = 10
+    event_source_arn = "${aws_sqs_queue.queue.arn}"
+    function_name = "worker"
+}
+output "queue_url" {
+    value = "${aws_sqs_queue.queue.id}"
+}
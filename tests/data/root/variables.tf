@@ -0,0 +1,4 @@
+variable "stage" {}
+locals {
+    service = "shop"
+}
@@ -0,0 +1,205 @@
+resource "aws_iam_role" "foo_lambda" {
+    name = "foo-lambda"
+    assume_role_policy = <<EOF
+{
+  "Version": "2012-10-17",
+  "Statement": [
+    {
+      "Action": "sts:AssumeRole",
+      "Principal": {
+        "Service": "lambda.amazonaws.com"
+      },
+      "Effect": "Allow"
+    }
+  ]
+}
+EOF
+    tags = {
+        team = "foo"
+    }
+}
+resource "aws_iam_role_policy" "foo_lambda_policy" {
+    name = "foo-lambda-policy"
+    role = "${aws_iam_role.foo_lambda.id}"
+    policy = <<EOF
+{
+  "Version": "2012-10-17",
+  "Statement": [
+    {
+      "Effect": "Allow",
+      "Action": ["sqs:*"],
+      "Resource": "${aws_sqs_queue.foo_queue.arn}"
+    },
+    {
+      "Effect": "Allow",
+      "Action": ["dynamodb:*"],
+      "Resource": "${aws_dynamodb_table.foo_table.arn}"
+    }
+  ]
+}
+EOF
+}
+resource "aws_lambda_function" "foo_api" {
+    function_name = "foo_api"
+    filename = "foo.zip"
+    handler = "index.handler"
+    runtime = "python3.8"
+    role = "${aws_iam_role.foo_lambda.arn}"
+    environment {
+        variables = {
+            TABLE_NAME = "${aws_dynamodb_table.foo_table.name}"
+            STAGE = "${var.stage}"
+        }
+    }
+    tags = {
+        team = "foo"
+    }
+}
+resource "aws_lambda_function" "foo_worker" {
+    function_name = "foo_worker"
+    filename = "foo.zip"
+    handler = "worker.handler"
+    runtime = "python3.8"
+    role = "${aws_iam_role.foo_lambda.arn}"
+    depends_on = ["aws_iam_role_policy.foo_lambda_policy", "aws_sqs_queue.foo_queue"]
+}
+resource "aws_lambda_permission" "foo_api_permission" {
+    statement_id = "AllowAPIGatewayInvoke"
+    action = "lambda:InvokeFunction"
+    function_name = "${aws_lambda_function.foo_api.function_name}"
+    principal = "apigateway.amazonaws.com"
+}
+resource "aws_api_gateway_rest_api" "foo" {
+    name = "foo"
+    binary_media_types = []
+}
+resource "aws_api_gateway_resource" "foo_v1" {
+    parent_id = "${aws_api_gateway_rest_api.foo.root_resource_id}"
+    rest_api_id = "${aws_api_gateway_rest_api.foo.id}"
+    path_part = "v1"
+}
+resource "aws_api_gateway_resource" "foo_v1_items" {
+    parent_id = "${aws_api_gateway_resource.foo_v1.id}"
+    rest_api_id = "${aws_api_gateway_rest_api.foo.id}"
+    path_part = "items"
+}
+resource "aws_api_gateway_resource" "foo_v1_items_proxy" {
+    parent_id = "${aws_api_gateway_resource.foo_v1_items.id}"
+    rest_api_id = "${aws_api_gateway_rest_api.foo.id}"
+    path_part = "{proxy+}"
+}
+resource "aws_api_gateway_method" "foo_items_any" {
+    http_method = "ANY"
+    authorization = "NONE"
+    rest_api_id = "${aws_api_gateway_rest_api.foo.id}"
+    resource_id = "${aws_api_gateway_resource.foo_v1_items_proxy.id}"
+}
+resource "aws_api_gateway_integration" "foo_items_any_int" {
+    resource_id = "${aws_api_gateway_resource.foo_v1_items_proxy.id}"
+    uri = "arn:aws:apigateway:${var.region}:lambda:path/2015-03-31/functions/${aws_lambda_function.foo_api.arn}/invocations"
+    http_method = "${aws_api_gateway_method.foo_items_any.http_method}"
+    integration_http_method = "POST"
+    rest_api_id = "${aws_api_gateway_rest_api.foo.id}"
+    type = "AWS_PROXY"
+}
+resource "aws_api_gateway_deployment" "foo_dev" {
+    stage_name = "dev"
+    rest_api_id = "${aws_api_gateway_rest_api.foo.id}"
+    depends_on = ["aws_api_gateway_integration.foo_items_any_int"]
+}
+resource "aws_sqs_queue" "foo_queue" {
+    name = "foo-queue"
+    visibility_timeout_seconds = 60
+    message_retention_seconds = 86400
+    tags = {
+        team = "foo"
+    }
+}
+resource "aws_dynamodb_table" "foo_table" {
+    name = "foo-table"
+    hash_key = "id"
+    range_key = "created"
+    stream_enabled = true
+    stream_view_type = "NEW_AND_OLD_IMAGES"
+    attribute {
+        name = "id"
+        type = "S"
+    }
+    attribute {
+        name = "created"
+        type = "N"
+    }
+    point_in_time_recovery {
+        enabled = true
+    }
+}
+resource "aws_lambda_event_source_mapping" "foo_worker_sqs" {
+    batch_size = 10
+    event_source_arn = "${aws_sqs_queue.foo_queue.arn}"
+    function_name = "foo_worker"
+}
+resource "aws_lambda_event_source_mapping" "foo_worker_stream" {
+    batch_size = 100
+    starting_position = "LATEST"
+    event_source_arn = "${aws_dynamodb_table.foo_table.stream_arn}"
+    function_name = "foo_worker"
+}
+resource "aws_sns_topic" "foo_topic" {
+    name = "foo-topic"
+    policy = <<EOF
+{
+  "Version": "2012-10-17",
+  "Statement": [
+    {
+      "Effect": "Allow",
+      "Principal": {"Service": "events.amazonaws.com"},
+      "Action": "sns:Publish",
+      "Resource": "*"
+    }
+  ]
+}
+EOF
+}
+resource "aws_sns_topic_subscription" "foo_worker_sub" {
+    topic_arn = "${aws_sns_topic.foo_topic.arn}"
+    protocol = "lambda"
+    endpoint = "${aws_lambda_function.foo_worker.arn}"
+}
+resource "aws_security_group" "foo_sg" {
+    name = "foo-sg"
+    description = "foo security group"
+    vpc_id = "${var.vpc_id}"
+    ingress {
+        from_port = 443
+        to_port = 443
+        protocol = "tcp"
+        cidr_blocks = ["10.0.0.0/8", "172.16.0.0/12"]
+    }
+    egress {
+        from_port = 0
+        to_port = 0
+        protocol = "-1"
+        cidr_blocks = ["0.0.0.0/0"]
+    }
+}
+resource "aws_cloudwatch_log_group" "foo_api_logs" {
+    name = "/aws/lambda/${aws_lambda_function.foo_api.function_name}"
+    retention_in_days = 14
+}
+resource "aws_cloudwatch_metric_alarm" "foo_errors" {
+    alarm_name = "foo-errors"
+    comparison_operator = "GreaterThanThreshold"
+    evaluation_periods = 1
+    metric_name = "Errors"
+    namespace = "AWS/Lambda"
+    period = 60
+    statistic = "Sum"
+    threshold = 0
+    alarm_actions = ["${aws_sns_topic.foo_topic.arn}"]
+    dimensions = {
+        FunctionName = "${aws_lambda_function.foo_api.function_name}"
+    }
+    tags = {
+        team = "foo"
+    }
+}
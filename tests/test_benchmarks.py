@@ -0,0 +1,30 @@
+import os
+import sys
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, 'benchmarks'))
+
+import generate_tf  # noqa: E402
+import run  # noqa: E402
+import tf2sam as ts  # noqa: E402
+
+
+def test_generate_tf():
+    (source, count) = generate_tf.generate(100)
+    assert count >= 100
+    assert source == generate_tf.generate(100)[0]
+    assert source.count('resource "') == count
+
+
+def test_bench(tmp_path):
+    result = run.bench(100, str(tmp_path))
+    assert result['resources'] >= 100
+    assert list(result['stages'].keys()) == [
+        stage for (stage, _) in run.STAGES
+    ] + ['total']
+    assert result['stages']['transform_resource']['calls'] > 0
+    assert result['stages']['load_file']['peak_mb'] > 0
+    # stage wrappers are removed after the run
+    assert ts.load_file.__name__ == 'load_file'
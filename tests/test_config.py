@@ -0,0 +1,51 @@
+import os
+import shutil
+import sys
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+import tf2sam as ts  # noqa: E402
+
+
+def test_config_snapshot(tmp_path, monkeypatch):
+    shutil.copytree(
+        os.path.join(ROOT_DIR, 'config'), tmp_path / 'root' / 'config'
+    )
+    monkeypatch.setattr(ts, 'ROOT_DIR', str(tmp_path / 'root'))
+    monkeypatch.delenv('TF2SAM_NO_CACHE', raising=False)
+    builds = []
+    _build_config = ts._build_config
+
+    def build_config():
+        builds.append(True)
+        return _build_config()
+    monkeypatch.setattr(ts, '_build_config', build_config)
+
+    snapshot = ts.load_config()
+    assert os.path.isfile(ts.config_snapshot_file())
+    assert snapshot['config']['aws_sqs_queue']['rename']['name'] == (
+        'QueueName'
+    )
+    assert ts.load_config()['digest'] == snapshot['digest']
+    assert len(builds) == 1
+
+    # touched but unchanged content reuses the snapshot
+    common = tmp_path / 'root' / 'config' / 'common.yaml'
+    os.utime(common, ns=(0, 0))
+    assert ts.load_config()['digest'] == snapshot['digest']
+    assert len(builds) == 1
+
+    common.write_text(common.read_text() + '\ndebug: false\n')
+    changed = ts.load_config()
+    assert len(builds) == 2
+    assert changed['digest'] != snapshot['digest']
+    assert changed['config']['common']['debug'] is False
+
+    # only this user can write the cache, and a cache others can write to
+    # is not loaded
+    assert os.stat(tmp_path / 'cache').st_mode & 0o777 == 0o700
+    os.chmod(tmp_path / 'cache', 0o777)
+    assert ts.load_config()['digest'] == changed['digest']
+    assert len(builds) == 3
@@ -0,0 +1,125 @@
+import json
+import os
+import sys
+
+import pytest
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT_DIR, 'tests', 'data')
+sys.path.append(ROOT_DIR)
+
+import hcl  # noqa: E402
+import tf2sam as ts  # noqa: E402
+
+
+SUPPORTED = [
+    'a = 1',
+    'a = -1\nb = 1.5\nc = -0.25\nd = 007\ne = true\nf = false',
+    'a = "x"\na = "y"',
+    'resource "t" "n" {}\nresource "t" "m" {}\nresource "u" "n" {}',
+    'resource "t" "n" { a = 1 }\nresource "t" "n" { b = 2 }',
+    'resource "t" "n" {\n  attribute {\n    name = "id"\n  }\n'
+    '  attribute {\n    name = "created"\n  }\n  attribute {}\n}',
+    'a { b "c" "d" { e = 1 } b "c" { f = 2 } }',
+    'a = { b = 1, c = "2", }\nd = {}\ne { }',
+    'a = [1, "x", {b = 1}, ]\nb = []\nc = ["x", "y", {}]\nd = [{}, {}]',
+    'a = "${b.c}"\nb = "${f("q", "r")}"\nc = "$${x}"\nd = "$x"',
+    'a = "${x}}"\nb = "{x}"\nc = "line\nnext"\nd = "#not"',
+    '# c\n// c\n/* c\n*/a = /* c */ 1 # c\nb = 2 // c',
+    'a = <<EOF\n{\n  "k": "${x}"\n}\nEOF\nb = 1',
+    'a = <<EOF\nEOF\nb = <<EOF\nfooEOF\nc = <<EOF\nx\n  EOF\n',
+    'a = <<EOF\nx \\n y\nEOF\nb = [<<X\ny\nX\n, "z"]',
+    '"quoted" = 1\nx-y.z = 2\na = 1, b = 2',
+]
+
+UNSUPPORTED = [
+    '',
+    '# only a comment',
+    '{"resource": {"t": {"n": {}}}}',
+    'a = "x\\"y"',
+    'a = <<-EOF\n\tx\n\tEOF\n',
+    'a = 1 + 2',
+    'a = 1e5',
+    'a = 0x1f',
+    'a = var.x',
+    'a = lookup(var.x, "y")',
+    'a : 1',
+    'a = "${m({})}"',
+]
+
+INVALID = [
+    '  ',
+    'a = ',
+    'a = [1,,]',
+    'a = 1,',
+    'a = <<EOF\nx\n',
+    'trueness = 1',
+    'a = "x',
+    'a = [true]',
+    'a = ["x", 1]',
+    'a = [/* c */ "x\\"y", 1,, /* c */]',
+]
+
+
+def assert_same(text):
+    expected = json.dumps(hcl.loads(text))
+    assert json.dumps(ts.parse_hcl(text)) == expected
+
+
+@pytest.mark.parametrize('text', SUPPORTED)
+def test_parse_hcl_supported(text):
+    assert json.dumps(ts._HclParser(text).parse()) == json.dumps(
+        hcl.loads(text)
+    )
+
+
+@pytest.mark.parametrize('text', UNSUPPORTED)
+def test_parse_hcl_fallback(text):
+    with pytest.raises(ts.HclUnsupported):
+        ts._HclParser(text).parse()
+    assert_same(text)
+
+
+@pytest.mark.parametrize('text', INVALID)
+def test_parse_hcl_invalid(text):
+    with pytest.raises(ValueError):
+        hcl.loads(text)
+    with pytest.raises(ValueError):
+        ts.parse_hcl(text)
+
+
+def test_parse_hcl_fixture():
+    with open(os.path.join(DATA_DIR, 'transform.tf')) as fh:
+        text = fh.read()
+    assert json.dumps(ts._HclParser(text).parse()) == json.dumps(
+        hcl.loads(text)
+    )
+
+
+def test_load_hcl_cache(tmp_path, monkeypatch):
+    file = tmp_path / 'stack.tf'
+    file.write_text('resource "t" "n" {\n  a = 1\n}\n')
+    calls = []
+    parse_hcl = ts.parse_hcl
+    monkeypatch.setattr(
+        ts, 'parse_hcl', lambda text: calls.append(text) or parse_hcl(text)
+    )
+    expected = {'resource': {'t': {'n': {'a': 1}}}}
+    assert ts.load_file(str(file)) == expected
+    assert ts.load_file(str(file)) == expected
+    assert len(calls) == 1
+    assert len(os.listdir(tmp_path / 'cache' / 'hcl')) == 1
+
+    file.write_text('resource "t" "n" {\n  a = 2\n}\n')
+    assert ts.load_file(str(file))['resource']['t']['n']['a'] == 2
+    assert len(calls) == 2
+
+    # parsed documents are cached as json, only loaded from a cache
+    # others can't write to
+    assert all(
+        f.endswith('.json') for f in os.listdir(tmp_path / 'cache' / 'hcl')
+    )
+    os.chmod(tmp_path / 'cache' / 'hcl', 0o777)
+    assert ts.load_file(str(file))['resource']['t']['n']['a'] == 2
+    assert len(calls) == 3
@@ -1,3 +1,4 @@
+import copy
 import json
 import os
 import sys
@@ -106,3 +107,63 @@ def test_relationships():
   }
 }
 ''')
+
+
+def test_relationship_graph():
+    data = ts.load_file(os.path.join(DATA_DIR, 'relationships.tf'))
+    graph = ts.build_relationship_graph(data['resource'])
+    assert graph.related(
+        'aws_api_gateway_rest_api.foo', 'aws_api_gateway_resource'
+    ) == ('foo_bar_resource', 'foo_bar_resource_proxy')
+    assert graph.related(
+        'aws_api_gateway_rest_api.foo', 'aws_lambda_function'
+    ) == ()
+    assert graph.view('aws_api_gateway_rest_api.missing') is None
+    view = graph.view('aws_lambda_function.foo_bar-api')
+    assert dict(view) == {
+        'aws_api_gateway_integration': (
+            'foo_integration_foo_bar_resource_ANY_int',
+        )
+    }
+    node = graph.ids['aws_api_gateway_deployment.foo_bar']
+    assert [graph.names[n] for n in graph.refs[node]] == [
+        'aws_api_gateway_rest_api.foo'
+    ]
+
+
+def test_find_refs():
+    # the scan caches are shared by every test in the process
+    for fn in [ts.scan_refs, ts._resource_refs, ts._sub_plan]:
+        fn.cache_clear()
+    policy = (
+        '{"a": "${aws_sqs_queue.foo.arn}", "b": "${aws_sqs_queue.foo.id}"}'
+    )
+    obj = {'policy': policy, 'list': ['${var.x}', {'arn': policy}]}
+    assert ts.find_refs(obj) == [
+        'aws_sqs_queue.foo', 'var.x', 'aws_sqs_queue.foo'
+    ]
+    stats = ts.ref_scan_cache_stats()
+    # two distinct strings, policy seen twice
+    assert (
+        stats['resource_refs']['misses'], stats['resource_refs']['hits']
+    ) == (2, 1)
+    assert (stats['scan_refs']['misses'], stats['scan_refs']['hits']) == (
+        2, 0
+    )
+
+    # expanding the same strings reuses the scan of policy
+    vars = {}
+    expanded = ts.expand_variables(copy.deepcopy(obj), vars=vars)
+    stats = ts.ref_scan_cache_stats()
+    assert (stats['scan_refs']['misses'], stats['scan_refs']['hits']) == (
+        2, 1
+    )
+    assert (stats['sub_plan']['misses'], stats['sub_plan']['hits']) == (
+        1, 1
+    )
+    for sub in [expanded['policy'], expanded['list'][1]['arn']]:
+        assert sorted(set(
+            ts.strip_ref_attrs(ref) for ref in sub['Fn::Sub'][1]
+        )) == ts.find_refs(policy)
+    assert expanded['list'][0] == {'Ref': 'var.x'}
+    assert list(vars) == ts.find_refs('${var.x}')
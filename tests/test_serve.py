@@ -0,0 +1,150 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT_DIR, 'tests', 'data')
+sys.path.append(ROOT_DIR)
+
+import tf2sam as ts  # noqa: E402
+
+
+def source():
+    with open(os.path.join(DATA_DIR, 'transform.tf')) as fh:
+        return fh.read()
+
+
+def expected_yaml():
+    with open(os.path.join(DATA_DIR, 'transform_expected.yaml')) as fh:
+        return fh.read()
+
+
+def test_transform_request():
+    response = ts.transform_request({'id': 'a', 'source': source()})
+    assert response['id'] == 'a'
+    assert response['ok'] is True
+    assert response['template'] == expected_yaml()
+    assert response['diagnostics'] == []
+    assert sorted(response['ms']) == ['emit', 'parse', 'total', 'transform']
+
+    for (request, message) in [
+        ({'id': 1, 'source': 'a = '}, 'unable to parse source'),
+        ({'id': 2, 'source': 'variable "x" {}'}, 'no resources defined'),
+        ({'id': 3, 'source': source(), 'format': 'xml'}, 'not supported'),
+        ([], 'request must be an object')
+    ]:
+        response = ts.transform_request(request)
+        assert response['ok'] is False
+        assert response['template'] is None
+        assert response['diagnostics'][-1]['level'] == 'fatal'
+        assert message in response['diagnostics'][-1]['message']
+
+
+def test_transform_request_exception(monkeypatch):
+    def _fail(*args, **kwargs):
+        raise OSError('disk full')
+    monkeypatch.setattr(ts, 'write_template', _fail)
+    response = ts.transform_request({'id': 'b', 'source': source()})
+    assert response['id'] == 'b'
+    assert response['ok'] is False
+    assert response['diagnostics'][-1] == {
+        'level': 'exception', 'message': 'OSError: disk full'
+    }
+
+    monkeypatch.setattr(ts, 'transform_request', _fail)
+    response = ts._handle_request('{"id": "c"}')
+    assert response['id'] == 'c'
+    assert response['ok'] is False
+    assert response['diagnostics'][0]['level'] == 'exception'
+
+
+def test_serve_stdio():
+    requests = [{'id': i, 'source': source()} for i in range(3)]
+    out = subprocess.run(
+        [sys.executable, os.path.join(ROOT_DIR, 'tf2sam.py'), 'serve'],
+        input='\n'.join([json.dumps(r) for r in requests] + ['{']) + '\n',
+        capture_output=True, text=True, check=True
+    ).stdout
+    responses = [json.loads(line) for line in out.splitlines()]
+    assert len(responses) == 4
+    assert sorted([
+        r['id'] for r in responses if r['ok'] is True
+    ]) == [0, 1, 2]
+    for r in responses:
+        if r['ok'] is True:
+            assert r['template'] == expected_yaml()
+        else:
+            assert 'invalid json' in r['diagnostics'][0]['message']
+
+
+def test_serve_stdio_stdout(monkeypatch, capsys):
+    stdout = sys.stdout
+    transform_request = ts.transform_request
+    seen = []
+
+    def _request(request):
+        seen.append(sys.stdout is stdout)
+        return transform_request(request)
+
+    monkeypatch.setattr(ts, 'transform_request', _request)
+    monkeypatch.setattr(sys, 'stdin', io.StringIO(''.join([
+        json.dumps({'id': i, 'source': source()}) + '\n' for i in range(2)
+    ])))
+    ts._serve_stdio(jobs=2)
+    # stdout is left alone, responses are its only output
+    assert seen == [True, True]
+    assert sys.stdout is stdout
+    out = capsys.readouterr().out
+    assert sorted(json.loads(line)['id'] for line in out.splitlines()) == [
+        0, 1
+    ]
+
+
+def test_serve_http():
+    server = ts.http_server()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = 'http://%s:%s/' % server.server_address[0:2]
+    try:
+        response = json.loads(urlopen(url, json.dumps({
+            'source': source(), 'format': 'json'
+        }).encode('utf-8')).read())
+        assert response['ok'] is True
+        assert json.loads(response['template'])['Resources']
+        with pytest.raises(HTTPError) as e:
+            urlopen(url, b'{"source": 1}')
+        assert e.value.code == 422
+        assert json.loads(e.value.read())['ok'] is False
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_serve_http_exception(monkeypatch):
+    def _fail(*args, **kwargs):
+        raise OSError('disk full')
+    monkeypatch.setattr(ts, 'write_template', _fail)
+    server = ts.http_server()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = 'http://%s:%s/' % server.server_address[0:2]
+    try:
+        with pytest.raises(HTTPError) as e:
+            urlopen(url, json.dumps({
+                'id': 'd', 'source': source()
+            }).encode('utf-8'))
+        assert e.value.code == 500
+        response = json.loads(e.value.read())
+        assert response['id'] == 'd'
+        assert response['diagnostics'][-1]['level'] == 'exception'
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+import time
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = [
+    'argh', 'cfn_flip', 'dateutil', 'hcl', 'jmespath', 'jsonschema',
+    'mergedeep'
+]
+# cold start budget in milliseconds over a bare interpreter start
+IMPORT_BUDGET_MS = float(os.environ.get('TF2SAM_IMPORT_BUDGET_MS', 150))
+HELP_BUDGET_MS = float(os.environ.get('TF2SAM_HELP_BUDGET_MS', 300))
+
+
+def min_wall_ms(args, runs=5):
+    timings = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            args, cwd=ROOT_DIR, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def test_import_is_lazy():
+    out = subprocess.check_output([
+        sys.executable, '-c',
+        'import sys, tf2sam; print(",".join(sorted(set(['
+        'm.split(".")[0] for m in sys.modules]) & set(%r))))' % (
+            HEAVY_MODULES
+        )
+    ], cwd=ROOT_DIR)
+    assert out.decode('utf-8').strip() == ''
+
+
+def test_cold_start_budget():
+    baseline = min_wall_ms([sys.executable, '-c', 'pass'])
+    import_ms = min_wall_ms([sys.executable, '-c', 'import tf2sam'])
+    help_ms = min_wall_ms([sys.executable, 'tf2sam.py', '--help'])
+    print('interpreter %.1fms, import +%.1fms, --help +%.1fms' % (
+        baseline, import_ms - baseline, help_ms - baseline
+    ))
+    assert import_ms - baseline < IMPORT_BUDGET_MS
+    assert help_ms - baseline < HELP_BUDGET_MS
@@ -0,0 +1,110 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT_DIR, 'tests', 'data')
+sys.path.append(ROOT_DIR)
+
+import tf2sam as ts  # noqa: E402
+
+
+DOC = {
+    'skip': {'a': ['}', '{', '\\"]', {'b': '"[{'}], 'c': [[], {}]},
+    'items': [
+        {'name': 'café \\u00e9 "x"', 'n': [1, -2.5e3, True, None]},
+        12345678901234567890,
+        '\U0001f600',
+        {}
+    ],
+    'nested': {'items': [{'x': 1}, {'y': []}]},
+    'after': 'x' * 40
+}
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 1 << 20])
+def test_json_stream(monkeypatch, chunk_size):
+    monkeypatch.setattr(ts.JsonStream, 'CHUNK_SIZE', chunk_size)
+    for text in [json.dumps(DOC), json.dumps(DOC, indent=2)]:
+        actual = list(ts.JsonStream(io.StringIO(text), lambda path: (
+            ts._match_path(path, (('nested',), 'items', '#'))
+        )))
+        assert actual == [
+            (('items', i), v) for i, v in enumerate(DOC['items'])
+        ] + [
+            (('nested', 'items', i), v)
+            for i, v in enumerate(DOC['nested']['items'])
+        ]
+
+
+@pytest.mark.parametrize('text', [
+    '', '{', '{"items": [1, 2}', '{"items": [1] "x": 1}', '{"a": 1} 2',
+    '{"skip": [1, 2}'
+])
+def test_json_stream_invalid(text):
+    with pytest.raises(ValueError):
+        list(ts.JsonStream(io.StringIO(text), lambda path: (
+            ts._match_path(path, ('items', '#'))
+        )))
+
+
+def test_load_state():
+    resources = ts.load_state(os.path.join(DATA_DIR, 'state.tfstate'))[
+        'resource'
+    ]
+    # data sources and computed attributes are dropped
+    assert 'aws_caller_identity' not in resources
+    function = resources['aws_lambda_function']['foo_worker']
+    for attr in ['arn', 'id', 'invoke_arn', 'dead_letter_config', 'tags']:
+        assert attr not in function
+    # single blocks are unwrapped
+    assert function['tracing_config'] == {'mode': 'PassThrough'}
+    # resolved values of dependencies become references
+    assert function['role'] == '${aws_iam_role.foo_lambda.arn}'
+    assert function['environment']['variables'] == {
+        'QUEUE_URL': '${aws_sqs_queue.jobs_queue.id}'
+    }
+    assert function['depends_on'] == ['aws_iam_role_policy.foo_lambda_policy']
+    assert '"Resource":"${aws_sqs_queue.jobs_queue.arn}"' in resources[
+        'aws_iam_role_policy'
+    ]['foo_lambda_policy']['policy']
+    assert resources['aws_lambda_event_source_mapping']['foo_worker'] == {
+        'batch_size': 10,
+        'enabled': True,
+        'event_source_arn': '${aws_sqs_queue.jobs_queue.arn}',
+        'function_name': 'foo_worker'
+    }
+    assert list(resources['aws_cloudwatch_log_group']) == ['foo_worker_0']
+
+
+def test_load_plan():
+    resources = ts.load_state(os.path.join(DATA_DIR, 'plan.json'))[
+        'resource'
+    ]
+    assert resources['aws_sqs_queue']['jobs_queue']['name'] == 'foo-queue'
+    function = resources['aws_lambda_function']['foo_worker']
+    assert function['role'] == '${aws_iam_role.foo_lambda.arn}'
+    assert function['depends_on'] == ['aws_iam_role.foo_lambda']
+    assert function['environment'] == {'variables': {'STAGE': 'dev'}}
+    # unknown values are set from module outputs and resource references
+    mapping = resources['aws_lambda_event_source_mapping']['foo_worker']
+    assert mapping['event_source_arn'] == '${aws_sqs_queue.jobs_queue.arn}'
+    assert mapping['function_name'] == 'foo_worker'
+
+
+@pytest.mark.parametrize('file', ['state.tfstate', 'plan.json'])
+def test_transform_state(file):
+    actual = ts.transform_file(os.path.join(DATA_DIR, file), print_yaml=True)
+    assert (
+        '      Events:\n'
+        '        FooWorker:\n'
+        '          Type: SQS\n'
+        '          Properties:\n'
+        '            BatchSize: 10\n'
+        '            Queue: !Ref \'JobsQueueSQSQueue\'\n'
+    ) in actual
+    assert 'LambdaEventSourceMapping' not in actual
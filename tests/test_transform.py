@@ -0,0 +1,702 @@
+import copy
+import os
+import shutil
+import sys
+
+import pytest
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT_DIR, 'tests', 'data')
+sys.path.append(ROOT_DIR)
+
+import tf2sam as ts  # noqa: E402
+
+
+def expected_yaml():
+    with open(os.path.join(DATA_DIR, 'transform_expected.yaml')) as fh:
+        return fh.read()
+
+
+def test_transform_file():
+    actual = ts.transform_file(
+        os.path.join(DATA_DIR, 'transform.tf'), print_yaml=True
+    )
+    assert actual == expected_yaml()
+    # options are TransformOptions fields
+    with pytest.raises(TypeError):
+        ts.transform_file(
+            os.path.join(DATA_DIR, 'transform.tf'), print_yml=True
+        )
+
+
+def test_transform_many(tmp_path, capsys):
+    for d in ['a', 'b', os.path.join('b', 'c')]:
+        os.makedirs(tmp_path / d)
+        shutil.copy(
+            os.path.join(DATA_DIR, 'transform.tf'),
+            tmp_path / d / 'stack.tf'
+        )
+    ts.transform([str(tmp_path / 'a'), str(tmp_path / 'b')], jobs=2)
+    out = capsys.readouterr().out
+    for d in ['a', 'b', os.path.join('b', 'c')]:
+        target = tmp_path / d / 'stack.yaml'
+        assert 'written %s' % target in out
+        assert target.read_text() == expected_yaml()
+
+
+def test_emit_template():
+    import io
+    import json
+    from cfn_flip import to_yaml
+    shared = {'Ref': 'Stage'}
+    template = ts.build_template(
+        ts.load_file(os.path.join(DATA_DIR, 'transform.tf'))
+    )
+    template['Resources']['Machine'] = {
+        'Type': 'AWS::StepFunctions::StateMachine',
+        'Properties': {
+            'DefinitionString': {'StartAt': 'A', 'States': {}},
+            'Tags': ({'Key': 'stage', 'Value': shared}, 1, True),
+            'Extra': {1: shared, None: '0123', 'long': 'x' * 250}
+        }
+    }
+    # written directly rather than by the cfn_flip dumper
+    plain = {
+        'Type': 'AWS::IAM::Role',
+        'Properties': {
+            'Policy': json.dumps({'a': list(range(10))}, indent=2),
+            'Script': 'echo a\n\n  echo b\n' + 'x\n' * 9,
+            'Quoted': ['yes', '0123', '', 'a: b', "it's", 'null', '1.5'],
+            'Words': ' '.join(['word'] * 35),
+            'Empty': [{}, [], {'Ref': 'AWS::Region'}],
+            'Nested': [[1, [True, None]], {'Fn::GetAtt': ['A', 'Arn']}],
+            'Join': {'Fn::Join': ['', [{'Ref': 'A'}, {'k': 'v'}]]},
+            'k' * 122: 'long key'
+        }
+    }
+    template['Resources']['Plain'] = plain
+    assert ts._emit_yaml('Plain', plain, 2) is not None
+    for fmt, expected in [
+        ('yaml', to_yaml(json.dumps(template))),
+        ('json', json.dumps(template, indent=4))
+    ]:
+        fh = io.StringIO()
+        ts.emit_template(template, fh, fmt)
+        assert fh.getvalue() == expected
+    assert isinstance(
+        template['Resources']['Machine']['Properties']['DefinitionString'],
+        dict
+    )
+
+
+def test_expand_files(tmp_path):
+    for f in ['a.tf', 'b.tf', 'c.yaml', os.path.join('d', 'e.tf')]:
+        os.makedirs(os.path.dirname(tmp_path / f), exist_ok=True)
+        (tmp_path / f).write_text('')
+    assert ts._expand_files([
+        str(tmp_path / '*.tf'), str(tmp_path)
+    ]) == [
+        str(tmp_path / 'a.tf'),
+        str(tmp_path / 'b.tf'),
+        str(tmp_path / 'd' / 'e.tf')
+    ]
+
+    # json matched by a glob is only state or plan json, other than
+    # terraform json configuration
+    shutil.copy(os.path.join(DATA_DIR, 'plan.json'), tmp_path / 'plan.json')
+    (tmp_path / 'package.json').write_text('{"version": "1.0.0"}')
+    (tmp_path / 'f.tf.json').write_text(
+        '{"resource": {"aws_sqs_queue": {"q": {"name": "q"}}}}'
+    )
+    assert ts._expand_files([str(tmp_path / '*')]) == [
+        str(tmp_path / 'a.tf'),
+        str(tmp_path / 'b.tf'),
+        str(tmp_path / 'f.tf.json'),
+        str(tmp_path / 'plan.json')
+    ]
+    assert ts.is_state_file(os.path.join(DATA_DIR, 'state.tfstate'))
+    assert not ts.is_state_file(str(tmp_path / 'f.tf.json'))
+    with pytest.raises(SystemExit):
+        ts._expand_files([str(tmp_path / 'package.json')])
+    assert ts.transform_file(str(tmp_path / 'f.tf.json')) == str(
+        tmp_path / 'f.yaml'
+    )
+
+
+def test_jq_cache():
+    misses = ts.jq_stats['misses']
+    hits = ts.jq_stats['hits']
+    query = "re_sub('([^_]+)_(.*)', '\\2', name)"
+    assert ts.jq(query, {'name': 'foo_bar'}) == 'bar'
+    assert ts.jq(query, {'name': 'foo_baz'}) == 'baz'
+    assert ts.jq_stats['misses'] == misses + 1
+    assert ts.jq_stats['hits'] == hits + 1
+
+
+def test_transform_type_name_cache():
+    stats = ts.type_name_cache_stats()['transform_type_name']
+    expected = ('AWS::Serverless::Function', 'FooBarServerlessFunction')
+    assert ts.transform_type_name('aws_lambda_function.foo_bar') == expected
+    assert ts.transform_type_name(
+        '${aws_lambda_function.foo_bar.arn}'
+    ) is ts.transform_type_name('aws_lambda_function.foo_bar')
+    actual = ts.type_name_cache_stats()['transform_type_name']
+    assert actual['hits'] + actual['misses'] == (
+        stats['hits'] + stats['misses'] + 3
+    )
+    assert actual['hits'] >= stats['hits'] + 2
+
+
+def test_api_int_path():
+    data = ts.load_file(os.path.join(DATA_DIR, 'transform.tf'))
+    all_resources = data['resource']
+    integration = all_resources['aws_api_gateway_integration'][
+        'foo_items_any_int'
+    ]
+    expected = ('/v1/items/{proxy+}', [
+        'FooV1ItemsProxyApiGatewayResource',
+        'FooV1ItemsApiGatewayResource',
+        'FooV1ApiGatewayResource'
+    ])
+    assert ts._get_api_int_path(integration, all_resources) == expected
+    # parents are memoized from the first lookup
+    assert ts.run_cache(all_resources).api_paths[
+        'aws_api_gateway_resource.foo_v1'
+    ] == (('v1', 'FooV1ApiGatewayResource'),)
+    assert ts._get_api_int_path(integration, all_resources) == expected
+
+
+def test_incremental_cache():
+    cache = ts.TransformCache()
+    file = os.path.join(DATA_DIR, 'transform.tf')
+    expected = ts.build_template(ts.load_file(file), cache=cache)
+    total = cache.misses
+    assert cache.hits == 0
+    cache.prune()
+
+    assert ts.build_template(ts.load_file(file), cache=cache) == expected
+    assert (cache.hits, cache.misses) == (total, total)
+    cache.prune()
+
+    # only the changed queue and resources related to it miss
+    data = ts.load_file(file)
+    data['resource']['aws_sqs_queue']['foo_queue']['delay_seconds'] = 5
+    actual = ts.build_template(data, cache=cache)
+    assert actual['Resources']['FooQueueSQSQueue']['Properties'][
+        'DelaySeconds'
+    ] == 5
+    assert cache.misses - total == 3
+
+
+def test_incremental_timestamp(monkeypatch):
+    monkeypatch.delenv('SOURCE_DATE_EPOCH', raising=False)
+    source = {'aws_kms_alias': {'a': {
+        'name_prefix': 'alias/a-', 'target_key_id': 'k'
+    }}}
+
+    def _alias_name(template):
+        return template['Resources']['AKMSAlias']['Properties']['AliasName']
+    template = ts.build_template(
+        {'resource': copy.deepcopy(source)}, cache=ts.TransformCache()
+    )
+    assert _alias_name(template) == 'alias/a-19700101000000000000'
+    # the fixed timestamp is only for the cached run
+    assert ts.timestamp_now() != ts.fixed_timestamp()
+    assert _alias_name(ts.transform_source(source).template) != (
+        'alias/a-19700101000000000000'
+    )
+
+
+def test_watcher(tmp_path, monkeypatch, capsys):
+    file = tmp_path / 'stack.tf'
+    shutil.copy(os.path.join(DATA_DIR, 'transform.tf'), file)
+    watcher = ts.Watcher([str(tmp_path)])
+    [(_file, target, changed, total, ms)] = watcher.poll()
+    assert target == str(tmp_path / 'stack.yaml')
+    assert changed == total
+    assert (tmp_path / 'stack.yaml').read_text() == expected_yaml()
+    assert watcher.poll() == []
+
+    file.write_text(file.read_text().replace('retention_in_days = 14', (
+        'retention_in_days = 30'
+    )))
+    # the log group and the function it references
+    [(_file, target, changed, total, ms)] = watcher.poll()
+    assert changed == 2
+    assert 'RetentionInDays: 30' in (tmp_path / 'stack.yaml').read_text()
+
+    # unexpected errors fail the file without stopping the watch
+    write_template = ts.write_template
+
+    def _fail(*args, **kwargs):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(ts, 'write_template', _fail)
+    file.write_text(file.read_text() + '\n')
+    [(_file, target, changed, total, ms)] = watcher.poll()
+    assert target is None
+    assert 'OSError: disk full' in capsys.readouterr().out
+    monkeypatch.setattr(ts, 'write_template', write_template)
+    file.write_text(file.read_text() + '\n')
+    [(_file, target, changed, total, ms)] = watcher.poll()
+    assert target == str(tmp_path / 'stack.yaml')
+    # the fixed timestamp is only for the cached run
+    assert ts.timestamp_now() != ts.fixed_timestamp()
+
+    # config changes are reported like any other message
+    watcher.config_manifest = {}
+    with ts.capture_diagnostics() as diagnostics:
+        [(_file, target, changed, total, ms)] = watcher.poll()
+    assert diagnostics[0] == {
+        'level': 'info', 'message': 'config changed, reloading'
+    }
+    assert changed == total
+
+
+def test_run_stats():
+    stats = ts.start_stats()
+    try:
+        actual = ts.transform_file(
+            os.path.join(DATA_DIR, 'transform.tf'), print_yaml=True
+        )
+    finally:
+        assert ts.stop_stats() is stats
+    assert actual == expected_yaml()
+    assert list(sorted(stats.phases)) == sorted(ts.PROFILE_PHASES)
+    assert stats.phases['parse']['calls'] == 1
+    assert stats.types['aws_lambda_function']['resources'] == 2
+    assert stats.files == 1
+    for k in ['jq', 'path_update', 'deepcopy', 'deepcopy_objects']:
+        assert stats.counters[k] > 0
+    d = stats.to_dict()
+    total = ts.RunStats()
+    total.merge(d)
+    total.merge(d)
+    assert total.files == 2
+    assert total.counters['jq'] == stats.counters['jq'] * 2
+    assert total.types['aws_lambda_function']['resources'] == 4
+
+
+def test_load_root():
+    data = ts.load_root(os.path.join(DATA_DIR, 'root'))
+    resources = data['resource']
+    # module resources are prefixed with the module name
+    assert resources['aws_sqs_queue'] == {'jobs_queue': {
+        'name': 'shop-jobs',
+        'visibility_timeout_seconds': 60,
+        'message_retention_seconds': 86400
+    }}
+    worker = resources['aws_lambda_function']['jobs_worker']
+    assert worker['role'] == '${aws_iam_role.lambda.arn}'
+    assert worker['depends_on'] == ['aws_sqs_queue.jobs_queue']
+    assert resources['aws_lambda_event_source_mapping']['jobs_worker'][
+        'function_name'
+    ] == 'jobs_worker'
+    api = resources['aws_lambda_function']['api']
+    assert api['function_name'] == 'shop-api'
+    assert api['environment']['variables'] == {
+        'QUEUE_URL': '${aws_sqs_queue.jobs_queue.id}',
+        'STAGE': '${var.stage}'
+    }
+
+
+def test_transform_root(tmp_path, monkeypatch, capsys):
+    root = tmp_path / 'root'
+    shutil.copytree(os.path.join(DATA_DIR, 'root'), root)
+    expected = ts.transform_root(str(root), print_yaml=True)
+    assert 'QUEUE_URL: !Ref \'JobsQueueSQSQueue\'' in expected
+    assert 'Queue: !Ref \'JobsQueueSQSQueue\'' in expected
+
+    # parse files in worker processes regardless of size
+    monkeypatch.setattr(ts, 'ROOT_PARALLEL_MIN_BYTES', 0)
+    ts.transform([str(root)], jobs=2, root=True)
+    assert 'written %s' % (root / 'template.yaml') in capsys.readouterr().out
+    assert (root / 'template.yaml').read_text() == expected
+
+
+def test_transform_source(capsys):
+    source = {'aws_sqs_queue': {'q': {'name': 'q'}}}
+    result = ts.transform_source(source)
+    assert result.template['Resources'] == {'QSQSQueue': {
+        'Type': 'AWS::SQS::Queue', 'Properties': {'QueueName': 'q'}
+    }}
+    assert result.diagnostics == []
+    # the source is not modified
+    assert source == {'aws_sqs_queue': {'q': {'name': 'q'}}}
+    text = open(os.path.join(DATA_DIR, 'transform.tf')).read()
+    assert ts.transform_source(text).template == ts.build_template(
+        ts.parse_hcl(text)
+    )
+    capsys.readouterr()
+
+    result = ts.transform_source('''
+resource "aws_lambda_function" "a" {
+  function_name = "foo_a"
+  handler = "index.handler"
+}
+resource "aws_lambda_function" "b" {
+  function_name = ["foo_b"]
+  handler = "index.handler"
+}
+''')
+    assert result.template is None
+    assert [
+        (d['level'], d.get('address')) for d in result.diagnostics
+    ] == [('error', 'aws_lambda_function.b'), ('fatal', None)]
+    assert result.diagnostics[-1]['message'] == (
+        '1 resource(s) failed to transform'
+    )
+    [diagnostic] = ts.transform_source('resource "x" {').diagnostics
+    assert diagnostic['level'] == 'fatal'
+    assert diagnostic['message'].startswith('unable to parse source')
+    # nothing is printed and the process does not exit
+    assert capsys.readouterr() == ('', '')
+
+    # tracebacks are not printed while diagnostics are captured
+    with ts.capture_diagnostics() as diagnostics:
+        with pytest.raises(ts.Tf2SamError):
+            ts.jq('json_to_obj(@)', '{')
+        with pytest.raises(ts.Tf2SamError):
+            ts.validate_schema([], 'state.yaml')
+    assert [d['level'] for d in diagnostics] == [
+        'error', 'fatal', 'error', 'fatal'
+    ]
+    assert 'json_to_obj' in diagnostics[0]['message']
+    assert diagnostics[-1]['message'] == '1 error(s)'
+    assert capsys.readouterr() == ('', '')
+
+
+def test_partition_template(tmp_path, capsys):
+    resources = {'Role': {'Type': 'AWS::IAM::Role'}}
+    for i in range(5):
+        resources['Fn%s' % i] = {
+            'Type': 'AWS::Serverless::Function',
+            'Properties': {
+                'Role': {'Fn::GetAtt': ['Role', 'Arn']},
+                'Environment': {'Variables': {
+                    'STAGE': {'Ref': 'var.stage'},
+                    'PREVIOUS': {'Ref': 'Fn%s' % (i - 1)} if i > 0 else ''
+                }}
+            }
+        }
+    resources['Fn4']['DependsOn'] = ['Role', 'Queue']
+    resources['Queue'] = {'Type': 'AWS::SQS::Queue'}
+    template = dict(ts.config('template'))
+    template['Parameters'] = {'var.stage': {'Type': 'String'}}
+    template['Resources'] = resources
+    assert ts.partition_template(template, 7) == (template, [])
+
+    (parent, stacks) = ts.partition_template(template, 3)
+    assert [list(s.template['Resources']) for s in stacks] == [
+        ['Role', 'Fn0', 'Fn1'], ['Fn2', 'Fn3', 'Queue'], ['Fn4']
+    ]
+    assert parent['Parameters'] == template['Parameters']
+    assert parent['Resources']['Stack3'] == {
+        'Type': 'AWS::Serverless::Application',
+        'Properties': {
+            'Location': 'stack3.yaml',
+            'Parameters': {
+                'Fn3': {'Fn::GetAtt': ['Stack2', 'Outputs.Fn3']},
+                'RoleArn': {'Fn::GetAtt': ['Stack1', 'Outputs.RoleArn']},
+                'var.stage': {'Ref': 'var.stage'}
+            }
+        }
+    }
+    assert stacks[0].template['Outputs'] == {
+        'RoleArn': {'Value': {'Fn::GetAtt': ['Role', 'Arn']}},
+        'Fn1': {'Value': {'Ref': 'Fn1'}}
+    }
+    fn4 = stacks[2].template['Resources']['Fn4']
+    assert fn4['Properties']['Role'] == {'Ref': 'RoleArn'}
+    assert 'DependsOn' not in fn4
+    # the caller's template is not modified
+    assert resources['Fn4']['Properties']['Role'] == {
+        'Fn::GetAtt': ['Role', 'Arn']
+    }
+    # every reference is to a resource or parameter of the same stack
+    for stack in stacks:
+        names = set(stack.template['Resources']) | set(
+            stack.template.get('Parameters', {})
+        )
+        assert set(ref for (ref, _) in ts.template_refs(
+            stack.template['Resources']
+        )) <= names
+
+    file = tmp_path / 'main.tf'
+    target = ts.write_template(template, str(file), max_resources=3)
+    assert target == str(tmp_path / 'main.yaml')
+    assert 'Location: main.stack1.yaml' in (tmp_path / 'main.yaml').read_text()
+    assert (tmp_path / 'main.stack3.yaml').read_text() == (
+        ts.write_template(stacks[2].template, str(file), print_yaml=True)
+    )
+    err = capsys.readouterr().err
+    assert 'Stack2: 3 resources, 3 parameters, 1 outputs, ' in err
+
+    # depends on across stacks becomes depends on between stacks
+    (parent, stacks) = ts.partition_template({'Resources': {
+        'A': {'Type': 'AWS::SQS::Queue'},
+        'B': {'Type': 'AWS::SQS::Queue', 'DependsOn': 'A'}
+    }}, 1)
+    assert parent['Resources']['Stack2']['DependsOn'] == ['Stack1']
+    assert stacks[1].template['Resources'] == {
+        'B': {'Type': 'AWS::SQS::Queue'}
+    }
+
+    # a function is in the same stack as the api of its events
+    (parent, stacks) = ts.partition_template({'Resources': {
+        'Api': {'Type': 'AWS::Serverless::Api'},
+        'Queue': {'Type': 'AWS::SQS::Queue'},
+        'Fn': {'Type': 'AWS::Serverless::Function', 'Properties': {
+            'Environment': {'Variables': {'QUEUE': {'Ref': 'Queue'}}},
+            'Events': {'Get': {'Type': 'Api', 'Properties': {
+                'RestApiId': {'Ref': 'Api'}, 'Path': '/', 'Method': 'get'
+            }}}
+        }}
+    }}, 2)
+    assert [list(s.template['Resources']) for s in stacks] == [
+        ['Queue'], ['Api', 'Fn']
+    ]
+    assert stacks[1].template['Parameters'] == {'Queue': {'Type': 'String'}}
+    assert stacks[1].template['Resources']['Fn']['Properties']['Events'][
+        'Get'
+    ]['Properties']['RestApiId'] == {'Ref': 'Api'}
+
+
+def test_transform_shards(monkeypatch):
+    expected = ts.transform_file(
+        os.path.join(DATA_DIR, 'transform.tf'), print_yaml=True
+    )
+    # fork workers for every type that can be sharded
+    monkeypatch.setattr(ts, 'SHARD_MIN_RESOURCES', 0)
+    forked = []
+    transform_shards = ts._transform_shards
+    monkeypatch.setattr(ts, '_transform_shards', lambda *args: (
+        forked.append(args[0]) or transform_shards(*args)
+    ))
+    stats = ts.start_stats()
+    try:
+        actual = ts.transform_file(
+            os.path.join(DATA_DIR, 'transform.tf'), print_yaml=True,
+            shards=2
+        )
+    finally:
+        ts.stop_stats()
+    assert actual == expected
+    assert 'aws_lambda_function' in forked
+    # worker stats are added to the run stats
+    assert stats.types['aws_lambda_function']['resources'] == 2
+    assert stats.counters['jq'] > 0
+
+
+def test_reduce_dependencies(capsys):
+    template = {'Resources': {
+        'A': {'Type': 'AWS::SQS::Queue'},
+        'B': {'Type': 'AWS::SQS::Queue', 'Properties': {'X': {'Ref': 'A'}}},
+        'C': {'Type': 'AWS::SQS::Queue', 'DependsOn': ['A', 'B', 'B', 'Z']},
+        'D': {
+            'Type': 'AWS::SQS::Queue',
+            'Properties': {'X': {'Fn::Sub': 'arn:${C.Arn}:${AWS::Region}'}},
+            'DependsOn': 'C'
+        },
+        'E': {'Type': 'AWS::SQS::Queue', 'DependsOn': 'A'}
+    }}
+    report = ts.reduce_dependencies(template)
+    resources = template['Resources']
+    assert resources['C']['DependsOn'] == ['B', 'Z']
+    assert 'DependsOn' not in resources['D']
+    assert resources['E']['DependsOn'] == 'A'
+    assert report == ts.DependencyReport(
+        3, 3, [['A'], ['B', 'E'], ['C'], ['D']], ['A', 'B', 'C', 'D']
+    )
+    ts.print_dependency_report(report)
+    assert capsys.readouterr().err == (
+        'DependsOn: 3 removed, 3 left\n'
+        'deploy waves: 4 (1, 2, 1, 1 resources)\n'
+        'critical path: A -> B -> C -> D\n'
+    )
+
+    resources['A']['DependsOn'] = 'D'
+    assert ts.reduce_dependencies(template) is None
+    assert resources['C']['DependsOn'] == ['B', 'Z']
+    assert 'resources depend on each other' in capsys.readouterr().out
+
+
+def test_merge_index(monkeypatch):
+    source = '''
+resource "aws_sqs_queue" "jobs" {
+  name = "jobs"
+}
+resource "aws_lambda_function" "a" {
+  function_name = "foo_a"
+  handler = "index.handler"
+}
+resource "aws_lambda_function" "b" {
+  function_name = "foo_b"
+  handler = "index.handler"
+}
+resource "aws_lambda_event_source_mapping" "jobs" {
+  batch_size = 10
+  event_source_arn = "${aws_sqs_queue.jobs.arn}"
+  function_name = "a"
+  description = "${aws_lambda_function.b.function_name}"
+}
+'''
+
+    def _transform():
+        stats = ts.start_stats()
+        try:
+            return (ts.build_template(ts.parse_hcl(source)), stats)
+        finally:
+            ts.stop_stats()
+
+    (template, stats) = _transform()
+    resources = template['Resources']
+    events = [
+        resources['%sServerlessFunction' % f]['Properties']['Events']
+        for f in ['A', 'B']
+    ]
+    assert events[0] == events[1] == {'Jobs': {
+        'Type': 'SQS',
+        'Properties': {'BatchSize': 10, 'Queue': {'Ref': 'JobsSQSQueue'}}
+    }}
+    assert events[0]['Jobs'] is not events[1]['Jobs']
+
+    # without the index the rule's filter and transform run per function
+    monkeypatch.setattr(ts.RunCache, 'merge_index', lambda *args: {})
+    (unindexed, unindexed_stats) = _transform()
+    assert unindexed == template
+    assert stats.counters['jq'] < unindexed_stats.counters['jq']
+
+
+def test_merge_index_invalidate():
+    cache = ts.RunCache({})
+    index = cache.merge_index(
+        'aws_lambda_function', 'Events:sqs', 'aws_lambda_event_source_mapping'
+    )
+    index['jobs'] = [{}, [], 1]
+    cache.invalidate('aws_lambda_function')
+    assert cache.merge_index(
+        'aws_lambda_function', 'Events:sqs', 'aws_lambda_event_source_mapping'
+    ) is index
+    cache.invalidate('aws_lambda_event_source_mapping')
+    assert cache.merge_index(
+        'aws_lambda_function', 'Events:sqs', 'aws_lambda_event_source_mapping'
+    ) == {}
+
+
+def test_add_rule_view():
+    statements = [
+        {'Resource': '${var.topic_arn}'}, {'Action': ['sns:Publish']}
+    ]
+    d = {'name': 'foo-topic', 'policy': {'Statement': statements}}
+    stats = ts.start_stats()
+    try:
+        [(resources, merged, errors, vars)] = ts.transform_resources(
+            'aws_sns_topic', [('foo', d, None)]
+        )
+    finally:
+        ts.stop_stats()
+    properties = resources['FooSNSTopicTopicPolicy']['Properties']
+    assert properties == {
+        'PolicyDocument': {'Statement': [
+            {'Resource': {'Ref': 'var.topic_arn'}}, {'Action': ['sns:Publish']}
+        ]},
+        'Topics': [{'Ref': 'FooSNSTopic'}]
+    }
+    assert vars == {'var.topic_arn': True}
+    # the resource isn't copied or modified, only containers with variables
+    # are copied when expanded
+    assert stats.counters['deepcopy'] == 0
+    assert d['policy']['Statement'] is statements
+    assert statements[0] == {'Resource': '${var.topic_arn}'}
+    assert properties['PolicyDocument']['Statement'][1] is statements[1]
+
+
+def test_transform_plan(monkeypatch):
+    plan = ts.get_transform_plan('aws_kms_key')
+    # compiled once per type, until config is reset
+    assert ts.get_transform_plan('aws_kms_key') is plan
+    ts.reset_config()
+    assert ts.get_transform_plan('aws_kms_key') is not plan
+
+    # defaults are set on the source resources before they're transformed
+    plan = ts.get_transform_plan('aws_kms_key')._replace(default=[
+        (ts.parse_path('Aliases'), {'Names': ['a']})
+    ])
+    monkeypatch.setitem(ts._plans, 'aws_kms_key', plan)
+    ds = [{'description': name} for name in ['a', 'b', 'c']]
+    results = ts.transform_resources('aws_kms_key', [
+        (name, d, None) for name, d in zip(['a', 'b'], ds)
+    ]) + [ts.transform_resource('aws_kms_key', 'c', ds[2])]
+    for result in results:
+        [properties] = [r['Properties'] for r in result[0].values()]
+        assert properties['Aliases'] == {'Names': ['a']}
+    # every resource gets its own copy of the default
+    ds[0]['Aliases']['Names'].append('b')
+    assert [d['Aliases'] for d in ds[1:]] == [{'Names': ['a']}] * 2
+    assert plan.default[0][1] == {'Names': ['a']}
+
+
+def test_add_rule_expand_array(monkeypatch):
+    plan = ts.get_transform_plan('aws_sns_topic')
+    monkeypatch.setitem(ts._plans, 'aws_sns_topic', plan._replace(add=[(
+        {'type': 'AWS::EC2::SecurityGroup'},
+        None,
+        ts.compile_jq("concat(__target_name__, 'Group')"),
+        ts.compile_jq(
+            "{SecurityGroupIngress: expand_array('cidr_blocks', ingress)}"
+        )
+    )]))
+    ingress = [{'cidr_blocks': ['10.0.0.0/8', '172.16.0.0/12'], 'port': 1}]
+    d = {'name': 'foo-topic', 'ingress': ingress}
+    [(resources, _, _, _)] = ts.transform_resources(
+        'aws_sns_topic', [('foo', d, None)]
+    )
+    assert resources['FooSNSTopicGroup']['Properties'] == {
+        'SecurityGroupIngress': [
+            {'cidr_blocks': '10.0.0.0/8', 'port': 1},
+            {'cidr_blocks': '172.16.0.0/12', 'port': 1}
+        ]
+    }
+    # the add rule reads the source, which is not modified
+    assert d['ingress'] is ingress
+    assert ingress == [
+        {'cidr_blocks': ['10.0.0.0/8', '172.16.0.0/12'], 'port': 1}
+    ]
+
+
+def test_lint(tmp_path, capsys):
+    pytest.importorskip('cfnlint')
+    import json
+    data = ts.load_file(os.path.join(DATA_DIR, 'transform.tf'))
+    template = ts.build_template(data)
+    expected = json.dumps(template)
+    diagnostics = ts.lint_template(
+        template, ts.template_addresses(data['resource'])
+    )
+    assert json.dumps(template) == expected
+    addresses = {(d['rule'], d.get('address')) for d in diagnostics}
+    # resources generated by the SAM transform map to their function
+    assert ('E3008', 'aws_lambda_function.foo_worker') in addresses
+    assert ('E2003', 'var.stage') in addresses
+    assert ('W2001', 'var.region') in addresses
+    assert {
+        'level': 'error',
+        'rule': 'E1010',
+        'message': 'Invalid GetAtt FooTableDynamoDBTable.Name for resource '
+        'FooApiServerlessFunction',
+        'path': 'Resources/FooApiServerlessFunction/Properties/Environment/'
+        'Variables/TABLE_NAME/Fn::GetAtt',
+        'address': 'aws_lambda_function.foo_api'
+    } in diagnostics
+
+    file = tmp_path / 'stack.tf'
+    shutil.copy(os.path.join(DATA_DIR, 'transform.tf'), file)
+    with pytest.raises(SystemExit):
+        ts.transform([str(file)], lint=True)
+    # the template is still written
+    assert (tmp_path / 'stack.yaml').read_text() == expected_yaml()
+    out = capsys.readouterr().out
+    assert '[E3005] aws_lambda_function.foo_worker: ' in out
+    assert 'cfn-lint error(s) in %s' % file in out
@@ -1,30 +1,42 @@
 #!/usr/bin/env python3
-import argh
-from argh import aliases
-from argh import arg
-from cfn_flip import to_json
-from cfn_flip import to_yaml
+# heavy dependencies (argh, cfn_flip, dateutil, hcl, jmespath, jsonschema,
+# mergedeep) are imported where used to keep cli startup fast
+from array import array
 from collections import namedtuple
+from collections.abc import Mapping
 from copy import deepcopy
 import csv
 from datetime import datetime
-from dateutil import tz
-import hcl
+from functools import lru_cache
+import glob
+import hashlib
+import heapq
 import humps
-import jmespath
+import io
 import json
-import jsonschema
-from jsonschema.exceptions import ErrorTree
 import os
-import mergedeep
+import pickle
 import re
 import sys
+import threading
+import time
 from traceback import print_exc
 
 
-ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 global config
 _config = None
+_config_digest = None
+_validators = {}
+CONFIG_SNAPSHOT_VERSION = 1
+INCREMENTAL_CACHE_VERSION = 1
+_plans = {}
+_deterministic_timestamp = None
+_jmespath_options = None
+_jq_cache = {}
+_local = threading.local()
+API_PATH_MAX_DEPTH = 50
+jq_stats = {'hits': 0, 'misses': 0}
 REF_PATTERN = re.compile('[$]{[^}]+}')
 
 
@@ -35,106 +47,228 @@ color = namedtuple('color', 'red green yellow blue bold endc none')(*[
 ])
 
 
+@lru_cache(maxsize=256)
+def _regex(pattern):
+    return re.compile(pattern)
+
+
 def add_utc_tz(x):
+    from dateutil import tz
     return x.replace(tzinfo=tz.gettz("UTC"))
 
 
-# custom jmespath functions
-class CustomFunctions(jmespath.functions.Functions):
-    # regex substitution
-    @jmespath.functions.signature(
-        {'types': ['string']}, {'types': ['string']}, {'types': ['string']}
-    )
-    def _func_re_sub(self, pattern, repl, string):
-        """regular expression substitution
+def set_deterministic(deterministic=True):
+    """use a fixed timestamp so output is reproducible
 
-        """
-        if isinstance(string, str):
-            return re.sub(pattern, repl, string)
-        else:
-            return string
+    the timestamp is SOURCE_DATE_EPOCH if set, otherwise the unix epoch
+
+    """
+    global _deterministic_timestamp
+    _deterministic_timestamp = None
+    if deterministic is True:
+        _deterministic_timestamp = fixed_timestamp()
 
-    @jmespath.functions.signature(
-        {'types': ['object']}, {'types': ['string']}
+
+def fixed_timestamp():
+    from dateutil import tz
+    return datetime.fromtimestamp(
+        int(os.environ.get('SOURCE_DATE_EPOCH', 0)), tz.gettz('UTC')
     )
-    def _func_object2keyvalues(self, obj, key_name):
-        """convert object to key value list
 
-        """
-        return [
-            {
-                key_name: k,
-                'Value': v
+
+def timestamp_now():
+    # a cached transform in this thread fixes the timestamp for its run
+    timestamp = getattr(_local, 'timestamp', None)
+    if timestamp is not None:
+        return timestamp
+    if _deterministic_timestamp is not None:
+        return _deterministic_timestamp
+    return add_utc_tz(datetime.utcnow())
+
+
+def _custom_functions():
+    import jmespath.functions
+
+    # custom jmespath functions
+    class CustomFunctions(jmespath.functions.Functions):
+        # regex substitution
+        @jmespath.functions.signature(
+            {'types': ['string']}, {'types': ['string']}, {'types': ['string']}
+        )
+        def _func_re_sub(self, pattern, repl, string):
+            """regular expression substitution
+
+            """
+            if isinstance(string, str):
+                return _regex(pattern).sub(repl, string)
+            else:
+                return string
+
+        @jmespath.functions.signature(
+            {'types': ['object']}, {'types': ['string']}
+        )
+        def _func_object2keyvalues(self, obj, key_name):
+            """convert object to key value list
+
+            """
+            return [
+                {
+                    key_name: k,
+                    'Value': v
+                }
+                for k, v in obj.items()
+            ]
+
+        @jmespath.functions.signature(
+            {'types': ['string']}, {'types': ['string']}
+        )
+        def _func_concat(self, s1, s2):
+            """concat one string with another
+
+            """
+            return s1 + s2
+
+        @jmespath.functions.signature({'types': ['string']})
+        def _pascalize(self, s1):
+            """pascalize string
+
+            """
+            return humps.pascalize(s1)
+
+        @jmespath.functions.signature({'types': ['string']})
+        def _func_ref(self, type_name):
+            """convert terraform reference
+
+            """
+            return {
+                'Ref': transform_type_name(type_name)[1]
             }
-            for k, v in obj.items()
-        ]
 
-    @jmespath.functions.signature({'types': ['string']}, {'types': ['string']})
-    def _func_concat(self, s1, s2):
-        """concat one string with another
+        # generate timestamp
+        @jmespath.functions.signature()
+        def _func_timestamp_number(self):
+            """gets timestamp number
 
-        """
-        return s1 + s2
+            """
+            return timestamp_now().strftime('%Y%m%d%H%M%S%f')
 
-    @jmespath.functions.signature({'types': ['string']})
-    def _pascalize(self, s1):
-        """pascalize string
+        @jmespath.functions.signature({'types': ['string']})
+        def _func_json_to_obj(self, s1):
+            """load json to object
 
-        """
-        return humps.pascalize(s1)
+            """
+            try:
+                return json.loads(s1)
+            except Exception:
+                error('invalid json in to json_to_obj(): %s' % s1)
+                if getattr(_local, 'diagnostics', None) is None:
+                    print_exc()
+                raise
 
-    @jmespath.functions.signature({'types': ['string']})
-    def _func_ref(self, type_name):
-        """convert terraform reference
+        @jmespath.functions.signature(
+            {'types': ['string']}, {'types': ['array']}
+        )
+        def _func_expand_array(self, attrs, input_list):
+            """generate array from array attributes in array of dicts (!?)
 
-        """
-        return {
-            'Ref': transform_type_name(type_name)[1]
-        }
+            used for expanding security group ingress/egress cidr_blocks.
+            input_list may be shared with the source, so is not modified
 
-    # generate timestamp
-    @jmespath.functions.signature()
-    def _func_timestamp_number(self):
-        """gets timestamp number
+            """
+            attrs = attrs.split(',')
+            output_list = []
+            for d in input_list:
+                _d = {k: v for k, v in d.items() if k not in attrs}
+                for attr in attrs:
+                    for val in d.get(attr, []):
+                        output_list.append(dict(_d, **{attr: val}))
+            return output_list
 
-        """
-        return add_utc_tz(datetime.utcnow()).strftime(
-            '%Y%m%d%H%M%S%f'
+    return CustomFunctions
+
+
+def jmespath_options():
+    """jmespath options with custom functions, importing jmespath on first use
+
+    """
+    global _jmespath_options
+    if _jmespath_options is None:
+        import jmespath
+        _jmespath_options = jmespath.Options(
+            custom_functions=_custom_functions()()
         )
+    return _jmespath_options
 
-    @jmespath.functions.signature({'types': ['string']})
-    def _func_json_to_obj(self, s1):
-        """load json to object
 
-        """
-        try:
-            return json.loads(s1)
-        except Exception:
-            error('invalid json in to json_to_obj(): %s' % s1)
-            print_exc()
-            raise
+def __getattr__(name):
+    # lazily created module attributes
+    if name == 'CustomFunctions':
+        return type(jmespath_options().custom_functions)
+    if name == 'JMESPATH_OPTIONS':
+        return jmespath_options()
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
 
-    @jmespath.functions.signature({'types': ['string']}, {'types': ['array']})
-    def _func_expand_array(self, attrs, input_list):
-        """generate array from array attributes in array of dicts (!?)
 
-        used for expanding security group ingress/egress cidr_blocks
+def arg(*args, **kwargs):
+    """record argh argument, applied in cli() so argh loads only for the cli
 
-        """
-        output_list = []
-        for d in input_list:
-            _attrs = {a: d.pop(a, []) for a in attrs.split(',')}
-            for attr, vals in _attrs.items():
-                _d = d.copy()
-                for val in vals:
-                    _d[attr] = val
-                    output_list.append(_d)
-        return output_list
+    """
+    def wrapper(fn):
+        fn.__dict__.setdefault('_cli_args', []).append((args, kwargs))
+        return fn
+    return wrapper
 
 
-JMESPATH_OPTIONS = jmespath.Options(
-    custom_functions=CustomFunctions()
-)
+def aliases(*names):
+    def wrapper(fn):
+        fn._cli_aliases = names
+        return fn
+    return wrapper
+
+
+class Tf2SamError(Exception):
+    """raised by fatal() while diagnostics are captured
+
+    diagnostics has everything reported up to and including the failure
+
+    """
+
+    def __init__(self, msg, diagnostics=None):
+        super().__init__(msg)
+        self.diagnostics = diagnostics if diagnostics is not None else []
+
+
+class _DiagnosticsCapture(object):
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'diagnostics', None)
+        _local.diagnostics = []
+        return _local.diagnostics
+
+    def __exit__(self, *exc_info):
+        _local.diagnostics = self.previous
+        return False
+
+
+def capture_diagnostics():
+    """context manager collecting error() and fatal() reports in this
+    thread into a list instead of printing them, fatal() raises
+    Tf2SamError instead of exiting
+
+    """
+    return _DiagnosticsCapture()
+
+
+def _diagnostic(level, msg, address=None):
+    # True if captured rather than to be printed
+    diagnostics = getattr(_local, 'diagnostics', None)
+    if diagnostics is None:
+        return False
+    diagnostic = {'level': level, 'message': str(msg)}
+    if address is not None:
+        diagnostic['address'] = address
+    diagnostics.append(diagnostic)
+    return True
 
 
 def fatal_if_errors(errors, msg=None):
@@ -143,24 +277,225 @@ def fatal_if_errors(errors, msg=None):
     c = 0
     for e in errors:
         c += 1
-        print(color.red('[%s] %s' % (c, e)))
+        if not _diagnostic('error', e):
+            print(color.red('[%s] %s' % (c, e)))
     fatal('%s error(s)%s' % (c, '' if msg is None else ' ' + msg))
 
 
 def error(msg):
-    print(color.red('ERROR: %s' % msg))
+    if not _diagnostic('error', msg):
+        print(color.red('ERROR: %s' % msg))
 
 
 def fatal(msg):
+    if _diagnostic('fatal', msg):
+        raise Tf2SamError(msg, _local.diagnostics)
     print(color.red('FATAL: %s' % msg))
     sys.exit(1)
 
 
+def info(msg):
+    if not _diagnostic('info', msg):
+        print(msg)
+
+
 def debug(msg):
-    print(color.blue('DEBUG:') + msg)
+    if not _diagnostic('debug', msg):
+        print(color.blue('DEBUG:') + msg)
 
 
-def validate_schema(data, schema_file, msg=None):
+class _NullPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class RunStats(object):
+    """per phase wall time and allocations, per terraform type counts and
+    timings and hot path counters, collected while enabled by start_stats()
+
+    phase times exclude nested phases, eg transform excludes merge.
+    allocations are the net change in allocated blocks, plus the peak
+    traced bytes when tracemalloc is tracing (python -X tracemalloc)
+
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.types = {}
+        self.counters = {
+            'jq': 0, 'path_update': 0, 'deepcopy': 0, 'deepcopy_objects': 0
+        }
+        self.files = 0
+        self.seconds = 0.0
+        self._stack = []
+        # peak memory is only measured when tracemalloc is already tracing
+        self._tracemalloc = None
+        if 'tracemalloc' in sys._xoptions or 'tracemalloc' in sys.modules \
+                or os.environ.get('PYTHONTRACEMALLOC'):
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                self._tracemalloc = tracemalloc
+
+    def phase(self, name):
+        self._name = name
+        return self
+
+    def __enter__(self):
+        tracemalloc = self._tracemalloc
+        frame = [self._name, 0.0, 0, sys.getallocatedblocks(), 0, 0]
+        if tracemalloc is not None:
+            (frame[4], peak) = tracemalloc.get_traced_memory()
+            if len(self._stack) > 0:
+                self._stack[-1][5] = max(self._stack[-1][5], peak)
+            tracemalloc.reset_peak()
+        self._stack.append(frame)
+        frame.append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exc):
+        (name, child_seconds, child_blocks, blocks, current, peak,
+         start) = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        blocks = sys.getallocatedblocks() - blocks
+        p = self.phases.setdefault(name, {
+            'calls': 0, 'seconds': 0.0, 'blocks': 0, 'peak_bytes': 0
+        })
+        p['calls'] += 1
+        p['seconds'] += elapsed - child_seconds
+        p['blocks'] += blocks - child_blocks
+        if self._tracemalloc is not None:
+            peak = max(peak, self._tracemalloc.get_traced_memory()[1])
+            p['peak_bytes'] = max(p['peak_bytes'], peak - current)
+        if len(self._stack) > 0:
+            parent = self._stack[-1]
+            parent[1] += elapsed
+            parent[2] += blocks
+            parent[5] = max(parent[5], peak)
+        return False
+
+    def add_type(self, tf_type, resources, seconds):
+        t = self.types.setdefault(tf_type, {'resources': 0, 'seconds': 0.0})
+        t['resources'] += resources
+        t['seconds'] += seconds
+
+    def to_dict(self):
+        return {
+            'files': self.files,
+            'seconds': self.seconds,
+            'phases': self.phases,
+            'types': self.types,
+            'counters': self.counters
+        }
+
+    def merge(self, d):
+        """add stats from to_dict(), eg from a worker process
+
+        """
+        self.files += d['files']
+        for name, p in d['phases'].items():
+            _p = self.phases.setdefault(name, {
+                'calls': 0, 'seconds': 0.0, 'blocks': 0, 'peak_bytes': 0
+            })
+            for k in ['calls', 'seconds', 'blocks']:
+                _p[k] += p[k]
+            _p['peak_bytes'] = max(_p['peak_bytes'], p['peak_bytes'])
+        for tf_type, t in d['types'].items():
+            self.add_type(tf_type, t['resources'], t['seconds'])
+        for k, v in d['counters'].items():
+            self.counters[k] = self.counters.get(k, 0) + v
+
+    def report(self, file=None):
+        """print phase, type and counter tables
+
+        """
+        file = file or sys.stderr
+        total = sum([p['seconds'] for p in self.phases.values()]) or 1
+        print('%-14s %7s %10s %6s %12s %10s' % (
+            'phase', 'calls', 'seconds', '%', 'alloc blocks', 'peak kb'
+        ), file=file)
+        for name in PROFILE_PHASES:
+            if name not in self.phases:
+                continue
+            p = self.phases[name]
+            print('%-14s %7s %10.3f %6.1f %12s %10s' % (
+                name, p['calls'], p['seconds'],
+                p['seconds'] * 100 / total, p['blocks'],
+                p['peak_bytes'] // 1024 if p['peak_bytes'] else '-'
+            ), file=file)
+        print('%-14s %7s %10.3f  (%s file(s) in %.3fs)' % (
+            'total', '', total, self.files, self.seconds
+        ), file=file)
+        print('\n%-42s %9s %10s %8s' % (
+            'type', 'resources', 'seconds', 'ms each'
+        ), file=file)
+        for tf_type, t in sorted(
+            self.types.items(), key=lambda x: -x[1]['seconds']
+        ):
+            print('%-42s %9s %10.3f %8.3f' % (
+                tf_type, t['resources'], t['seconds'],
+                t['seconds'] * 1000 / (t['resources'] or 1)
+            ), file=file)
+        print('\n' + ', '.join([
+            '%s %s' % (k, v) for k, v in self.counters.items()
+        ]), file=file)
+
+
+PROFILE_PHASES = [
+    'parse', 'references', 'relationships', 'transform', 'merge', 'emit'
+]
+_stats = None
+
+
+def start_stats():
+    """start collecting run stats, returns the RunStats
+
+    """
+    global _stats
+    _stats = RunStats()
+    return _stats
+
+
+def stop_stats():
+    """stop collecting run stats, returns the RunStats or None
+
+    """
+    global _stats
+    (stats, _stats) = (_stats, None)
+    return stats
+
+
+def phase(name):
+    """context manager timing a pipeline phase while stats are enabled
+
+    """
+    if _stats is None:
+        return _NULL_PHASE
+    return _stats.phase(name)
+
+
+def _deepcopy(obj):
+    # counts copies and copied objects when collecting stats
+    if _stats is None:
+        return deepcopy(obj)
+    memo = {}
+    obj = deepcopy(obj, memo)
+    _stats.counters['deepcopy'] += 1
+    _stats.counters['deepcopy_objects'] += len(memo)
+    return obj
+
+
+def get_validator(schema_file):
+    validator = _validators.get(schema_file)
+    if validator is not None:
+        return validator
+    import jsonschema
     schema = load_file(os.path.join(
         ROOT_DIR, 'config', 'schemas', schema_file
     ))
@@ -169,6 +504,12 @@ def validate_schema(data, schema_file, msg=None):
         jsvalidator = jsonschema.Draft7Validator
     else:
         jsvalidator = jsonschema.Draft4Validator
+    validator = _validators[schema_file] = jsvalidator(schema)
+    return validator
+
+
+def validate_schema(data, schema_file, msg=None):
+    from jsonschema.exceptions import ErrorTree
 
     def _deque_as_string(items):
         return '.'.join([str(item) for item in items])
@@ -189,14 +530,406 @@ def validate_schema(data, schema_file, msg=None):
         return results
     try:
         fatal_if_errors(
-            _descriptions(ErrorTree(jsvalidator(schema).iter_errors(data))),
+            _descriptions(ErrorTree(
+                get_validator(schema_file).iter_errors(data)
+            )),
             msg
         )
+    except Tf2SamError:
+        # the errors are already reported, like the exit outside capture
+        raise
     except Exception as e:
-        print_exc()
+        if getattr(_local, 'diagnostics', None) is None:
+            print_exc()
         fatal('unable to load schema %s: %s' % (schema_file, e))
 
 
+class HclUnsupported(Exception):
+    """raised by parse_hcl on input outside the subset it handles
+
+    """
+    pass
+
+
+# skip whitespace and comments, then match the next token. the skip is
+# atomic (lookahead and backreference) so a failed token never backtracks
+# into a comment
+_HCL_TOKEN = re.compile(r"""
+    (?=(?P<skip>(?:[ \t\n\f\v]+|\#[^\n]*|//[^\n]*|/\*(?s:.*?)\*/)*))
+    (?P=skip)
+    (?:
+        (?P<string>"(?:[^"\\$]|\$(?!\{)|\$\{[^{}\\]*\})*")
+        |<<(?!-)(?P<heredoc>\S+)\n
+        |(?P<number>-?\d+(?P<float>\.\d+)?)(?![\w.])
+        |(?P<bool>true|false)(?![\w.-])
+        |(?P<ident>(?!true|false)[^\W\d][\w.-]*)
+        |(?P<punct>[{}\[\]=,])
+        |(?P<end>\Z)
+    )
+""", re.VERBOSE)
+
+
+class _HclParser(object):
+    # recursive descent parser for the subset of hcl terraform resources use:
+    # blocks, assignments, strings with interpolations, heredocs, numbers,
+    # booleans, lists and objects. results are built exactly as pyhcl would
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.peeked = None
+
+    def next(self):
+        if self.peeked is not None:
+            (tok, self.peeked) = (self.peeked, None)
+            return tok
+        m = _HCL_TOKEN.match(self.text, self.pos)
+        if m is None:
+            raise HclUnsupported('unsupported token at %s' % self.pos)
+        self.pos = m.end()
+        kind = m.lastgroup
+        if kind == 'number':
+            if m.group('float') is not None:
+                return ('number', float(m.group('number')))
+            return ('number', int(m.group('number')))
+        if kind == 'string':
+            return ('string', m.group('string')[1:-1])
+        if kind == 'heredoc':
+            return ('string', self._heredoc(m.group('heredoc')))
+        if kind == 'bool':
+            return ('bool', m.group('bool') == 'true')
+        if kind == 'punct':
+            return (m.group('punct'), None)
+        return (kind, m.group(kind))
+
+    def peek(self):
+        if self.peeked is None:
+            self.peeked = self.next()
+        return self.peeked
+
+    def _heredoc(self, marker):
+        # ends on the first line ending with the marker, as pyhcl does
+        text = self.text
+        start = self.pos
+        n = len(marker)
+        p = text.find(marker, start)
+        while p != -1 and p + n != len(text) and text[p + n] != '\n':
+            p = text.find(marker, p + 1)
+        if p == -1:
+            raise HclUnsupported('unterminated heredoc')
+        self.pos = p + n
+        if p == start or text[p - 1] == '\n':
+            return text[start:max(start, p - 1)]
+        return text[start:p]
+
+    def parse(self):
+        return _hcl_flat(self.objectlist('end'), True)
+
+    def objectlist(self, end):
+        items = []
+        while True:
+            (kind, value) = self.next()
+            if kind not in ['ident', 'string']:
+                raise HclUnsupported('expected key')
+            items.append(self.objectitem(value))
+            (kind, _) = self.peek()
+            if kind == ',':
+                self.next()
+                (kind, _) = self.peek()
+                if kind == end:
+                    if end != '}':
+                        raise HclUnsupported('trailing comma')
+                    self.next()
+                    return items
+            elif kind == end:
+                self.next()
+                return items
+
+    def objectitem(self, key):
+        keys = [key]
+        while True:
+            (kind, value) = self.next()
+            if kind in ['ident', 'string']:
+                keys.append(value)
+            elif kind == '=' and len(keys) == 1:
+                return (key, self.value(self.next()))
+            elif kind == '{':
+                value = self.object()
+                for k in reversed(keys[1:]):
+                    value = {k: value}
+                return (key, value)
+            else:
+                raise HclUnsupported('expected = or {')
+
+    def object(self):
+        if self.peek()[0] == '}':
+            self.next()
+            return {}
+        return _hcl_flat(self.objectlist('}'), False)
+
+    def value(self, tok):
+        (kind, value) = tok
+        if kind in ['string', 'number', 'bool']:
+            return value
+        if kind == '{':
+            return self.object()
+        if kind == '[':
+            return self.list()
+        raise HclUnsupported('unsupported value')
+
+    def list(self):
+        items = []
+        if self.peek()[0] == ']':
+            self.next()
+            return items
+        while True:
+            (kind, value) = self.next()
+            # pyhcl rejects a number second in a list after a non number
+            if kind == 'number' and len(items) == 1 and \
+                    not isinstance(items[0], (int, float)):
+                raise HclUnsupported('number after non number')
+            if kind in ['string', 'number']:
+                items.append(value)
+            elif kind == '{':
+                items.append(self.object())
+            else:
+                raise HclUnsupported('unsupported list item')
+            (kind, _) = self.next()
+            if kind == ',':
+                if self.peek()[0] == ']':
+                    self.next()
+                    return items
+            elif kind == ']':
+                return items
+            else:
+                raise HclUnsupported('expected , or ]')
+
+
+def _hcl_flat(items, replace):
+    # pyhcl HclParser.objectlist_flat, merging repeated keys
+    d = {}
+    for k, v in items:
+        if k in d and not replace:
+            if type(d[k]) is list:
+                d[k].append(v)
+            else:
+                d[k] = [d[k], v]
+        elif isinstance(v, dict):
+            dd = d.setdefault(k, {})
+            for kk, vv in v.items():
+                if type(dd) == list:
+                    dd.append({kk: vv})
+                elif kk in dd:
+                    if hasattr(vv, 'items'):
+                        for k2, v2 in vv.items():
+                            dd[kk][k2] = v2
+                    else:
+                        d[k] = [dd, {kk: vv}]
+                else:
+                    dd[kk] = vv
+        else:
+            d[k] = v
+    return d
+
+
+def parse_hcl(text):
+    """parse terraform hcl, using the fast subset parser where possible and
+    pyhcl for anything else
+
+    """
+    try:
+        if '\r' in text:
+            raise HclUnsupported('carriage returns')
+        return _HclParser(text).parse()
+    except (HclUnsupported, RecursionError):
+        import hcl
+        return hcl.loads(text)
+
+
+HCL_CACHE_VERSION = 2
+HCL_CACHE_MAX_FILES = 256
+
+
+def _load_hcl(file):
+    # parsed documents are cached by content hash as json, which unlike
+    # marshal or pickle can't run code if the cache is tampered with
+    with open(file, 'r') as fh:
+        text = fh.read()
+    if os.environ.get('TF2SAM_NO_CACHE') is not None:
+        return parse_hcl(text)
+    cache_file = cache_dir('hcl', '%s.json' % hashlib.sha256(
+        (str(HCL_CACHE_VERSION) + '\0' + text).encode('utf-8', 'replace')
+    ).hexdigest())
+    if _cache_trusted(cache_file):
+        try:
+            with open(cache_file, 'rb') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            pass
+    data = parse_hcl(text)
+    try:
+        _write_cache(cache_file, json.dumps(
+            data, separators=(',', ':')
+        ).encode('utf-8'))
+    except (TypeError, ValueError):
+        return data
+    _prune_cache(os.path.dirname(cache_file), HCL_CACHE_MAX_FILES)
+    return data
+
+
+def _match_path(path, pattern):
+    """'yield' if json path matches pattern, 'descend' if it is a prefix
+
+    pattern items are keys, '*' for any key, '#' for any array index or a
+    tuple of items repeated zero or more times
+
+    """
+    if len(path) == 0:
+        return 'yield' if len(pattern) == 0 else 'descend'
+    if len(pattern) == 0:
+        return None
+    p = pattern[0]
+    if isinstance(p, tuple):
+        results = [
+            _match_path(path, pattern[1:]), _match_path(path, p + pattern)
+        ]
+        for result in ['yield', 'descend']:
+            if result in results:
+                return result
+        return None
+    if p == '#':
+        ok = isinstance(path[0], int)
+    elif p == '*':
+        ok = isinstance(path[0], str)
+    else:
+        ok = path[0] == p
+    return _match_path(path[1:], pattern[1:]) if ok else None
+
+
+class JsonStream(object):
+    """incremental json reader yielding (path, value) for selected values
+
+    select(path) returns 'yield' to decode the value at path, 'descend' to
+    read into the object or array at path, otherwise the value is skipped
+    without being decoded.  path is a tuple of object keys and array
+    indexes, and only one selected value is held in memory at a time
+
+    """
+    CHUNK_SIZE = 1 << 20
+
+    _WHITESPACE = re.compile(r'[ \t\n\r]*')
+    # strings and brackets, a lone quote is a string cut off by the buffer
+    _SKIP = re.compile(r'"(?:[^"\\]|\\.)*"|"|[\[\]{}]')
+
+    def __init__(self, fh, select):
+        self.fh = fh
+        self.select = select
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def __iter__(self):
+        yield from self._value(())
+        if self._peek(False) is not None:
+            self._error('extra data')
+
+    def _error(self, msg):
+        raise ValueError('%s at offset %s' % (msg, self.pos))
+
+    def _fill(self, size=None):
+        # drop consumed text and read more, False at end of file
+        if self.eof is True:
+            return False
+        data = self.fh.read(size or self.CHUNK_SIZE)
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        self.eof = data == ''
+        return not self.eof
+
+    def _peek(self, required=True):
+        while True:
+            self.pos = self._WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                if required is True:
+                    self._error('unexpected end of json')
+                return None
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c not in chars:
+            self._error('expected %s' % ' or '.join(chars))
+        self.pos += 1
+        return c
+
+    def _decode(self):
+        # decode value at pos, reading more until it is complete
+        while True:
+            try:
+                (value, end) = self.decoder.raw_decode(self.buf, self.pos)
+                # a number could continue in the next chunk
+                if end < len(self.buf) or self.eof is True:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof is True:
+                    raise
+            self._fill(max(self.CHUNK_SIZE, len(self.buf)))
+
+    def _skip(self):
+        if self._peek() not in '[{':
+            self._decode()
+            return
+        depth = 0
+        while True:
+            for m in self._SKIP.finditer(self.buf, self.pos):
+                token = m.group(0)
+                if token == '"':
+                    self.pos = m.start()
+                    break
+                elif token in '[{':
+                    depth += 1
+                elif token in ']}':
+                    depth -= 1
+                    if depth == 0:
+                        self.pos = m.end()
+                        return
+            else:
+                self.pos = len(self.buf)
+            if not self._fill():
+                self._error('unexpected end of json')
+
+    def _value(self, path):
+        action = self.select(path)
+        c = self._peek()
+        if action == 'yield':
+            yield (path, self._decode())
+            return
+        if action != 'descend' or c not in '[{':
+            self._skip()
+            return
+        self.pos += 1
+        close = '}' if c == '{' else ']'
+        if self._peek() == close:
+            self.pos += 1
+            return
+        i = 0
+        while True:
+            if c == '{':
+                if self._peek() != '"':
+                    self._error('expected object key')
+                key = self._decode()
+                self._expect(':')
+                yield from self._value(path + (key,))
+            else:
+                yield from self._value(path + (i,))
+                i += 1
+            if self._expect(',' + close) == close:
+                return
+
+
 def load_file(file, schema_file=None, csv_keyval=None):
     if not os.path.isfile(file):
         fatal('file %s not found' % file)
@@ -204,10 +937,11 @@ def load_file(file, schema_file=None, csv_keyval=None):
     data = None
     try:
         if ext in ['tf']:
-            data = hcl.load(open(file, 'r'))
+            data = _load_hcl(file)
         elif ext in ['json']:
             data = json.load(open(file, 'r'))
         elif ext in ['yaml']:
+            from cfn_flip import to_json
             data = json.loads(to_json(open(file, 'r').read()))
         elif ext in ['csv']:
             data = []
@@ -234,10 +968,75 @@ def load_file(file, schema_file=None, csv_keyval=None):
     return data
 
 
-def config(name):
-    global _config
-    if _config is not None:
-        return _config.get(name, {})
+def cache_dir(*parts):
+    """tf2sam cache directory, TF2SAM_CACHE_DIR or the user cache dir
+
+    """
+    base = os.environ.get('TF2SAM_CACHE_DIR')
+    if base is None:
+        base = os.path.join(
+            os.environ.get('XDG_CACHE_HOME')
+            or os.path.join(os.path.expanduser('~'), '.cache'),
+            'tf2sam'
+        )
+    return os.path.join(base, *parts)
+
+
+def _cache_trusted(file):
+    # caches are unpickled, which runs code, so only load them when the
+    # file and each directory down to it from the cache dir are owned by
+    # this user and not group or world writable
+    if not hasattr(os, 'getuid'):
+        return True
+    base = os.path.abspath(cache_dir())
+    path = os.path.abspath(file)
+    while True:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if st.st_uid != os.getuid() or st.st_mode & 0o022:
+            return False
+        if path == base:
+            return True
+        parent = os.path.dirname(path)
+        if parent == path:
+            return False
+        path = parent
+
+
+def _config_manifest(config_dir):
+    # (mtime, size) of every config and schema file, keyed on relative path
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(config_dir):
+        for f in filenames:
+            if f.split('.')[-1] not in ['csv', 'yaml']:
+                continue
+            path = os.path.join(dirpath, f)
+            st = os.stat(path)
+            manifest[os.path.relpath(path, config_dir)] = (
+                st.st_mtime_ns, st.st_size
+            )
+    return manifest
+
+
+def _config_hashes(config_dir, manifest):
+    hashes = {}
+    for f in sorted(manifest.keys()):
+        with open(os.path.join(config_dir, f), 'rb') as fh:
+            hashes[f] = hashlib.sha256(fh.read()).hexdigest()
+    return hashes
+
+
+def config_snapshot_file():
+    config_dir = os.path.join(ROOT_DIR, 'config')
+    return cache_dir('config-%s.pickle' % hashlib.sha256(
+        config_dir.encode('utf-8')
+    ).hexdigest()[0:12])
+
+
+def _build_config():
+    # load and validate every config file
     config_dir = os.path.join(ROOT_DIR, 'config')
     files = [
         f for f in os.listdir(config_dir)
@@ -264,13 +1063,128 @@ def config(name):
             schema_file=schema_file,
             csv_keyval=csv_keyvals.get(file)
         )
+    return _config
+
+
+def _write_pickle(file, data):
+    _write_cache(file, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _write_cache(file, data):
+    # write atomically, caches are only an optimisation so ignore errors
+    try:
+        # only this user can read or replace cached files
+        os.makedirs(cache_dir(), mode=0o700, exist_ok=True)
+        os.makedirs(os.path.dirname(file), mode=0o700, exist_ok=True)
+        tmp_file = '%s.%s.tmp' % (file, os.getpid())
+        with open(tmp_file, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp_file, file)
+    except OSError as e:
+        error('unable to write cache %s: %s' % (file, e))
+
+
+def _prune_cache(dir, max_files):
+    # remove least recently written files over max_files
+    try:
+        files = [os.path.join(dir, f) for f in os.listdir(dir)]
+        if len(files) <= max_files:
+            return
+        files.sort(key=lambda f: os.stat(f).st_mtime_ns)
+        for f in files[0:len(files) - max_files]:
+            os.remove(f)
+    except OSError:
+        pass
+
+
+def load_config(force=False):
+    """load validated config from snapshot, rebuilding it if config changed
+
+    the snapshot is reused when every config file has the same mtime and
+    size, or failing that the same content hash
+
+    """
+    config_dir = os.path.join(ROOT_DIR, 'config')
+    manifest = _config_manifest(config_dir)
+    use_cache = os.environ.get('TF2SAM_NO_CACHE') is None
+    snapshot_file = config_snapshot_file()
+    snapshot = None
+    if use_cache is True and force is False and \
+            _cache_trusted(snapshot_file):
+        try:
+            with open(snapshot_file, 'rb') as fh:
+                snapshot = pickle.load(fh)
+        except Exception:
+            snapshot = None
+    if (isinstance(snapshot, dict)
+       and snapshot.get('version') == CONFIG_SNAPSHOT_VERSION):
+        if snapshot['manifest'] == manifest:
+            return snapshot
+        if set(snapshot['manifest'].keys()) == set(manifest.keys()):
+            if snapshot['hashes'] == _config_hashes(config_dir, manifest):
+                # touched but unchanged
+                snapshot['manifest'] = manifest
+                _write_pickle(snapshot_file, snapshot)
+                return snapshot
+    hashes = _config_hashes(config_dir, manifest)
+    snapshot = {
+        'version': CONFIG_SNAPSHOT_VERSION,
+        'manifest': manifest,
+        'hashes': hashes,
+        'digest': hashlib.sha256(
+            json.dumps(hashes, sort_keys=True).encode('utf-8')
+        ).hexdigest(),
+        'config': _build_config()
+    }
+    if use_cache is True:
+        _write_pickle(snapshot_file, snapshot)
+    return snapshot
+
+
+def config(name):
+    global _config, _config_digest
+    if _config is None:
+        snapshot = load_config()
+        (_config, _config_digest) = (snapshot['config'], snapshot['digest'])
     return _config.get(name, {})
 
 
+def config_digest():
+    """content hash of the loaded config
+
+    """
+    config('template')
+    return _config_digest
+
+
+def reset_config():
+    """drop loaded config and everything derived from it
+
+    """
+    global _config, _config_digest
+    (_config, _config_digest) = (None, None)
+    _plans.clear()
+    _validators.clear()
+    _resolve_type_name.cache_clear()
+
+
+TYPE_NAME_CACHE_SIZE = 65536
+
+
 def transform_type_name(type_name):
-    type_name = strip_ref_attrs(type_name)
+    """resolve terraform type.name to (cloudformation type, logical id)
+
+    references such as ${type.name.attr} are accepted and resolved to the
+    same result, names not starting with aws_ are returned unchanged
+
+    """
+    return _resolve_type_name(strip_ref_attrs(type_name))
+
+
+@lru_cache(maxsize=TYPE_NAME_CACHE_SIZE)
+def _resolve_type_name(type_name):
     if not type_name.startswith('aws_'):
-        return type_name
+        return sys.intern(type_name)
     (_type, name) = type_name.split('.', 1)
     type_names = config('resource_type_names')
     target_type = type_names.get(_type)
@@ -285,43 +1199,111 @@ def transform_type_name(type_name):
         )
         target_type = '::'.join(target_parts)
     target_name = humps.pascalize(name) + ''.join(target_parts[1:])
-    return (target_type, target_name)
+    return (sys.intern(target_type), sys.intern(target_name))
 
 
+@lru_cache(maxsize=TYPE_NAME_CACHE_SIZE)
 def strip_ref_attrs(ref):
     if ref.startswith('${') and ref.endswith('}'):
         ref = ref[2:-1]
     parts = ref.split('.')
     if len(parts) == 3:
         ref = '.'.join(parts[0:2])
-    return ref
+    return sys.intern(ref)
+
+
+def _lru_stats(fn):
+    info = fn.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'size': info.currsize,
+        'maxsize': info.maxsize,
+        'hit_rate': info.hits / lookups if lookups > 0 else 0.0
+    }
+
+
+def type_name_cache_stats():
+    """hit rate statistics for type name and reference resolution
+
+    """
+    return {
+        'transform_type_name': _lru_stats(_resolve_type_name),
+        'strip_ref_attrs': _lru_stats(strip_ref_attrs)
+    }
 
 
-def find_refs(obj):
-    refs = []
+REF_SCAN_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=REF_SCAN_CACHE_SIZE)
+def scan_refs(s):
+    """tokenize ${...} interpolations in string
+
+    returns sorted tuple of unique interpolated expressions without ${}
+
+    """
+    if '${' not in s or '}' not in s:
+        return ()
+    return tuple(sorted(set([ref[2:-1] for ref in REF_PATTERN.findall(s)])))
+
+
+@lru_cache(maxsize=REF_SCAN_CACHE_SIZE)
+def _resource_refs(s):
+    # unique type.name references in string, used for relationships
+    return tuple(sorted(set([strip_ref_attrs(ref) for ref in scan_refs(s)])))
+
+
+@lru_cache(maxsize=REF_SCAN_CACHE_SIZE)
+def _sub_plan(s):
+    # Fn::Sub string and (substitution key, reference) pairs for string
+    plan = []
+    for ref in scan_refs(s):
+        if ref.startswith('AWS::'):
+            continue
+        _ref = ref
+        if ref.startswith('var.'):
+            _ref = _get_var(ref)
+            s = s.replace(ref, _ref)
+        plan.append((_ref, ref))
+    return (s, tuple(plan))
+
+
+def ref_scan_cache_stats():
+    """hit rate statistics for interpolation scanning
+
+    """
+    return {
+        'scan_refs': _lru_stats(scan_refs),
+        'resource_refs': _lru_stats(_resource_refs),
+        'sub_plan': _lru_stats(_sub_plan)
+    }
+
+
+def find_refs(obj, refs=None):
+    if refs is None:
+        refs = []
     if isinstance(obj, dict):
         for v in obj.values():
-            refs += find_refs(v)
+            find_refs(v, refs)
     elif isinstance(obj, list):
         for v in obj:
-            refs += find_refs(v)
-    elif isinstance(obj, str) and '${' in obj and '}' in obj:
-        refs = re.findall(REF_PATTERN, obj)
-        refs = sorted(list(set([
-            strip_ref_attrs(ref)
-            for ref in refs
-        ])))
+            find_refs(v, refs)
+    elif isinstance(obj, str):
+        refs.extend(_resource_refs(obj))
     return refs
 
 
+def _get_var(ref):
+    return ref.split('["')[-1].split('"]')[0]
+
+
 def expand_variables(obj, refs=None, vars=None):
 
     if vars is None:
         vars = {}
 
-    def _get_var(ref):
-        return ref.split('["')[-1].split('"]')[0]
-
     def _get_ref_obj(ref, get_attr=False):
         if ref.startswith('${') and ref.endswith('}'):
             ref = ref[2:-1]
@@ -368,17 +1350,9 @@ def expand_variables(obj, refs=None, vars=None):
         if obj.startswith('${'):
             obj = _get_ref_obj(obj)
         elif '${' in obj:
-            refs = sorted(list(set([
-                ref[2:-1] for ref in re.findall(REF_PATTERN, obj)
-            ])))
+            (obj, sub_refs) = _sub_plan(obj)
             sub_map = {}
-            for ref in refs:
-                if ref.startswith('AWS::'):
-                    continue
-                _ref = ref
-                if ref.startswith('var.'):
-                    _ref = _get_var(ref)
-                    obj = obj.replace(ref, _ref)
+            for _ref, ref in sub_refs:
                 sub_map[_ref] = _get_ref_obj(ref, True)
             obj = {
                 'Fn::Sub': [obj, sub_map] if len(sub_map) else obj
@@ -387,29 +1361,62 @@ def expand_variables(obj, refs=None, vars=None):
     return obj
 
 
+def compile_jq(query):
+    """compile jmespath expression, cached on the query string
+
+    """
+    expr = _jq_cache.get(query)
+    if expr is None:
+        jq_stats['misses'] += 1
+        import jmespath
+        expr = _jq_cache[query] = jmespath.compile(query)
+    else:
+        jq_stats['hits'] += 1
+    return expr
+
+
 def jq(query, data):
+    if _stats is not None:
+        _stats.counters['jq'] += 1
     try:
-        return jmespath.search(query, data, JMESPATH_OPTIONS)
+        if isinstance(query, str):
+            query = compile_jq(query)
+        return query.search(data, jmespath_options())
     except Exception as e:
-        print_exc()
+        if getattr(_local, 'diagnostics', None) is None:
+            print_exc()
         fatal('unable to perform jmespath.search(%s, %s): %s' % (
-            query, data, e
+            getattr(query, 'expression', query), data, e
         ))
 
 
-def path_update(
-    obj, path, val, fn=None, default=False, change_key=False, remove_key=False,
-    merge=False
-):
-    parts = path.split('.')
-    parts_len = len(parts)
-    updated = False
-    for i in range(len(parts)):
-        key = parts.pop(0)
+def parse_path(path):
+    """split dotted path into tuple of (key, index) parts
+
+    index is None unless the part ends in [n], [] or [*]
+
+    """
+    parts = []
+    for key in path.split('.'):
         idx = None
         if key[-1] == ']' and '[' in key:
             (key, idx) = key.split('[')
             idx = idx[0:-1]
+        parts.append((key, idx))
+    return tuple(parts)
+
+
+def path_update(
+    obj, path, val, fn=None, default=False, change_key=False, remove_key=False,
+    merge=False
+):
+    if _stats is not None:
+        _stats.counters['path_update'] += 1
+    parts = parse_path(path) if isinstance(path, str) else path
+    parts_len = len(parts)
+    updated = False
+    for i in range(parts_len):
+        (key, idx) = parts[i]
         if key not in obj:
             if parts_len == i + 1 and default is True:
                 obj[key] = fn(val) if callable(fn) else val
@@ -438,7 +1445,7 @@ def path_update(
             if idx in ['', '*']:
                 for j in range(len(obj)):
                     _updated = path_update(
-                        obj[j], '.'.join(parts), val, fn, default,
+                        obj[j], parts[i + 1:], val, fn, default,
                         change_key, remove_key
                     )
                     if _updated is True:
@@ -457,107 +1464,385 @@ def path_update(
     return updated
 
 
-def get_relationships(resources):
+def _expand_view(obj, refs=None, vars=None):
+    """expand_variables without modifying obj, copying only the dicts and
+    lists with variables and sharing the rest
+
+    """
+    if isinstance(obj, dict):
+        expanded = None
+        for k, v in obj.items():
+            # don't resolve twice
+            if k.startswith('Fn::'):
+                continue
+            _v = _expand_view(v, refs, vars)
+            if _v is not v:
+                if expanded is None:
+                    expanded = dict(obj)
+                expanded[k] = _v
+        return obj if expanded is None else expanded
+    if isinstance(obj, list):
+        expanded = None
+        for i, v in enumerate(obj):
+            _v = _expand_view(v, refs, vars)
+            if _v is not v:
+                if expanded is None:
+                    expanded = list(obj)
+                expanded[i] = _v
+        return obj if expanded is None else expanded
+    if isinstance(obj, str) and '${' in obj:
+        return expand_variables(obj, refs, vars)
+    return obj
+
+
+class RelationshipGraph(object):
+    """compact index of references between terraform resources
+
+    nodes are integer ids, edges are kept in adjacency arrays in both
+    directions and related names are grouped by type on first lookup
+
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.types = []
+        self.refs = []
+        self.referrers = []
+        # neighbours in both directions, in discovery order
+        self.adjacent = []
+        self._typed = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, type_name):
+        return type_name in self.ids
+
+    def node(self, type_name):
+        node = self.ids.get(type_name)
+        if node is None:
+            node = self.ids[type_name] = len(self.names)
+            self.names.append(type_name)
+            self.types.append(type_name.split('.', 1)[0])
+            self.refs.append(array('i'))
+            self.referrers.append(array('i'))
+            self.adjacent.append(array('i'))
+        return node
+
+    def add_edge(self, from_type_name, to_type_name):
+        # from_type_name references to_type_name
+        to_node = self.node(to_type_name)
+        from_node = self.node(from_type_name)
+        self.refs[from_node].append(to_node)
+        self.referrers[to_node].append(from_node)
+        self.adjacent[to_node].append(from_node)
+        self.adjacent[from_node].append(to_node)
+        self._typed.pop(to_node, None)
+        self._typed.pop(from_node, None)
+
+    def typed(self, node):
+        """related names of node grouped by type, both directions
+
+        """
+        typed = self._typed.get(node)
+        if typed is None:
+            grouped = {}
+            for other in self.adjacent[node]:
+                name = self.names[other]
+                grouped.setdefault(self.types[other], set()).add(
+                    name.split('.', 1)[-1]
+                )
+            typed = self._typed[node] = {
+                _type: tuple(sorted(_names))
+                for _type, _names in grouped.items()
+            }
+        return typed
+
+    def related(self, type_name, type):
+        """names of resources of type related to type_name
+
+        """
+        node = self.ids.get(type_name)
+        if node is None:
+            return ()
+        return self.typed(node).get(type, ())
+
+    def view(self, type_name):
+        """read only mapping of type to related names, None if unrelated
+
+        """
+        node = self.ids.get(type_name)
+        if node is None or len(self.adjacent[node]) == 0:
+            return None
+        return RelationshipView(self, node)
+
+    def to_dict(self):
+        return {
+            self.names[node]: {
+                _type: list(_names)
+                for _type, _names in self.typed(node).items()
+            }
+            for node in range(len(self.names))
+        }
+
+
+class RelationshipView(Mapping):
+    """relationships of a single resource as {type: (names, ...)}
+
+    """
+    __slots__ = ['graph', 'node']
+
+    def __init__(self, graph, node):
+        self.graph = graph
+        self.node = node
+
+    def __getitem__(self, type):
+        return self.graph.typed(self.node)[type]
+
+    def __iter__(self):
+        return iter(self.graph.typed(self.node))
+
+    def __len__(self):
+        return len(self.graph.typed(self.node))
+
+
+def build_relationship_graph(resources):
     # build parent/child relationships for merging
-    relationships = {}
+    graph = RelationshipGraph()
     for tf_type, tf_resources in resources.items():
         for tf_name, tf_d in tf_resources.items():
             tf_type_name = '%s.%s' % (tf_type, tf_name)
-            refs = find_refs(tf_d)
-            for ref in refs:
+            for ref in find_refs(tf_d):
+                graph.add_edge(tf_type_name, ref)
+    return graph
 
-                # parent
-                if ref not in relationships:
-                    relationships[ref] = {}
-                if tf_type not in relationships[ref]:
-                    relationships[ref][tf_type] = {}
-                relationships[ref][tf_type][tf_name] = True
 
-                # child
-                if tf_type_name not in relationships:
-                    relationships[tf_type_name] = {}
-                (ref_type, ref_name) = ref.split('.')
-                if ref_type not in relationships[tf_type_name]:
-                    relationships[tf_type_name][ref_type] = {}
-                relationships[tf_type_name][ref_type][ref_name] = True
+def get_relationships(resources):
+    return build_relationship_graph(resources).to_dict()
 
-    # convert to dicts to lists
-    for _name, _rd in relationships.items():
-        for _type in sorted(_rd.keys()):
-            relationships[_name][_type] = sorted(_rd[_type].keys())
 
-    return relationships
+class RunCache(object):
+    """caches derived from the resources of a single transform run
 
+    """
 
-def _get_api_int_path(ref_obj, all_resources):
-    rid = ref_obj.get('resource_id')
-    if rid is None:
-        return None, []
-    paths = []
-    c = 0
-    merged = []
-    while True:
-        c += 1
-        if c > 50:
-            break
+    def __init__(self, all_resources):
+        self.all_resources = all_resources
+        # aws_api_gateway_resource address -> ((path_part, merged), ...)
+        self.api_paths = {}
+        # (type, merge rule, child type) -> {child name: [fragment,
+        # merged names, uses left]}
+        self.merges = {}
+
+    def merge_index(self, type, rule, ref_type):
+        index = self.merges.get((type, rule, ref_type))
+        if index is None:
+            index = self.merges[(type, rule, ref_type)] = {}
+        return index
+
+    def invalidate(self, type):
+        """drop merge fragments of resources of type, before they are
+        modified by their own transform
+
+        """
+        for key in [k for k in self.merges if k[2] == type]:
+            del self.merges[key]
+
+
+def run_cache(all_resources):
+    cache = getattr(_local, 'run_cache', None)
+    if cache is None or cache.all_resources is not all_resources:
+        cache = _local.run_cache = RunCache(all_resources)
+    return cache
+
+
+def _api_resource_path(rid, all_resources):
+    # walk parent_id links up to the api root, reusing the path already
+    # resolved for any ancestor, capped at API_PATH_MAX_DEPTH hops
+    memo = run_cache(all_resources).api_paths
+    chain = []
+    entries = ()
+    capped = True
+    for c in range(API_PATH_MAX_DEPTH):
         if rid.startswith('${') and rid.endswith('}'):
             rid = rid[2:-1]
-        (_type, _name) = strip_ref_attrs(rid).split('.', 1)
+        key = strip_ref_attrs(rid)
+        if key in memo:
+            entries = memo[key]
+            capped = False
+            break
+        (_type, _name) = key.split('.', 1)
         res_obj = all_resources.get(_type, {}).get(_name)
         if not isinstance(res_obj, dict) or 'parent_id' not in res_obj:
+            memo[key] = ()
+            capped = False
             break
+        merged = None
         if not _name.endswith('.root_resource_id'):
-            merged.append(transform_type_name('%s.%s' % (_type, _name))[1])
-        paths.append(res_obj['path_part'])
+            merged = transform_type_name('%s.%s' % (_type, _name))[1]
+        chain.append((key, (res_obj['path_part'], merged)))
         rid = res_obj['parent_id']
-    return ('/' + '/'.join(reversed(paths)), merged)
+    for key, entry in reversed(chain):
+        entries = ((entry,) + entries)[0:API_PATH_MAX_DEPTH]
+        if capped is False:
+            memo[key] = entries
+    return entries
 
 
-def _merge_resources(type_c, pd, relationships, all_resources, refs=None):
-    # merge other resources
-    merged = []
-    _debug = type_c.get('debug')
+def _get_api_int_path(ref_obj, all_resources):
+    rid = ref_obj.get('resource_id')
+    if rid is None:
+        return None, []
+    entries = _api_resource_path(rid, all_resources)
+    return (
+        '/' + '/'.join(reversed([e[0] for e in entries])),
+        [e[1] for e in entries if e[1] is not None]
+    )
+
+
+TransformPlan = namedtuple('TransformPlan', [
+    'type', 'config', 'debug', 'preserve_case', 'default', 'transform',
+    'rename', 'remove', 'merge', 'merge_exclude_types', 'add', 'do_merge',
+    'exclude_depends_on_types'
+])
+
+
+def compile_transform_plan(type):
+    """merge common and type config once and pre-parse paths and queries
+
+    """
+    import mergedeep
+    type_c = mergedeep.merge(
+        {}, config('common'), config(type),
+        strategy=mergedeep.Strategy.ADDITIVE
+    )
+
+    def _compile(query):
+        return None if query is None else compile_jq(query)
+
+    merge = []
     for path, md in type_c.get('merge', {}).items():
-        if ':' in path:
-            path = path.split(':', 1)[0]
+        merge.append((
+            path, parse_path(path.split(':', 1)[0]), md,
+            _compile(md.get('filter')), _compile(md['transform'])
+        ))
+    return TransformPlan(
+        type=type,
+        config=type_c,
+        debug=type_c.get('debug') is True,
+        preserve_case=type_c.get('preserve_case', []),
+        default=[
+            (parse_path(path), val)
+            for path, val in type_c.get('default', {}).items()
+        ],
+        transform=[
+            (parse_path(path), _compile(transform))
+            for path, transform in type_c.get('transform', {}).items()
+        ],
+        rename=[
+            (parse_path(path), new_name)
+            for path, new_name in type_c.get('rename', {}).items()
+        ],
+        remove=[parse_path(path) for path in type_c.get('remove', [])],
+        merge=merge,
+        merge_exclude_types=type_c.get('merge_exclude_types', []),
+        add=[
+            (
+                ad, _compile(ad.get('filter')), _compile(ad['name_query']),
+                _compile(ad['transform'])
+            )
+            for ad in type_c.get('add', [])
+        ],
+        do_merge=len([k for k in type_c.keys() if k.startswith('merge')]) > 0,
+        exclude_depends_on_types=type_c.get('exclude_depends_on_types', [])
+    )
+
+
+def get_transform_plan(type):
+    plan = _plans.get(type)
+    if plan is None:
+        plan = _plans[type] = compile_transform_plan(type)
+    return plan
+
+
+def _merge_entry(
+    ref_type, ref_name, ref_obj, md, filter_query, transform_query,
+    all_resources, _debug
+):
+    # transformed fragment of a merge rule's child, or None if filtered
+    # out, and the names it merges
+    _merged = []
+    if ref_type == 'aws_api_gateway_integration':
+        if 'http_method' in ref_obj:
+            _merged.append(
+                transform_type_name(ref_obj['http_method'])[1]
+            )
+        (ref_obj['_api_path'], _merged2) = _get_api_int_path(
+            ref_obj, all_resources
+        )
+        _merged += _merged2
+    # apply filter if specified
+    if filter_query is not None:
+        filter_match = jq(filter_query, ref_obj)
+        if _debug is True:
+            debug('merge filter: %s, match: %s, obj: %s' % (
+                md['filter'], filter_match, ref_obj
+            ))
+        if filter_match is not True:
+            return (None, [])
+
+    tx_d = jq(transform_query, ref_obj)
+    if tx_d is None:
+        return (None, [])
+    # allow transform to specify object key name as ref name
+    if isinstance(tx_d, dict) and '_ref_name_' in tx_d:
+        tx_d[humps.pascalize(ref_name)] = tx_d.pop('_ref_name_')
+    _merged.append(transform_type_name('%s.%s' % (ref_type, ref_name))[1])
+    return (tx_d, _merged)
+
+
+def _merge_resources(plan, pd, relationships, all_resources, refs=None):
+    # merge other resources, each rule's fragments are indexed by child in
+    # the run cache so the filter and transform run once per child
+    merged = []
+    _debug = plan.debug
+    cache = run_cache(all_resources)
+    graph = getattr(relationships, 'graph', None)
+    for (name, path, md, filter_query, transform_query) in plan.merge:
         vals = []
         ref_type = md['type']
         if _debug is True:
-            debug('merging %s' % path)
+            debug('merging %s' % name.split(':', 1)[0])
+        index = cache.merge_index(plan.type, name, ref_type)
         for ref_name in relationships.get(ref_type, []):
-            ref_type_name = '%s.%s' % (ref_type, ref_name)
-            ref_obj = all_resources.get(ref_type, {}).get(ref_name)
-            if ref_obj is not None:
-                _merged = []
-                if ref_type == 'aws_api_gateway_integration':
-                    if 'http_method' in ref_obj:
-                        _merged.append(
-                            transform_type_name(ref_obj['http_method'])[1]
-                        )
-                    (ref_obj['_api_path'], _merged2) = _get_api_int_path(
-                        ref_obj, all_resources
-                    )
-                    _merged += _merged2
-                # apply filter if specified
-                if 'filter' in md:
-                    filter_match = jq(md['filter'], ref_obj)
-                    if _debug is True:
-                        debug('merge filter: %s, match: %s, obj: %s' % (
-                            md['filter'], filter_match, ref_obj
-                        ))
-                    if filter_match is not True:
-                        continue
-
-                tx_d = jq(md['transform'], ref_obj)
-                if tx_d is not None:
-                    # allow transform to specify object key name as ref name
-                    if isinstance(tx_d, dict) and '_ref_name_' in tx_d:
-                        tx_d[humps.pascalize(ref_name)] = (
-                            tx_d.pop('_ref_name_')
-                        )
-                    vals.append(tx_d)
-                    merged += _merged
-                    merged.append(transform_type_name(ref_type_name)[1])
+            entry = index.get(ref_name)
+            if entry is None:
+                ref_obj = all_resources.get(ref_type, {}).get(ref_name)
+                if ref_obj is None:
+                    continue
+                (tx_d, _merged) = _merge_entry(
+                    ref_type, ref_name, ref_obj, md, filter_query,
+                    transform_query, all_resources, _debug
+                )
+                # resources of this type merging the child, unknown
+                # without the relationship graph
+                uses = 0 if graph is None else len(graph.related(
+                    '%s.%s' % (ref_type, ref_name), plan.type
+                ))
+                entry = index[ref_name] = [tx_d, _merged, uses]
+            (tx_d, _merged) = entry[0:2]
+            if tx_d is None:
+                continue
+            # fragments end up in the resource, so each use but the last
+            # expected one is given a copy
+            entry[2] -= 1
+            if entry[2] == 0:
+                del index[ref_name]
+            else:
+                tx_d = _deepcopy(tx_d)
+            vals.append(tx_d)
+            merged += _merged
         if len(vals) > 0:
             object_type = md.get('object_type', 'array')
             # output type is an object
@@ -575,7 +1860,7 @@ def _merge_resources(type_c, pd, relationships, all_resources, refs=None):
                 path_update(
                     pd, path, vals, default=True, merge=md.get('merge', False)
                 )
-    for ref_type in type_c.get('merge_exclude_types', []):
+    for ref_type in plan.merge_exclude_types:
         for ref_name in relationships.get(ref_type, []):
             ref_type_name = '%s.%s' % (ref_type, ref_name)
             merged.append(transform_type_name(
@@ -586,206 +1871,2747 @@ def _merge_resources(type_c, pd, relationships, all_resources, refs=None):
     return merged
 
 
+class TransformCache(object):
+    """transform results keyed by a hash of the resource, its related
+    resources and the config
+
+    entries are pickled so each hit returns a fresh copy, and only entries
+    used since the last save are kept.  cached results are reused across
+    runs, so resources are transformed with a fixed timestamp to stay
+    current
+
+    """
+
+    def __init__(self, file=None):
+        self.file = file
+        self.timestamp = fixed_timestamp()
+        self.entries = {}
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+        if file is None or not _cache_trusted(file):
+            return
+        try:
+            with open(file, 'rb') as fh:
+                cached = pickle.load(fh)
+            if cached.get('version') == INCREMENTAL_CACHE_VERSION:
+                self.entries = cached['entries']
+        except Exception:
+            pass
+
+    @staticmethod
+    def file_for(file):
+        return cache_dir('incremental', '%s.pickle' % hashlib.sha256(
+            os.path.abspath(file).encode('utf-8')
+        ).hexdigest()[0:16])
+
+    def key(self, plan, name, d, relationships, all_resources):
+        h = hashlib.sha256()
+
+        def _update(obj):
+            h.update(json.dumps(obj, sort_keys=True, default=str).encode(
+                'utf-8'
+            ))
+        _update([
+            INCREMENTAL_CACHE_VERSION, config_digest(),
+            str(self.timestamp), plan.type, name, d
+        ])
+        if relationships and all_resources:
+            merge_types = [m[2]['type'] for m in plan.merge]
+            for ref_type in sorted(relationships.keys()):
+                for ref_name in relationships[ref_type]:
+                    ref_obj = all_resources.get(ref_type, {}).get(ref_name)
+                    related = [ref_type, ref_name, ref_obj]
+                    if (ref_type == 'aws_api_gateway_integration'
+                       and ref_type in merge_types
+                       and isinstance(ref_obj, dict)):
+                        related.append(
+                            _get_api_int_path(ref_obj, all_resources)
+                        )
+                    _update(related)
+        return h.hexdigest()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.used[key] = entry
+        return pickle.loads(entry)
+
+    def put(self, key, entry):
+        self.entries[key] = self.used[key] = pickle.dumps(
+            entry, protocol=pickle.HIGHEST_PROTOCOL
+        )
+
+    def prune(self):
+        (self.entries, self.used) = (self.used, {})
+
+    def save(self):
+        self.prune()
+        if self.file is not None:
+            _write_pickle(self.file, {
+                'version': INCREMENTAL_CACHE_VERSION,
+                'entries': self.entries
+            })
+
+
+def _api_path_updates(plan, relationships, all_resources):
+    # _api_path set on related integrations when merging, replayed on hits
+    updates = {}
+    if not relationships or not all_resources:
+        return updates
+    for md in [m[2] for m in plan.merge]:
+        if md['type'] != 'aws_api_gateway_integration':
+            continue
+        for ref_name in relationships.get(md['type'], []):
+            ref_obj = all_resources.get(md['type'], {}).get(ref_name)
+            if isinstance(ref_obj, dict) and '_api_path' in ref_obj:
+                updates[ref_name] = ref_obj['_api_path']
+    return updates
+
+
+def _cached_transform_resources(plan, resources, all_resources, cache):
+    # replay cached results, transforming only resources that changed
+    keys = [
+        cache.key(plan, name, d, relationships, all_resources)
+        for (name, d, relationships) in resources
+    ]
+    results = [None] * len(resources)
+    misses = []
+    for i, key in enumerate(keys):
+        entry = cache.get(key)
+        if entry is None:
+            misses.append(i)
+            continue
+        (post_d, result, api_paths) = entry
+        d = resources[i][1]
+        d.clear()
+        d.update(post_d)
+        for ref_name, api_path in api_paths.items():
+            all_resources['aws_api_gateway_integration'][ref_name][
+                '_api_path'
+            ] = api_path
+        results[i] = result
+    if len(misses) > 0:
+        previous = getattr(_local, 'timestamp', None)
+        _local.timestamp = cache.timestamp
+        try:
+            _results = transform_resources(
+                plan.type, [resources[i] for i in misses], all_resources
+            )
+        finally:
+            _local.timestamp = previous
+        for i, result in zip(misses, _results):
+            (name, d, relationships) = resources[i]
+            cache.put(keys[i], (d, result, _api_path_updates(
+                plan, relationships, all_resources
+            )))
+            results[i] = result
+    return results
+
+
 def transform_resource(type, name, d, relationships=None, all_resources=None):
-    (target_type, target_name) = transform_type_name(
-        type + '.' + name
-    )
+    return transform_resources(
+        type, [(name, d, relationships)], all_resources=all_resources
+    )[0]
 
-    type_c = mergedeep.merge(
-        {}, config('common'), config(type),
-        strategy=mergedeep.Strategy.ADDITIVE
-    )
-    preserve_case = {}
-    errors = []
 
-    if type_c.get('debug') is True and relationships is not None:
-        debug('%s.%s relationships: %s' % (
-            type, name,
-            json.dumps(relationships, indent=2)
-        ))
+def _prepare_resources(plan, ds):
+    # apply preserve case, defaults, transforms and renames to the source
+    # resources, running each rule over every resource before the next
+    preserve_cases = [{} for d in ds]
 
     # preserve case attributes
-    for k in type_c.get('preserve_case', []):
-        if k not in d:
-            continue
-        preserve_case[humps.pascalize(k)] = d.pop(k)
+    for k in plan.preserve_case:
+        for d, preserve_case in zip(ds, preserve_cases):
+            if k not in d:
+                continue
+            preserve_case[humps.pascalize(k)] = d.pop(k)
 
-    # apply defaults
-    for path, val in type_c.get('default', {}).items():
-        path_update(d, path, val, default=True)
+    # apply defaults, copied so resources don't share plan values
+    for path, val in plan.default:
+        for d in ds:
+            path_update(d, path, val, fn=_deepcopy, default=True)
 
     # transform attributes
-    for path, transform in type_c.get('transform', {}).items():
-        path_update(d, path, transform, fn=lambda x: jq(x, d))
-        path_update(
-            preserve_case, path, transform, fn=lambda x: jq(x, preserve_case)
-        )
+    for path, transform in plan.transform:
+        for d, preserve_case in zip(ds, preserve_cases):
+            path_update(d, path, transform, fn=lambda x: jq(x, d))
+            path_update(
+                preserve_case, path, transform,
+                fn=lambda x: jq(x, preserve_case)
+            )
 
     # rename attributes
-    for path, new_name in type_c.get('rename', {}).items():
-        path_update(d, path, new_name, change_key=True)
+    for path, new_name in plan.rename:
+        for d in ds:
+            path_update(d, path, new_name, change_key=True)
 
-    pd = humps.pascalize(d)
-    pd.update(preserve_case)
+    return preserve_cases
 
-    depends_on = pd.pop('DependsOn', None)
-    refs = []
-    vars = {}
-    expand_variables(pd, refs, vars)
 
-    # merge resources
-    merged = []
-    do_merge = len([k for k in type_c.keys() if k.startswith('merge')]) > 0
-    if all([relationships, all_resources]) and do_merge is True:
-        merged = _merge_resources(
-            type_c, pd, relationships, all_resources, refs
+def transform_resources(type, resources, all_resources=None, cache=None):
+    """transform list of (name, data, relationships) of the same type
+
+    returns list of (resources, merged, errors, vars) per resource
+
+    """
+    plan = get_transform_plan(type)
+    if all_resources:
+        run_cache(all_resources).invalidate(type)
+    # merging from the same type depends on resource order, so don't batch
+    if len(resources) > 1 and type in [m[2]['type'] for m in plan.merge]:
+        return [
+            transform_resources(type, [r], all_resources, cache)[0]
+            for r in resources
+        ]
+    if cache is not None:
+        return _cached_transform_resources(
+            plan, resources, all_resources, cache
         )
+    preserve_cases = _prepare_resources(plan, [r[1] for r in resources])
+    results = []
+    refs_list = []
 
-    # remove attributes
-    for path in type_c.get('remove', []):
-        path_update(pd, path, None, remove_key=True)
+    for (name, d, relationships), preserve_case in zip(
+        resources, preserve_cases
+    ):
+        (target_type, target_name) = transform_type_name(
+            type + '.' + name
+        )
+        errors = []
 
-    target_d = {
-        'Type': target_type,
-        'Properties': pd
-    }
+        if plan.debug is True and relationships is not None:
+            debug('%s.%s relationships: %s' % (
+                type, name,
+                json.dumps(dict(relationships), indent=2)
+            ))
 
-    # exclude relationships marked as reference to stop
-    # cfn-lint complaining about obsolete DependsOn
-    if depends_on is not None:
-        exclude_depends_on_types = type_c.get('exclude_depends_on_types', [])
-        if not isinstance(depends_on, list):
-            depends_on = [depends_on]
-        _depends_on = []
-        target_refs = list(set([_[1] for _ in refs]))
-        for ref in depends_on:
-            _tf_type = ref.split('.')[0]
-            _cf_name = transform_type_name(ref)[1]
-            if (_cf_name not in target_refs
-               and _tf_type not in exclude_depends_on_types):
-                _depends_on.append(_cf_name)
-        if len(_depends_on) > 0:
-            target_d['DependsOn'] = _depends_on
-
-    _resources_d = {
-        target_name: target_d
-    }
+        pd = humps.pascalize(d)
+        pd.update(preserve_case)
+
+        depends_on = pd.pop('DependsOn', None)
+        refs = []
+        vars = {}
+        expand_variables(pd, refs, vars)
+
+        # merge resources
+        merged = []
+        if all([relationships, all_resources]) and plan.do_merge is True:
+            with phase('merge'):
+                merged = _merge_resources(
+                    plan, pd, relationships, all_resources, refs
+                )
 
-    # process additions
-    for ad in type_c.get('add', []):
+        # remove attributes
+        for path in plan.remove:
+            path_update(pd, path, None, remove_key=True)
+
+        target_d = {
+            'Type': target_type,
+            'Properties': pd
+        }
+
+        # exclude relationships marked as reference to stop
+        # cfn-lint complaining about obsolete DependsOn
+        if depends_on is not None:
+            exclude_depends_on_types = plan.exclude_depends_on_types
+            if not isinstance(depends_on, list):
+                depends_on = [depends_on]
+            _depends_on = []
+            target_refs = list(set([_[1] for _ in refs]))
+            for ref in depends_on:
+                _tf_type = ref.split('.')[0]
+                _cf_name = transform_type_name(ref)[1]
+                if (_cf_name not in target_refs
+                   and _tf_type not in exclude_depends_on_types):
+                    _depends_on.append(_cf_name)
+            if len(_depends_on) > 0:
+                target_d['DependsOn'] = _depends_on
+
+        _resources_d = {
+            target_name: target_d
+        }
+        results.append((_resources_d, merged, errors, vars))
+        refs_list.append(refs)
+
+    # process additions, reading a view of each resource shared by the
+    # rules, with variables expanded on first use
+    views = [None] * len(resources) if len(plan.add) > 0 else []
+    for (ad, filter_query, name_query, transform_query) in plan.add:
         _target_type = ad['type']
-        _source_data = deepcopy(d)
-        _source_data.update({
-            '__type_name__': '%s.%s' % (type, name),
-            '__target_type__': target_type,
-            '__target_name__': target_name
-        })
-        if 'filter' in ad:
-            if jq(ad['filter'], _source_data) is not True:
-                continue
-        expand_variables(_source_data, refs, vars)
-        _target_name = jq(ad['name_query'], _source_data)
-        _target_data = jq(ad['transform'], _source_data)
-        if isinstance(_target_name, str) and isinstance(_target_data, dict):
-            _resources_d[_target_name] = {
-                'Type': _target_type,
-                'Properties': _target_data
-            }
+        for i, ((name, d, relationships), result, refs) in enumerate(zip(
+            resources, results, refs_list
+        )):
+            (_resources_d, merged, errors, vars) = result
+            view = views[i]
+            if view is None:
+                (target_type, target_name) = transform_type_name(
+                    type + '.' + name
+                )
+                view = dict(d)
+                view.update({
+                    '__type_name__': '%s.%s' % (type, name),
+                    '__target_type__': target_type,
+                    '__target_name__': target_name
+                })
+                view = views[i] = [view, None]
+            if filter_query is not None:
+                if jq(filter_query, view[0]) is not True:
+                    continue
+            if view[1] is None:
+                view[1] = _expand_view(view[0], refs, vars)
+            _target_name = jq(name_query, view[1])
+            _target_data = jq(transform_query, view[1])
+            if (isinstance(_target_name, str)
+               and isinstance(_target_data, dict)):
+                _resources_d[_target_name] = {
+                    'Type': _target_type,
+                    'Properties': _target_data
+                }
 
-    return (_resources_d, merged, errors, vars)
+    return results
 
 
-@arg('file', help='path to terraform file')
-@arg(
-    '-p', '--print-yaml',
-    help='print generated yaml instead of writing to file'
-)
-@arg(
-    '-f', '--filter',
-    help='filter resources on pattern'
-)
-@aliases('t')
-def transform(file, print_yaml=False, filter=None):
-    'transform terraform .tf file to sam format'
-    if not file.endswith('.tf'):
-        fatal('file must end in .tf')
-    if not os.path.isfile(file):
-        fatal('file not found')
-    data = load_file(file)
-    if len(data.get('resource', {})) == 0:
-        fatal('no resources defined in file %s' % file)
-    resources = {}
-    target_file = None
-    target_txt = None
-    merged_names = []
-    errors = []
+def _expand_files(paths):
+    # expand directories and glob patterns into a unique list of .tf and
+    # .tf.json files, state and plan json are only included when named or
+    # matched
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames[:] = sorted(
+                    d for d in dirnames if not d.startswith('.')
+                )
+                files += [
+                    os.path.join(dirpath, f) for f in sorted(filenames)
+                    if f.endswith(TF_EXTENSIONS)
+                ]
+        elif glob.has_magic(path):
+            # other json matched, such as package.json, is skipped
+            files += [
+                f for f in sorted(glob.glob(path, recursive=True))
+                if os.path.isfile(f) and (
+                    f.endswith(TF_EXTENSIONS) or is_state_file(f)
+                )
+            ]
+        else:
+            if not path.endswith(TF_EXTENSIONS + STATE_EXTENSIONS):
+                fatal('file %s must end in %s' % (
+                    path, ', '.join(TF_EXTENSIONS + STATE_EXTENSIONS)
+                ))
+            if path.endswith('.json') and not path.endswith(
+                TF_EXTENSIONS
+            ) and os.path.isfile(path) and not is_state_file(path):
+                fatal('file %s is not terraform state or plan json' % path)
+            files.append(path)
+    return list(dict.fromkeys(files))
 
-    # resolve any name references
-    for rd in config('references').get('name', []):
-        tf_type = rd['type']
-        tf_attr = rd['name_attribute']
-        if tf_type not in data['resource']:
-            continue
-        for tf_name, tf_d in data['resource'][tf_type].items():
-            if tf_attr not in tf_d:
-                continue
-            data['resource'][tf_type][tf_name][tf_attr] = '${%s.%s.id}' % (
-                rd['target_type'], tf_d[tf_attr]
-            )
 
-    relationships = get_relationships(data['resource'])
-    vars = {}
+ROOT_PARALLEL_MIN_BYTES = 256 * 1024
+MODULE_ARGS_IGNORED = ['source', 'version', 'providers', 'depends_on']
+_MODULE_REF = re.compile(r'(?<![\w.-])module\.([\w-]+)\.')
+_RESOURCE_REF = re.compile(r'(?<![\w.-])([a-z][\w-]*)\.([\w-]+)')
 
-    for tf_type, tf_resources in data['resource'].items():
-        for tf_name, tf_d in tf_resources.items():
-            type_name = '%s.%s' % (tf_type, tf_name)
-            if filter is not None:
-                if re.match('^.*%s.*$' % filter, type_name):
-                    print('processing %s' % type_name)
-                else:
+
+def _module_files(dir):
+    # terraform only reads the .tf files directly in a module directory
+    return [
+        os.path.join(dir, f) for f in sorted(os.listdir(dir))
+        if f.endswith('.tf') and os.path.isfile(os.path.join(dir, f))
+    ]
+
+
+def _load_files(files, jobs=None):
+    # parse in worker processes once there is enough to outweigh startup
+    jobs = min(jobs or os.cpu_count() or 1, len(files))
+    if jobs < 2 or sum(
+        os.path.getsize(f) for f in files
+    ) < ROOT_PARALLEL_MIN_BYTES:
+        return [load_file(f) for f in files]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(load_file, files))
+
+
+def _merge_module(dir, files, docs):
+    # merge the parsed files of a module directory into one document
+    merged = {}
+    for (file, doc) in zip(files, docs):
+        for block, d in doc.items():
+            for _d in d if isinstance(d, list) else [d]:
+                if not isinstance(_d, dict):
                     continue
-            (_resources_d, _merged, _errors, _vars) = transform_resource(
-                tf_type, tf_name, tf_d,
-                relationships=relationships.get(type_name),
-                all_resources=data['resource']
+                target = merged.setdefault(block, {})
+                if block not in ['resource', 'data']:
+                    target.update(_d)
+                    continue
+                for tf_type, tf_resources in _d.items():
+                    _target = target.setdefault(tf_type, {})
+                    for tf_name in tf_resources:
+                        if tf_name in _target:
+                            fatal('duplicate %s %s.%s in %s' % (
+                                block, tf_type, tf_name, file
+                            ))
+                    _target.update(tf_resources)
+    return merged
+
+
+def _module_source(dir, name, d):
+    source = d.get('source')
+    if not isinstance(source, str) or not source.startswith(
+        ('./', '../')
+    ):
+        error('module %s in %s skipped, only local sources supported' % (
+            name, dir
+        ))
+        return None
+    source = os.path.normpath(os.path.join(dir, source))
+    if not os.path.isdir(source):
+        fatal('module %s source %s not found' % (name, source))
+    return source
+
+
+def _load_modules(root, jobs=None):
+    """parse root and every local module directory it uses
+
+    returns dict of merged document per directory.  directories are
+    discovered a level at a time and each level's files parsed together
+
+    """
+    modules = {}
+    level = [root]
+    seen = set(level)
+    while len(level) > 0:
+        files = {dir: _module_files(dir) for dir in level}
+        all_files = [f for dir in level for f in files[dir]]
+        if _stats is not None:
+            _stats.files += len(all_files)
+        docs = iter(_load_files(all_files, jobs))
+        next_level = []
+        for dir in level:
+            modules[dir] = _merge_module(dir, files[dir], [
+                next(docs) for _ in files[dir]
+            ])
+            for name, d in modules[dir].get('module', {}).items():
+                source = _module_source(dir, name, d)
+                if source is not None and source not in seen:
+                    seen.add(source)
+                    next_level.append(source)
+        level = next_level
+    return modules
+
+
+class _ModuleScope(object):
+    """substitutes var, local and module output references and prefixes
+    resource names for one module instance
+
+    """
+
+    def __init__(self, prefix, resources, values):
+        self.prefix = prefix
+        self.resources = resources
+        self.values = values
+
+    def rename(self, expr):
+        if self.prefix == '':
+            return expr
+        return _RESOURCE_REF.sub(
+            lambda m: '%s.%s%s' % (m.group(1), self.prefix, m.group(2))
+            if m.group(2) in self.resources.get(m.group(1), ())
+            else m.group(0),
+            expr
+        )
+
+    def _sub_ref(self, m):
+        expr = m.group(0)[2:-1]
+        if expr not in self.values:
+            return '${%s}' % self.rename(expr)
+        value = self.values[expr]
+        if isinstance(value, bool):
+            return 'true' if value is True else 'false'
+        if isinstance(value, (str, int, float)):
+            return str(value)
+        # lists and maps can only replace a whole string
+        return m.group(0)
+
+    def sub(self, obj):
+        """copy of obj with references substituted
+
+        """
+        if isinstance(obj, dict):
+            return {k: self.sub(v) for k, v in obj.items()}
+        elif isinstance(obj, list):
+            return [self.sub(v) for v in obj]
+        elif not isinstance(obj, str) or '${' not in obj:
+            return obj
+        refs = scan_refs(obj)
+        if len(refs) == 1 and refs[0] in self.values and (
+            obj == '${%s}' % refs[0]
+        ):
+            return deepcopy(self.values[refs[0]])
+        return REF_PATTERN.sub(self._sub_ref, obj)
+
+
+def _module_order(modules_d):
+    # modules ordered so those whose outputs are used as inputs come first
+    pending = dict(modules_d)
+    while len(pending) > 0:
+        ready = [
+            name for name, d in pending.items()
+            if not any(
+                m in pending for m in _MODULE_REF.findall(json.dumps(d))
             )
-            vars.update(_vars)
-            resources.update(_resources_d)
-            errors += _errors
-            merged_names += _merged
+        ]
+        if len(ready) == 0:
+            fatal('module cycle between %s' % ', '.join(sorted(pending)))
+        for name in ready:
+            yield (name, pending.pop(name))
 
-    for target_name in merged_names:
-        resources.pop(target_name, None)
-    fatal_if_errors(errors)
 
-    if len(resources) == 0:
-        fatal('no resources to write to template')
+def _resolve_module(modules, dir, prefix='', inputs=None, path=()):
+    """resources and outputs of a module instance
 
-    target_file = '.'.join(file.split('.')[0:-1]) + '.yaml'
-    template = config('template')
-    if len(vars) > 0:
-        template['Parameters'] = {
-            v: {
-                'Type': 'String'
-            } for v in vars.keys()
-        }
-    template['Resources'] = resources
+    resource names are prefixed and var, local and module output
+    references substituted
 
-    target_txt = to_yaml(json.dumps(template))
-    if print_yaml is True:
-        print(target_txt)
-    else:
-        with open(target_file, 'w') as fh:
-            fh.write(target_txt)
-        print('written %s' % target_file)
+    """
+    if dir in path:
+        fatal('module %s includes itself' % dir)
+    data = modules[dir]
+    scope = _ModuleScope(prefix, data.get('resource', {}), {})
 
+    # root variables stay as template parameters
+    if inputs is not None:
+        for name, d in data.get('variable', {}).items():
+            if isinstance(d, dict) and 'default' in d:
+                scope.values['var.%s' % name] = d['default']
+        for name, v in inputs.items():
+            scope.values['var.%s' % name] = v
 
-def cli():
-    parser = argh.ArghParser()
-    parser.description = 'Transform Terraform to AWS SAM'
-    parser.add_commands([
-        transform
+    # locals can use each other in any order
+    local_d = data.get('locals', {})
+    for _ in range(len(local_d)):
+        for name, v in local_d.items():
+            scope.values['local.%s' % name] = scope.sub(v)
+
+    resources = {}
+    for name, d in _module_order(data.get('module', {})):
+        source = _module_source(dir, name, d)
+        if source is None:
+            continue
+        (_resources, _outputs) = _resolve_module(
+            modules, source, '%s%s_' % (prefix, name), {
+                k: scope.sub(v) for k, v in d.items()
+                if k not in MODULE_ARGS_IGNORED
+            }, path + (dir,)
+        )
+        for tf_type, tf_resources in _resources.items():
+            resources.setdefault(tf_type, {}).update(tf_resources)
+        for output, v in _outputs.items():
+            scope.values['module.%s.%s' % (name, output)] = v
+
+    name_refs = {
+        rd['type']: rd for rd in config('references').get('name', [])
+    }
+    for tf_type, tf_resources in data.get('resource', {}).items():
+        _resources = resources.setdefault(tf_type, {})
+        rd = name_refs.get(tf_type)
+        for tf_name, tf_d in tf_resources.items():
+            _name = prefix + tf_name
+            if _name in _resources:
+                fatal('duplicate resource %s.%s in module %s' % (
+                    tf_type, _name, dir
+                ))
+            tf_d = scope.sub(tf_d)
+            if isinstance(tf_d.get('depends_on'), list):
+                tf_d['depends_on'] = [
+                    scope.rename(v) for v in tf_d['depends_on']
+                ]
+            # name references resolve against prefixed resource names
+            if rd is not None and prefix != '' and isinstance(
+                tf_d.get(rd['name_attribute']), str
+            ) and tf_d[rd['name_attribute']] in scope.resources.get(
+                rd['target_type'], ()
+            ):
+                tf_d[rd['name_attribute']] = (
+                    prefix + tf_d[rd['name_attribute']]
+                )
+            _resources[_name] = tf_d
+
+    outputs = {
+        name: scope.sub(d.get('value')) for name, d in data.get(
+            'output', {}
+        ).items() if isinstance(d, dict)
+    }
+    return (resources, outputs)
+
+
+def load_root(root, jobs=None):
+    """load terraform root module directory and its local modules
+
+    returns one document with the resources of the root and every module
+    instance, module resources named <module>_<name>
+
+    """
+    if not os.path.isdir(root):
+        fatal('directory %s not found' % root)
+    root = os.path.normpath(root)
+    with phase('parse'):
+        modules = _load_modules(root, jobs)
+        (resources, _outputs) = _resolve_module(modules, root)
+    return {'resource': resources}
+
+
+# terraform configuration in hcl or json syntax
+TF_EXTENSIONS = ('.tf', '.tf.json')
+STATE_EXTENSIONS = ('.tfstate', '.json')
+# terraform writes the state or plan format version and its own version
+# before anything else
+_STATE_HEAD = re.compile(
+    r'\s*{\s*"(?:format_version|version)"\s*:\s*[^,{}\[\]]+,'
+    r'\s*"terraform_version"\s*:'
+)
+# state resources, and resources in the planned values and configuration
+# of plan json root and nested modules
+_STATE_PATHS = [
+    ('version',),
+    ('resources', '#'),
+    (
+        'planned_values', 'root_module', ('child_modules', '#'),
+        'resources', '#'
+    ),
+    (
+        'configuration', 'root_module', ('module_calls', '*', 'module'),
+        'resources', '#'
+    ),
+    (
+        'configuration', 'root_module', ('module_calls', '*', 'module'),
+        'outputs', '*'
+    )
+]
+_STATE_MODULE = re.compile(r'module\.([\w-]+)(?:\[("?)(.*?)\2\])?')
+_STATE_ADDRESS = re.compile(
+    r'^((?:module\.[\w-]+(?:\[[^\]]*\])?\.)*)(data\.)?([\w-]+)\.([\w-]+)'
+)
+_STATE_REF = re.compile(
+    r'^([\w-]+)\.([\w-]+)(?:\[("?)(.*?)\3\])?\.([\w-]+)$'
+)
+
+
+def _select_state(path):
+    results = [_match_path(path, pattern) for pattern in _STATE_PATHS]
+    for result in ['yield', 'descend']:
+        if result in results:
+            return result
+    return None
+
+
+def _state_name(prefix, name, index=None):
+    # module and instance keys become part of the name as for load_root
+    if index is None or index == '':
+        return prefix + name
+    return '%s%s_%s' % (prefix, name, re.sub(r'[^\w-]', '_', str(index)))
+
+
+def _state_prefix(module):
+    return ''.join([
+        _state_name('', name, index) + '_'
+        for (name, _quote, index) in _STATE_MODULE.findall(module or '')
     ])
+
+
+def _state_empty(v):
+    return v is None or (isinstance(v, (str, list, dict)) and len(v) == 0)
+
+
+def _state_value(v):
+    # drop empty values and unwrap single blocks as hcl would parse them
+    if isinstance(v, dict):
+        return {
+            k: _v for k, _v in ((k, _state_value(x)) for k, x in v.items())
+            if not _state_empty(_v)
+        }
+    elif isinstance(v, list):
+        v = [_state_value(x) for x in v]
+        if len(v) == 1 and isinstance(v[0], dict):
+            return v[0]
+    return v
+
+
+def _state_refs(obj, refs, pattern, used):
+    # replace resolved values of dependencies with references
+    if isinstance(obj, dict):
+        return {k: _state_refs(v, refs, pattern, used) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [_state_refs(v, refs, pattern, used) for v in obj]
+    elif not isinstance(obj, str):
+        return obj
+    if obj in refs:
+        used.add(refs[obj][0:2])
+        return '${%s.%s.%s}' % refs[obj]
+    if pattern is not None and 'arn:' in obj:
+        def _sub(m):
+            used.add(refs[m.group(0)][0:2])
+            return '${%s.%s.%s}' % refs[m.group(0)]
+        return pattern.sub(_sub, obj)
+    return obj
+
+
+class _StateReader(object):
+    """collects resources streamed from terraform state or plan json
+
+    """
+
+    def __init__(self):
+        state_config = config('state')
+        self.ref_attrs = state_config.get('reference_attributes', [])
+        self.ignore = state_config.get('ignore_attributes', {})
+        self.ignore_sets = {}
+        self.plan_refs = re.compile(
+            state_config.get('plan_reference_pattern', '(?!)')
+        )
+        self.name_refs = {
+            rd['type']: rd for rd in config('references').get('name', [])
+        }
+        self.resources = {}
+        # (type, prefix + name) -> instance names
+        self.instances = {}
+        # (type, name) -> {resolved value: reference attribute}
+        self.values = {}
+        # (type, name) -> [(type, prefix + name)]
+        self.dependencies = {}
+        self.configs = []
+        # (module prefix, output) -> references
+        self.outputs = {}
+
+    def add(self, tf_type, prefix, name, index, values, dependencies=()):
+        tf_name = _state_name(prefix, name, index)
+        key = (tf_type, tf_name)
+        self.instances.setdefault(
+            (tf_type, prefix + name), []
+        ).append(tf_name)
+        ref_values = {}
+        for attr in self.ref_attrs:
+            if isinstance(values.get(attr), str) and values[attr] != '':
+                ref_values.setdefault(values[attr], attr)
+        self.values[key] = ref_values
+        deps = []
+        for address in dependencies:
+            m = _STATE_ADDRESS.match(address)
+            if m is not None and m.group(2) is None:
+                deps.append((
+                    m.group(3), _state_prefix(m.group(1)) + m.group(4)
+                ))
+        self.dependencies[key] = deps
+        if tf_type not in self.ignore_sets:
+            self.ignore_sets[tf_type] = set(
+                self.ignore.get('common', []) + self.ignore.get(tf_type, [])
+            )
+        ignore = self.ignore_sets[tf_type]
+        self.resources.setdefault(tf_type, {})[tf_name] = _state_value({
+            k: v for k, v in values.items() if k not in ignore
+        })
+
+    def read(self, fh):
+        for (path, d) in JsonStream(fh, _select_state):
+            if path[0] == 'version':
+                if d != 4:
+                    fatal('terraform state version %s not supported' % d)
+            elif path[0] == 'configuration':
+                prefix = ''.join(['%s_' % n for n in path[3:-2:3]])
+                if path[-2] == 'outputs':
+                    self.outputs[(prefix, path[-1])] = (
+                        d.get('expression') or {}
+                    ).get('references', [])
+                else:
+                    self.configs.append((prefix, d))
+            elif d.get('mode') != 'managed':
+                continue
+            elif path[0] == 'resources':
+                prefix = _state_prefix(d.get('module'))
+                for instance in d.get('instances', []):
+                    self.add(
+                        d['type'], prefix, d['name'],
+                        instance.get('index_key'),
+                        instance.get('attributes') or {},
+                        instance.get('dependencies') or []
+                    )
+            else:
+                self.add(
+                    d['type'],
+                    _state_prefix(_STATE_ADDRESS.match(d['address']).group(1)),
+                    d['name'], d.get('index'), d.get('values') or {}
+                )
+
+    def _resolve_dependencies(self):
+        # state records dependencies rather than references
+        for (tf_type, tf_name), deps in self.dependencies.items():
+            targets = [
+                (t, n) for (t, name) in deps
+                for n in self.instances.get((t, name), [])
+            ]
+            if len(targets) == 0:
+                continue
+            refs = {}
+            for (t, n) in targets:
+                for value, attr in self.values[(t, n)].items():
+                    refs.setdefault(value, (t, n, attr))
+            arns = sorted([v for v in refs if v.startswith('arn:')], key=len)
+            pattern = None if len(arns) == 0 else re.compile(
+                '(?:%s)(?![\\w-])' % '|'.join(
+                    re.escape(v) for v in reversed(arns)
+                )
+            )
+            used = set()
+            d = self.resources[tf_type][tf_name]
+            target = refs.get(self._name_ref(tf_type, d))
+            d = _state_refs(d, refs, pattern, used)
+            # name references use the terraform name of the target
+            if target is not None and (
+                target[0] == self.name_refs[tf_type]['target_type']
+            ):
+                d[self.name_refs[tf_type]['name_attribute']] = target[1]
+                used.add(target[0:2])
+            depends_on = [
+                '%s.%s' % target for target in targets if target not in used
+            ]
+            if len(depends_on) > 0:
+                d['depends_on'] = depends_on
+            self.resources[tf_type][tf_name] = d
+
+    def _name_ref(self, tf_type, d):
+        rd = self.name_refs.get(tf_type)
+        if rd is None or not isinstance(d.get(rd['name_attribute']), str):
+            return None
+        return d[rd['name_attribute']]
+
+    def _resolve_configuration(self):
+        # plans have references for values unknown until apply
+        for (prefix, c) in self.configs:
+            if c.get('mode') != 'managed':
+                continue
+            tf_names = self.instances.get((c['type'], prefix + c['name']), [])
+            rd = self.name_refs.get(c['type'])
+            depends_on = []
+            for address in c.get('depends_on', []):
+                m = _STATE_ADDRESS.match(address)
+                if m is not None and m.group(1) == '' and (
+                    m.group(2) is None
+                ):
+                    depends_on += ['%s.%s' % (m.group(3), n) for n in (
+                        self.instances.get((m.group(3), prefix + m.group(4)))
+                        or []
+                    )]
+            for tf_name in tf_names:
+                d = self.resources[c['type']][tf_name]
+                for attr, expression in c.get('expressions', {}).items():
+                    if not isinstance(expression, dict):
+                        continue
+                    refs = [
+                        '${%s.%s.%s}' % ref for ref in [
+                            self._config_ref(prefix, ref)
+                            for ref in expression.get('references', [])
+                        ] if ref is not None
+                    ]
+                    if len(refs) == 0:
+                        continue
+                    if rd is not None and attr == rd['name_attribute']:
+                        (t, n) = refs[0][2:-1].split('.')[0:2]
+                        if t == rd['target_type']:
+                            d[attr] = n
+                    elif attr not in d and self.plan_refs.search(attr):
+                        d[attr] = refs if attr.endswith('s') else refs[0]
+                if len(depends_on) > 0:
+                    d['depends_on'] = list(dict.fromkeys(
+                        d.get('depends_on', []) + depends_on
+                    ))
+
+    def _config_ref(self, prefix, ref):
+        # (type, name, attribute) of a resource attribute or module output
+        # reference, None for anything else
+        m = _STATE_REF.match(ref)
+        if m is None:
+            return None
+        if m.group(1) == 'module':
+            _prefix = _state_name(prefix, m.group(2), m.group(4)) + '_'
+            for _ref in self.outputs.get((_prefix, m.group(5)), []):
+                result = self._config_ref(_prefix, _ref)
+                if result is not None:
+                    return result
+            return None
+        name = _state_name(prefix, m.group(2), m.group(4))
+        if (m.group(1), name) not in self.values:
+            return None
+        return (m.group(1), name, m.group(5))
+
+    def data(self):
+        self._resolve_dependencies()
+        self._resolve_configuration()
+        return {'resource': self.resources}
+
+
+def load_state(file):
+    """load terraform state or plan json (terraform show -json)
+
+    the json is streamed a resource at a time and only the attributes kept
+    for each resource are held in memory.  computed attributes are dropped
+    and resolved values of related resources replaced with references
+
+    """
+    if not os.path.isfile(file):
+        fatal('file %s not found' % file)
+    reader = _StateReader()
+    try:
+        with open(file, 'r') as fh:
+            reader.read(fh)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        fatal('unable to load %s: %s' % (file, e))
+    return reader.data()
+
+
+def is_state_file(file):
+    """True if file is terraform state or plan json (terraform show -json)
+
+    .tfstate files are state, and .json files other than .tf.json
+    configuration are if they start with terraform's version keys
+
+    """
+    if file.endswith(TF_EXTENSIONS):
+        return False
+    if file.endswith('.tfstate'):
+        return True
+    if not file.endswith('.json'):
+        return False
+    try:
+        with open(file, 'r') as fh:
+            head = fh.read(4096)
+    except (OSError, ValueError):
+        return False
+    return _STATE_HEAD.match(head) is not None
+
+
+def load_source(file):
+    """parsed terraform, terraform json configuration, state or plan json
+
+    """
+    if is_state_file(file):
+        return load_state(file)
+    return load_file(file)
+
+
+SHARD_MIN_RESOURCES = 64
+_shard_state = None
+
+
+def _shard_worker(bounds):
+    # transform a slice of the type forked in _transform_shards, returning
+    # each resource as modified with its result, as replayed from the cache
+    (tf_type, tf_resources, all_resources, stats) = _shard_state
+    if stats is True:
+        start_stats()
+    plan = get_transform_plan(tf_type)
+    shard = tf_resources[bounds[0]:bounds[1]]
+    results = transform_resources(tf_type, shard, all_resources)
+    return ([
+        (d, result, _api_path_updates(plan, relationships, all_resources))
+        for (_, d, relationships), result in zip(shard, results)
+    ], _worker_stats())
+
+
+def _transform_shards(tf_type, tf_resources, all_resources, shards):
+    """transform resources of a type in forked worker processes
+
+    workers are forked for each type, so see the parsed terraform as
+    modified by the types before, and results are returned in resource
+    order with the resources updated as if transformed in this process
+
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    global _shard_state
+    size = -(-len(tf_resources) // shards)
+    bounds = [
+        (i, min(i + size, len(tf_resources)))
+        for i in range(0, len(tf_resources), size)
+    ]
+    stats = _stats
+    _shard_state = (tf_type, tf_resources, all_resources, stats is not None)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=len(bounds),
+            mp_context=multiprocessing.get_context('fork')
+        ) as executor:
+            shard_results = list(executor.map(_shard_worker, bounds))
+    finally:
+        _shard_state = None
+    run_cache(all_resources).invalidate(tf_type)
+    results = []
+    i = 0
+    for (shard, worker_stats) in shard_results:
+        if worker_stats is not None:
+            stats.merge(worker_stats)
+        for (post_d, result, api_paths) in shard:
+            d = tf_resources[i][1]
+            d.clear()
+            d.update(post_d)
+            for ref_name, api_path in api_paths.items():
+                all_resources['aws_api_gateway_integration'][ref_name][
+                    '_api_path'
+                ] = api_path
+            results.append(result)
+            i += 1
+    return results
+
+
+def _can_shard(tf_type, tf_resources, cache, shards):
+    # forking is for large types of resources transformed independently
+    if shards is None or shards < 2 or cache is not None or \
+            len(tf_resources) < max(SHARD_MIN_RESOURCES, shards):
+        return False
+    if getattr(_local, 'diagnostics', None) is not None or \
+            not hasattr(os, 'fork'):
+        return False
+    plan = get_transform_plan(tf_type)
+    return tf_type not in [m[2]['type'] for m in plan.merge]
+
+
+def _transform_type(
+    tf_type, tf_resources, all_resources, cache=None, shards=None
+):
+    """transform resources of a type, returns (results, failed count)
+
+    while diagnostics are captured a failed type is retried a resource at a
+    time from a copy taken beforehand, so each error has the address of
+    the resource that failed.  with shards, large types are split across
+    that many forked worker processes
+
+    """
+    if _can_shard(tf_type, tf_resources, cache, shards):
+        return (_transform_shards(
+            tf_type, tf_resources, all_resources, shards
+        ), 0)
+    if getattr(_local, 'diagnostics', None) is None:
+        return (transform_resources(
+            tf_type, tf_resources, all_resources=all_resources, cache=cache
+        ), 0)
+    # resources are modified as they are transformed
+    source = pickle.dumps(
+        [d for (_, d, _) in tf_resources], protocol=pickle.HIGHEST_PROTOCOL
+    )
+    diagnostics = _local.diagnostics
+    try:
+        with capture_diagnostics() as captured:
+            results = transform_resources(
+                tf_type, tf_resources, all_resources=all_resources,
+                cache=cache
+            )
+        diagnostics += captured
+        return (results, 0)
+    except Exception as e:
+        # reports from the failed batch are replaced by the retries
+        exc = e
+    results = []
+    failed = 0
+    for (tf_name, _d, relationships), d in zip(
+        tf_resources, pickle.loads(source)
+    ):
+        try:
+            with capture_diagnostics() as captured:
+                results += transform_resources(
+                    tf_type, [(tf_name, d, relationships)],
+                    all_resources=all_resources
+                )
+            diagnostics += captured
+        except Exception as e:
+            failed += 1
+            _diagnostic('error', e if isinstance(e, Tf2SamError) else (
+                '%s: %s' % (type(e).__name__, e)
+            ), '%s.%s' % (tf_type, tf_name))
+    if failed == 0:
+        # only fails together, report against the type
+        failed = 1
+        _diagnostic('error', exc, tf_type)
+    return (results, failed)
+
+
+def build_template(data, filter=None, cache=None, shards=None):
+    """transform parsed terraform into sam template dict
+
+    shards transforms large types in that many forked worker processes,
+    with the same result
+
+    """
+    if len(data.get('resource', {})) == 0:
+        fatal('no resources defined')
+    resources = {}
+    merged_names = []
+    errors = []
+    failed = 0
+
+    # resolve any name references
+    with phase('references'):
+        for rd in config('references').get('name', []):
+            tf_type = rd['type']
+            tf_attr = rd['name_attribute']
+            if tf_type not in data['resource']:
+                continue
+            for tf_name, tf_d in data['resource'][tf_type].items():
+                if tf_attr not in tf_d:
+                    continue
+                data['resource'][tf_type][tf_name][tf_attr] = (
+                    '${%s.%s.id}' % (rd['target_type'], tf_d[tf_attr])
+                )
+
+    with phase('relationships'):
+        relationships = build_relationship_graph(data['resource'])
+    vars = {}
+
+    for tf_type, tf_resources in data['resource'].items():
+        _tf_resources = []
+        for tf_name, tf_d in tf_resources.items():
+            type_name = '%s.%s' % (tf_type, tf_name)
+            if filter is not None:
+                if re.match('^.*%s.*$' % filter, type_name):
+                    info('processing %s' % type_name)
+                else:
+                    continue
+            _tf_resources.append(
+                (tf_name, tf_d, relationships.view(type_name))
+            )
+        start = time.perf_counter()
+        with phase('transform'):
+            (results, _failed) = _transform_type(
+                tf_type, _tf_resources, data['resource'], cache, shards
+            )
+        failed += _failed
+        if _stats is not None:
+            _stats.add_type(
+                tf_type, len(_tf_resources), time.perf_counter() - start
+            )
+        for (_resources_d, _merged, _errors, _vars) in results:
+            vars.update(_vars)
+            resources.update(_resources_d)
+            errors += _errors
+            merged_names += _merged
+
+    for target_name in merged_names:
+        resources.pop(target_name, None)
+    fatal_if_errors(errors)
+    if failed > 0:
+        fatal('%s resource(s) failed to transform' % failed)
+
+    if len(resources) == 0:
+        fatal('no resources to write to template')
+
+    template = dict(config('template'))
+    if len(vars) > 0:
+        template['Parameters'] = {
+            v: {
+                'Type': 'String'
+            } for v in vars.keys()
+        }
+    template['Resources'] = resources
+    return template
+
+
+TransformResult = namedtuple('TransformResult', 'template diagnostics')
+
+
+def _parse_source(source):
+    # parsed document from hcl text, or a parsed document or resource dict
+    if isinstance(source, str):
+        try:
+            data = parse_hcl(source)
+        except ValueError as e:
+            fatal('unable to parse source: %s' % e)
+        data.setdefault('resource', {})
+        return data
+    if not isinstance(source, dict):
+        fatal('source must be terraform text or a parsed resource dict')
+    return source if 'resource' in source else {'resource': source}
+
+
+def transform_source(source, filter=None, copy=True):
+    """transform terraform to a sam template dict in process
+
+    source is terraform text, a parsed document or its resource dict, which
+    is copied rather than modified unless copy is False.  nothing is
+    printed, written or exited on, returns TransformResult with the
+    template, or None on failure, and a list of diagnostics, each a dict
+    with level, message and address (type.name) for resources that failed
+
+    """
+    with capture_diagnostics() as diagnostics:
+        try:
+            data = _parse_source(source)
+            if copy is True and not isinstance(source, str):
+                data = pickle.loads(pickle.dumps(
+                    data, protocol=pickle.HIGHEST_PROTOCOL
+                ))
+            return TransformResult(build_template(data, filter), diagnostics)
+        except Tf2SamError:
+            pass
+        except Exception as e:
+            diagnostics.append(_exception_diagnostic(e))
+    return TransformResult(None, diagnostics)
+
+
+# options of transform_file and transform_root.  print_yaml returns the
+# generated yaml rather than writing it, filter selects resources on a
+# pattern, incremental only re-transforms resources changed since the last
+# run, max_resources splits larger templates into nested stacks, shards
+# is the number of worker processes for large resource types,
+# reduce_depends_on drops redundant DependsOn and reports deploy waves and
+# lint runs cfn-lint, failing after the template is written on errors
+TransformOptions = namedtuple('TransformOptions', [
+    'print_yaml', 'filter', 'incremental', 'format', 'max_resources',
+    'shards', 'reduce_depends_on', 'lint'
+], defaults=[False, None, False, 'yaml', None, None, False, False])
+
+
+def _transform_parsed(data, file, name, options):
+    # cache, build, reduce, lint and emit the parsed terraform of name
+    cache = None
+    if options.incremental is True:
+        cache = TransformCache(TransformCache.file_for(name))
+    template = build_template(data, options.filter, cache, options.shards)
+    if cache is not None:
+        cache.save()
+    if options.reduce_depends_on is True:
+        _reduce_dependencies(template)
+    lint_errors = 0
+    if options.lint is True:
+        lint_errors = _lint(template, data['resource'])
+    with phase('emit'):
+        target = write_template(
+            template, file, options.print_yaml, options.format,
+            options.max_resources
+        )
+    if lint_errors > 0:
+        fatal('%s cfn-lint error(s) in %s' % (lint_errors, name))
+    return target
+
+
+def transform_file(file, **options):
+    """transform single terraform file
+
+    options are TransformOptions fields.  returns generated yaml if
+    print_yaml is True, otherwise the path of the written template
+
+    """
+    options = TransformOptions(**options)
+    if not os.path.isfile(file):
+        fatal('file %s not found' % file)
+    with phase('parse'):
+        data = load_source(file)
+    if len(data.get('resource', {})) == 0:
+        fatal('no resources defined in file %s' % file)
+    if _stats is not None:
+        _stats.files += 1
+    return _transform_parsed(data, file, file, options)
+
+
+def transform_root(root, jobs=None, **options):
+    """transform terraform root module directory and its local modules
+
+    files are parsed in jobs worker processes and options are
+    TransformOptions fields.  returns generated yaml if print_yaml is True,
+    otherwise the path of the template written to the root directory
+
+    """
+    options = TransformOptions(**options)
+    data = load_root(root, jobs)
+    if len(data['resource']) == 0:
+        fatal('no resources defined in %s' % root)
+    return _transform_parsed(
+        data, os.path.join(root, 'template.tf'), root, options
+    )
+
+
+# cloudformation template limits
+TEMPLATE_MAX_BYTES = 1024 * 1024
+TEMPLATE_MAX_RESOURCES = 500
+TEMPLATE_MAX_PARAMETERS = 200
+TEMPLATE_MAX_OUTPUTS = 200
+# compact json size of a nested stack's resources, leaving room for the
+# longer yaml or indented json emitted
+STACK_MAX_BYTES = 640 * 1024
+
+NestedStack = namedtuple('NestedStack', 'name template')
+_SUB_VAR = re.compile(r'[$]{(?!!)([^}]+)}')
+
+
+def template_refs(obj, refs=None):
+    """(logical id, attribute or None) of each Ref, Fn::GetAtt and Fn::Sub
+    variable in obj
+
+    """
+    if refs is None:
+        refs = []
+    if isinstance(obj, dict):
+        if len(obj) == 1:
+            if 'Ref' in obj and isinstance(obj['Ref'], str):
+                refs.append((obj['Ref'], None))
+                return refs
+            get_att = obj.get('Fn::GetAtt')
+            if isinstance(get_att, str):
+                get_att = get_att.split('.', 1)
+            if isinstance(get_att, list) and len(get_att) == 2:
+                refs.append((get_att[0], get_att[1]))
+                return refs
+            sub = obj.get('Fn::Sub')
+            if isinstance(sub, str):
+                sub = [sub, {}]
+            if isinstance(sub, list) and len(sub) == 2 and \
+                    isinstance(sub[0], str) and isinstance(sub[1], dict):
+                for var in _SUB_VAR.findall(sub[0]):
+                    if var not in sub[1]:
+                        ref = var.split('.', 1)
+                        refs.append((ref[0], ref[1] if len(ref) > 1 else None))
+                template_refs(sub[1], refs)
+                return refs
+        for v in obj.values():
+            template_refs(v, refs)
+    elif isinstance(obj, list):
+        for v in obj:
+            template_refs(v, refs)
+    return refs
+
+
+def _replace_get_atts(obj, names):
+    # Fn::GetAtt of resources in other stacks become Refs of parameters
+    if isinstance(obj, dict):
+        if len(obj) == 1 and 'Fn::GetAtt' in obj:
+            get_att = obj['Fn::GetAtt']
+            if isinstance(get_att, str):
+                get_att = get_att.split('.', 1)
+            name = names.get(tuple(get_att))
+            if name is not None:
+                return {'Ref': name}
+        if len(obj) == 1 and 'Fn::Sub' in obj:
+            sub = obj['Fn::Sub']
+            text = sub if isinstance(sub, str) else sub[0]
+            if isinstance(text, str):
+                text = _SUB_VAR.sub(lambda m: '${%s}' % names.get(
+                    tuple(m.group(1).split('.', 1)), m.group(1)
+                ), text)
+                return {'Fn::Sub': text if isinstance(sub, str) else (
+                    [text] + _replace_get_atts(sub[1:], names)
+                )}
+        return {k: _replace_get_atts(v, names) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_replace_get_atts(v, names) for v in obj]
+    return obj
+
+
+def _depends_on(resource):
+    depends_on = resource.get('DependsOn', [])
+    return [depends_on] if isinstance(depends_on, str) else depends_on
+
+
+def _stack_order(graph):
+    # referenced resources before the resources referencing them, each
+    # followed from the first in template order to keep related ones close
+    order = []
+    visited = bytearray(len(graph))
+    for start in range(len(graph)):
+        if visited[start]:
+            continue
+        visited[start] = 1
+        stack = [(start, iter(graph.refs[start]))]
+        while stack:
+            (node, refs) = stack[-1]
+            for ref in refs:
+                if not visited[ref]:
+                    visited[ref] = 1
+                    stack.append((ref, iter(graph.refs[ref])))
+                    break
+            else:
+                stack.pop()
+                order.append(node)
+    return order
+
+
+def _components(graph, order):
+    # connected resources in order, components by first resource in order
+    component = [-1] * len(graph)
+    components = []
+    for start in order:
+        if component[start] >= 0:
+            continue
+        component[start] = len(components)
+        pending = [start]
+        while pending:
+            node = pending.pop()
+            for other in graph.adjacent[node]:
+                if component[other] < 0:
+                    component[other] = len(components)
+                    pending.append(other)
+        components.append([])
+    for node in order:
+        components[component[node]].append(node)
+    return components
+
+
+def _units(size, together):
+    # union find of nodes that must be in the same stack
+    unit = list(range(size))
+
+    def _find(node):
+        while unit[node] != node:
+            unit[node] = unit[unit[node]]
+            node = unit[node]
+        return node
+    for (a, b) in together:
+        unit[_find(a)] = _find(b)
+    return [_find(node) for node in range(size)]
+
+
+def _cut_component(graph, nodes, unit, sizes, max_resources, max_bytes):
+    # stacks are grown from units whose references are all in earlier
+    # stacks or this one, most edges into the stack first, so a stack only
+    # references stacks before it and few edges are cut.  nodes are in
+    # dependency order, which breaks ties
+    members = {}
+    for node in nodes:
+        members.setdefault(unit[node], []).append(node)
+    pos = {root: i for i, root in enumerate(members)}
+    for _nodes in members.values():
+        if len(_nodes) > max_resources:
+            fatal('%s must be in the same stack, more than %s resources' % (
+                ', '.join(graph.names[n] for n in _nodes), max_resources
+            ))
+    pending = {root: set() for root in members}
+    referrers = {root: set() for root in members}
+    edges = {root: {} for root in members}
+    for node in nodes:
+        a = unit[node]
+        for ref in graph.refs[node]:
+            if unit[ref] != a:
+                pending[a].add(unit[ref])
+                referrers[unit[ref]].add(a)
+        for other in graph.adjacent[node]:
+            b = unit[other]
+            if b != a:
+                edges[a][b] = edges[a].get(b, 0) + 1
+    ready = set(root for root in members if len(pending[root]) == 0)
+    assigned = set()
+    bins = []
+    while len(assigned) < len(members):
+        current = [[], 0]
+        score = {}
+        heap = [(0, pos[root], root) for root in ready]
+        heapq.heapify(heap)
+        while heap:
+            (_score, _, root) = heapq.heappop(heap)
+            if root in assigned or -_score != score.get(root, 0):
+                continue
+            size = sum(sizes[n] for n in members[root])
+            if len(current[0]) > 0 and (
+                len(current[0]) + len(members[root]) > max_resources or
+                current[1] + size > max_bytes
+            ):
+                continue
+            current[0] += members[root]
+            current[1] += size
+            assigned.add(root)
+            ready.discard(root)
+            for other in referrers[root]:
+                pending[other].discard(root)
+                if len(pending[other]) == 0 and other not in assigned:
+                    ready.add(other)
+                    heapq.heappush(heap, (
+                        -score.get(other, 0), pos[other], other
+                    ))
+            for other, count in edges[root].items():
+                if other not in assigned:
+                    score[other] = score.get(other, 0) + count
+                    if other in ready:
+                        heapq.heappush(heap, (
+                            -score[other], pos[other], other
+                        ))
+        if len(current[0]) == 0:
+            # references in a cycle, the first left in dependency order
+            ready.add(min(
+                (root for root in members if root not in assigned),
+                key=pos.get
+            ))
+            continue
+        bins.append(current)
+    return bins
+
+
+def _assign_stacks(graph, sizes, max_resources, max_bytes, together=()):
+    # components that fit are kept whole, so never referenced across
+    # stacks.  larger ones are cut, never between together pairs of nodes
+    unit = _units(len(graph), together)
+    bins = []
+    whole = []
+    for nodes in _components(graph, _stack_order(graph)):
+        if len(nodes) <= max_resources and \
+                sum(sizes[n] for n in nodes) <= max_bytes:
+            whole.append(nodes)
+            continue
+        bins += _cut_component(
+            graph, nodes, unit, sizes, max_resources, max_bytes
+        )
+    # first fit decreasing
+    whole.sort(key=lambda nodes: -len(nodes))
+    for nodes in whole:
+        size = sum(sizes[n] for n in nodes)
+        for _bin in bins:
+            if len(_bin[0]) + len(nodes) <= max_resources and \
+                    _bin[1] + size <= max_bytes:
+                break
+        else:
+            _bin = [[], 0]
+            bins.append(_bin)
+        _bin[0] += nodes
+        _bin[1] += size
+    return [sorted(nodes) for (nodes, _) in bins]
+
+
+def partition_template(
+    template, max_resources, max_bytes=STACK_MAX_BYTES, location=None
+):
+    """split template into a parent and nested stacks of at most
+    max_resources resources
+
+    related resources are kept in the same stack where they fit, and a
+    sam resource is always with the resources its events reference.  refs
+    between stacks are passed through stack outputs and parameters, and
+    DependsOn another stack becomes DependsOn between the nested stacks.
+    returns (parent, [NestedStack]), or (template, []) if the template
+    already fits.  location(name) gives a nested template's location,
+    defaulting to name.yaml
+
+    """
+    resources = template.get('Resources', {})
+    sizes = [
+        len(json.dumps(r, separators=(',', ':'))) for r in resources.values()
+    ]
+    if len(resources) <= max_resources and sum(sizes) <= max_bytes:
+        return (template, [])
+    parameters = template.get('Parameters', {})
+
+    graph = RelationshipGraph()
+    for name in resources:
+        graph.node(name)
+    refs = {}
+    together = []
+    for name, resource in resources.items():
+        refs[name] = [
+            (ref, attr) for (ref, attr) in template_refs(resource)
+            if ref in resources and ref != name
+        ]
+        for (ref, _) in refs[name]:
+            graph.add_edge(name, ref)
+        for ref in _depends_on(resource):
+            if ref in resources:
+                graph.add_edge(name, ref)
+        # the sam transform resolves event sources, such as RestApiId,
+        # within the template, so they cannot become parameters
+        if str(resource.get('Type')).startswith('AWS::Serverless::'):
+            together += [
+                (graph.ids[name], graph.ids[ref]) for (ref, _) in (
+                    template_refs(resource.get('Properties', {}).get(
+                        'Events', {}
+                    ))
+                ) if ref in resources and ref != name
+            ]
+
+    names = graph.names
+    stack_of = {}
+    stacks = []
+    for i, nodes in enumerate(_assign_stacks(
+        graph, sizes, max_resources, max_bytes, together
+    )):
+        stacks.append(('Stack%s' % (i + 1), [names[node] for node in nodes]))
+        for name in stacks[-1][1]:
+            stack_of[name] = stacks[-1][0]
+
+    base = {k: v for k, v in template.items() if k in (
+        'AWSTemplateFormatVersion', 'Transform'
+    )}
+    outputs = {stack_name: {} for (stack_name, _) in stacks}
+    nested = []
+    parent_resources = {}
+    for (stack_name, stack) in stacks:
+        _parameters = {}
+        args = {}
+        depends_on = set()
+        get_atts = {}
+        _resources = {}
+        for name in stack:
+            for (ref, attr) in refs[name]:
+                other = stack_of[ref]
+                if other == stack_name:
+                    continue
+                # same name as the resource for Ref, so Refs stay as is
+                output = ref if attr is None else '%s%s' % (
+                    ref, attr.replace('.', '')
+                )
+                if output in resources and attr is not None:
+                    fatal('stack output %s clashes with a resource' % output)
+                outputs[other][output] = {'Value': (
+                    {'Ref': ref} if attr is None else
+                    {'Fn::GetAtt': [ref, attr]}
+                )}
+                _parameters[output] = {'Type': 'String'}
+                args[output] = {
+                    'Fn::GetAtt': [other, 'Outputs.%s' % output]
+                }
+                if attr is not None:
+                    get_atts[(ref, attr)] = output
+            resource = resources[name]
+            if len(get_atts) > 0:
+                resource = _replace_get_atts(resource, get_atts)
+            if 'DependsOn' in resource:
+                _depends = _depends_on(resource)
+                local = [d for d in _depends if stack_of.get(d) in (
+                    None, stack_name
+                )]
+                depends_on.update(
+                    stack_of[d] for d in _depends if d not in local
+                )
+                if len(local) < len(_depends):
+                    resource = dict(resource)
+                    if len(local) > 0:
+                        resource['DependsOn'] = local
+                    else:
+                        del resource['DependsOn']
+            _resources[name] = resource
+        for (ref, _) in template_refs(_resources):
+            if ref in parameters and ref not in _parameters:
+                _parameters[ref] = parameters[ref]
+                args[ref] = {'Ref': ref}
+        _template = dict(base)
+        if len(_parameters) > 0:
+            _template['Parameters'] = dict(sorted(_parameters.items()))
+        _template['Resources'] = _resources
+        nested.append(NestedStack(stack_name, _template))
+        properties = {'Location': (
+            '%s.yaml' % stack_name.lower() if location is None
+            else location(stack_name)
+        )}
+        if len(args) > 0:
+            properties['Parameters'] = dict(sorted(args.items()))
+        parent_resources[stack_name] = {
+            'Type': 'AWS::Serverless::Application',
+            'Properties': properties
+        }
+        depends_on.difference_update(a['Fn::GetAtt'][0] for a in (
+            args.values()
+        ) if 'Fn::GetAtt' in a)
+        if len(depends_on) > 0:
+            parent_resources[stack_name]['DependsOn'] = sorted(
+                depends_on, key=lambda name: int(name[5:])
+            )
+    for stack in nested:
+        if len(outputs[stack.name]) > 0:
+            stack.template['Outputs'] = outputs[stack.name]
+
+    parent = {
+        k: v for k, v in template.items() if k not in ('Resources', 'Outputs')
+    }
+    parent['Resources'] = parent_resources
+    return (parent, nested)
+
+
+DependencyReport = namedtuple(
+    'DependencyReport', 'removed depends_on waves critical_path'
+)
+
+
+def _dependency_order(deps):
+    # resources after the resources they depend on, None if there's a cycle
+    order = []
+    state = dict.fromkeys(deps, 0)
+    for start in deps:
+        if state[start] != 0:
+            continue
+        state[start] = 1
+        stack = [(start, iter(deps[start]))]
+        while stack:
+            (name, pending) = stack[-1]
+            for dep in pending:
+                if state[dep] == 1:
+                    return None
+                if state[dep] == 0:
+                    state[dep] = 1
+                    stack.append((dep, iter(deps[dep])))
+                    break
+            else:
+                stack.pop()
+                state[name] = 2
+                order.append(name)
+    return order
+
+
+def reduce_dependencies(template):
+    """remove DependsOn entries implied by other dependencies
+
+    dependencies are DependsOn plus Ref, Fn::GetAtt and Fn::Sub refs
+    between resources.  a DependsOn is dropped when the resource already
+    depends on it through a ref or another dependency.  the template is
+    modified in place, returns a DependencyReport with the number of
+    DependsOn removed and left, the deploy waves, resources whose
+    dependencies are all in earlier waves, and the longest dependency
+    chain.  returns None, leaving the template as is, if there's a cycle
+
+    """
+    resources = template.get('Resources', {})
+    implicit = {}
+    deps = {}
+    for name, resource in resources.items():
+        implicit[name] = set(
+            ref for (ref, _) in template_refs(resource)
+            if ref in resources and ref != name
+        )
+        deps[name] = implicit[name].union(
+            d for d in _depends_on(resource) if d in resources
+        )
+    order = _dependency_order(deps)
+    if order is None:
+        error('DependsOn not reduced, resources depend on each other')
+        return None
+
+    # reachable sets are only built for resources with DependsOn
+    removed = 0
+    remaining = 0
+    for name, resource in resources.items():
+        if 'DependsOn' not in resource:
+            continue
+        indirect = set(implicit[name])
+        pending = list(deps[name])
+        while pending:
+            for dep in deps[pending.pop()]:
+                if dep not in indirect:
+                    indirect.add(dep)
+                    pending.append(dep)
+        depends_on = _depends_on(resource)
+        kept = []
+        for dep in depends_on:
+            if dep not in indirect and dep not in kept:
+                kept.append(dep)
+        removed += len(depends_on) - len(kept)
+        remaining += len(kept)
+        if len(kept) == 0:
+            del resource['DependsOn']
+        elif len(kept) < len(depends_on):
+            resource['DependsOn'] = kept
+
+    # reachability is unchanged, so are the waves
+    wave = {}
+    previous = {}
+    for name in order:
+        wave[name] = 0
+        for dep in deps[name]:
+            if wave[dep] + 1 > wave[name]:
+                (wave[name], previous[name]) = (wave[dep] + 1, dep)
+    waves = []
+    for name in resources:
+        while len(waves) <= wave[name]:
+            waves.append([])
+        waves[wave[name]].append(name)
+    critical_path = []
+    if len(waves) > 0:
+        name = waves[-1][0]
+        while name is not None:
+            critical_path.insert(0, name)
+            name = previous.get(name)
+    return DependencyReport(removed, remaining, waves, critical_path)
+
+
+def _reduce_dependencies(template):
+    # reduce and report to stderr with the stack reports
+    report = reduce_dependencies(template)
+    if report is not None:
+        print_dependency_report(report)
+
+
+def print_dependency_report(report, fh=None):
+    """print DependsOn removed, deploy waves and critical path
+
+    """
+    fh = sys.stderr if fh is None else fh
+    print('DependsOn: %s removed, %s left' % (
+        report.removed, report.depends_on
+    ), file=fh)
+    print('deploy waves: %s (%s resources)' % (
+        len(report.waves), ', '.join(str(len(w)) for w in report.waves)
+    ), file=fh)
+    print('critical path: %s' % ' -> '.join(report.critical_path), file=fh)
+
+
+LINT_REGIONS = ['us-east-1']
+_linter = None
+
+
+def linter():
+    """function running cfn-lint on a template dict, loading cfn-lint, its
+    rules and the resource spec once, so forked workers share them
+
+    uses cfnlint.core.run_checks from cfn-lint 0.x, or
+    cfnlint.runner.run_template_by_data from 1.x
+
+    """
+    global _linter
+    if _linter is not None:
+        return _linter
+    import logging
+    try:
+        import cfnlint  # noqa: F401
+    except ImportError:
+        fatal('linting requires cfn-lint, pip install cfn-lint')
+    # samtranslator logs a warning for metrics it isn't asked to publish
+    logging.getLogger('samtranslator').setLevel(logging.ERROR)
+    try:
+        from cfnlint.core import get_rules, run_checks
+        rules = get_rules([], [], [])
+
+        def _lint(template):
+            return run_checks('template', template, rules, LINT_REGIONS)
+    except ImportError:
+        try:
+            from cfnlint.config import ManualArgs
+            from cfnlint.runner import run_template_by_data
+        except ImportError:
+            fatal('unsupported cfn-lint version %s' % getattr(
+                cfnlint, '__version__', ''
+            ))
+        args = ManualArgs(regions=LINT_REGIONS)
+
+        def _lint(template):
+            return list(run_template_by_data(template, args))
+    _linter = _lint
+    return _linter
+
+
+def template_addresses(resources):
+    """logical id to terraform address of each parsed terraform resource
+
+    """
+    return {
+        transform_type_name('%s.%s' % (tf_type, tf_name))[1]: '%s.%s' % (
+            tf_type, tf_name
+        )
+        for tf_type, tf_resources in resources.items()
+        for tf_name in tf_resources
+    }
+
+
+def _lint_address(path, addresses):
+    # resources added by rules or generated by the SAM transform are named
+    # after the resource they come from
+    if len(path) < 2 or not isinstance(path[1], str):
+        return None
+    if path[0] == 'Parameters':
+        return path[1]
+    if path[0] != 'Resources':
+        return None
+    for i in range(len(path[1]), 0, -1):
+        address = addresses.get(path[1][0:i])
+        if address is not None:
+            return address
+    return None
+
+
+def lint_template(template, addresses=None):
+    """cfn-lint template dict in process, returns a list of diagnostics
+
+    each diagnostic is a dict with level (error, warning or
+    informational), rule, message, path and, with addresses from
+    template_addresses(), the terraform address of the resource or the
+    variable it's from
+
+    """
+    lint = linter()
+    # cfn-lint modifies the template when applying the SAM transform
+    matches = lint(pickle.loads(pickle.dumps(
+        template, protocol=pickle.HIGHEST_PROTOCOL
+    )))
+    diagnostics = []
+    for match in matches:
+        diagnostic = {
+            'level': match.rule.severity,
+            'rule': match.rule.id,
+            'message': match.message,
+            'path': '/'.join(str(p) for p in match.path)
+        }
+        address = _lint_address(match.path, addresses or {})
+        if address is not None:
+            diagnostic['address'] = address
+        diagnostics.append(diagnostic)
+    return diagnostics
+
+
+def _lint(template, resources):
+    # report lint diagnostics by terraform address, returns error count
+    errors = 0
+    for d in lint_template(template, template_addresses(resources)):
+        msg = '[%s] %s%s (%s)' % (
+            d['rule'], '' if 'address' not in d else d['address'] + ': ',
+            d['message'], d['path']
+        )
+        if d['level'] == 'error':
+            errors += 1
+            error(msg)
+        elif not _diagnostic(d['level'], msg, d.get('address')):
+            print(color.yellow('%s: %s' % (d['level'].upper(), msg)))
+    return errors
+
+
+def write_template(
+    template, file, print_yaml=False, format='yaml', max_resources=None
+):
+    """write template next to terraform file, or return it if print_yaml
+
+    with max_resources a larger template is written as a parent and nested
+    stack templates, file.stack1.yaml and so on, and each stack's size is
+    reported to stderr
+
+    """
+    # file is only used for names of nested stacks when printing
+    base = 'template' if file is None else '.'.join(file.split('.')[0:(
+        -2 if file.endswith('.tf.json') else -1
+    )])
+    target_file = base + '.' + format
+    stacks = []
+    if max_resources is not None:
+        (template, stacks) = partition_template(
+            template, max_resources, location=lambda name: '%s.%s.%s' % (
+                os.path.basename(base), name.lower(), format
+            )
+        )
+    if print_yaml is True:
+        fh = io.StringIO()
+        emit_template(template, fh, format)
+        for stack in stacks:
+            fh.write('# %s\n' % (
+                template['Resources'][stack.name]['Properties']['Location']
+            ))
+            _emit_stack(stack, fh, format)
+        return fh.getvalue()
+    if target_file == file:
+        fatal('template %s would overwrite its source' % target_file)
+    with open(target_file, 'w') as fh:
+        emit_template(template, fh, format)
+    for stack in stacks:
+        with open('%s.%s.%s' % (base, stack.name.lower(), format), 'w') as fh:
+            _emit_stack(stack, fh, format)
+    return target_file
+
+
+def _emit_stack(stack, fh, format):
+    # emit nested stack template, reporting its size against the limits
+    buffer = io.StringIO()
+    emit_template(stack.template, buffer, format)
+    text = buffer.getvalue()
+    fh.write(text)
+    size = len(text.encode('utf-8'))
+    counts = [len(stack.template.get(k, {})) for k in (
+        'Resources', 'Parameters', 'Outputs'
+    )]
+    print('%s: %s resources, %s parameters, %s outputs, %s bytes' % (
+        stack.name, counts[0], counts[1], counts[2], size
+    ), file=sys.stderr)
+    for (count, limit, what) in [
+        (size, TEMPLATE_MAX_BYTES, 'bytes'),
+        (counts[0], TEMPLATE_MAX_RESOURCES, 'resources'),
+        (counts[1], TEMPLATE_MAX_PARAMETERS, 'parameters'),
+        (counts[2], TEMPLATE_MAX_OUTPUTS, 'outputs')
+    ]:
+        if count > limit:
+            error('%s has %s %s, over the limit of %s' % (
+                stack.name, count, what, limit
+            ))
+
+
+_yaml_dumper = None
+
+
+def yaml_dumper():
+    """cfn_flip yaml dumper representing plain dicts and tuples directly
+
+    """
+    global _yaml_dumper
+    if _yaml_dumper is not None:
+        return _yaml_dumper
+    import cfn_clean
+    from cfn_flip import get_dumper
+    from cfn_flip.yaml_dumper import map_representer
+    from cfn_tools.literal import LiteralString
+
+    literal_keys = dict(cfn_clean.UNCONVERTED_KEYS)
+
+    class TemplateDumper(get_dumper(False, False)):
+
+        def ignore_aliases(self, data):
+            return True
+
+    def _dict_representer(dumper, value):
+        # same result as the json round trip and cfn_literal_parser
+        if not all(isinstance(k, str) for k in value):
+            value = {
+                k if isinstance(k, str) else json.dumps(k): v
+                for k, v in value.items()
+            }
+        prop = literal_keys.get(value.get('Type'))
+        if prop is not None and isinstance(value.get('Properties'), dict):
+            literal = value['Properties'].get(prop)
+            if literal and isinstance(literal, dict) and \
+                    not cfn_clean.has_intrinsic_functions(literal.keys()):
+                value = dict(value)
+                value['Properties'] = dict(value['Properties'])
+                value['Properties'][prop] = LiteralString(json.dumps(
+                    literal, indent=2, separators=(',', ': ')
+                ))
+        return map_representer(dumper, value)
+
+    TemplateDumper.add_representer(dict, _dict_representer)
+    TemplateDumper.add_representer(
+        tuple, TemplateDumper.represent_list
+    )
+    _yaml_dumper = TemplateDumper
+    return _yaml_dumper
+
+
+class _YamlUnsupported(Exception):
+    pass
+
+
+# plain scalars and the text of quoted ones, as the cfn_flip dumper writes
+# them, by (string, tagged)
+_yaml_scalars = {}
+_yaml_scalar_state = None
+_YAML_WIDTH = 200
+_YAML_INTRINSICS = ('Ref', 'Condition')
+
+
+def _yaml_state():
+    # cfn_flip dumper used to analyze scalars, and the node type to resolve
+    global _yaml_scalar_state
+    if _yaml_scalar_state is None:
+        import yaml
+        _yaml_scalar_state = (
+            yaml_dumper()(io.StringIO(), allow_unicode=True),
+            yaml.ScalarNode
+        )
+    return _yaml_scalar_state
+
+
+def _yaml_scalar(value, tagged=False):
+    # text of a string as the cfn_flip dumper would write it, or None for
+    # the styles left to it: block, folded and double quoted
+    text = _yaml_scalars.get((value, tagged))
+    if text is not None:
+        return text
+    (dumper, node) = _yaml_state()
+    if '\n' in value or '\r' in value or (
+        len(value) >= _YAML_WIDTH and tagged is False
+    ):
+        return None
+    analysis = dumper.analyze_scalar(value)
+    if tagged is False and not value.startswith('0') and \
+            analysis.allow_block_plain and dumper.resolve(
+                node, value, (True, False)
+            ) == 'tag:yaml.org,2002:str':
+        text = value
+    elif analysis.allow_single_quoted:
+        text = "'%s'" % value.replace("'", "''")
+    else:
+        return None
+    if len(_yaml_scalars) > 100000:
+        _yaml_scalars.clear()
+    _yaml_scalars[(value, tagged)] = text
+    return text
+
+
+def _yaml_literal(value, indent):
+    # literal block the cfn_flip dumper writes strings of many lines as,
+    # lines after the first at indent, blank lines left empty
+    if '\r' in value or '\x85' in value or '\u2028' in value or \
+            '\u2029' in value:
+        raise _YamlUnsupported()
+    if value.endswith('\n\n') or value == '\n':
+        # keep chomping, which ends the document open
+        raise _YamlUnsupported()
+    if not _yaml_state()[0].analyze_scalar(value).allow_block:
+        raise _YamlUnsupported()
+    hints = ('2' if value[0] in ' \n' else '') + (
+        '' if value.endswith('\n') else '-'
+    )
+    pad = ' ' * indent
+    lines = value.split('\n')
+    if value.endswith('\n'):
+        lines.pop()
+    return '|%s\n%s' % (hints, ''.join(
+        '%s%s\n' % (pad, line) if line != '' else '\n' for line in lines
+    ))
+
+
+def _yaml_value(value, indent, col, out, tag=None):
+    # write value after a mapping key or tag (col is the column written to)
+    # or after a sequence dash (col == indent), ending the line
+    t = type(value)
+    if t is str and tag is None and value.count('\n') >= 10:
+        text = _yaml_literal(value, indent if col == indent else indent + 2)
+        out.append(text if col == indent else ' ' + text)
+        return
+    if t is str:
+        text = _yaml_scalar(value, tag is not None)
+        if text is None or (' ' in text and col + len(text) >= _YAML_WIDTH):
+            raise _YamlUnsupported()
+        out.append(text if col == indent else ' ' + text)
+    elif tag is not None:
+        raise _YamlUnsupported()
+    elif t is bool:
+        out.append(('true' if value else 'false') if col == indent else (
+            ' true' if value else ' false'
+        ))
+    elif t is int:
+        out.append(str(value) if col == indent else ' %s' % value)
+    elif value is None:
+        out.append('null' if col == indent else ' null')
+    else:
+        raise _YamlUnsupported()
+    out.append('\n')
+
+
+def _yaml_node(value, indent, col, out):
+    # write a node after a mapping key (col > indent) or a sequence dash
+    # (col == indent), children of a mapping key are indented under it
+    t = type(value)
+    if t is dict:
+        if len(value) == 1:
+            for key in value:
+                if key in _YAML_INTRINSICS or key.startswith('Fn::'):
+                    tag = '!' + (key if key in _YAML_INTRINSICS else key[4:])
+                    value = value[key]
+                    if tag == '!GetAtt' and isinstance(value, list):
+                        value = '.'.join(value)
+                    dash = col == indent
+                    out.append(tag if dash else ' ' + tag)
+                    col += len(tag) + (0 if dash else 1)
+                    t = type(value)
+                    if t is dict or t is list or t is tuple:
+                        if len(value) == 0:
+                            out.append(' {}\n' if t is dict else ' []\n')
+                        else:
+                            out.append('\n')
+                            _yaml_block(
+                                value, indent if dash else indent + 2, out
+                            )
+                    else:
+                        _yaml_value(value, indent, col, out, tag)
+                    return
+        if len(value) == 0:
+            out.append('{}\n' if col == indent else ' {}\n')
+        elif col == indent:
+            _yaml_block(value, indent, out, True)
+        else:
+            out.append('\n')
+            _yaml_block(value, indent + 2, out)
+    elif t is list or t is tuple:
+        if len(value) == 0:
+            out.append('[]\n' if col == indent else ' []\n')
+        elif col == indent:
+            _yaml_block(value, indent, out, True)
+        else:
+            out.append('\n')
+            _yaml_block(value, indent + 2, out)
+    else:
+        _yaml_value(value, indent, col, out)
+
+
+def _yaml_block(value, indent, out, inline=False):
+    # block mapping or sequence at indent, the first entry continuing the
+    # current line if inline
+    pad = ' ' * indent
+    if type(value) is dict:
+        if value.get('Type') in _literal_types() and \
+                isinstance(value.get('Properties'), dict):
+            raise _YamlUnsupported()
+        for i, (key, v) in enumerate(value.items()):
+            # the dumper writes a key as ? key once it and its !!str tag
+            # reach 128 characters
+            if type(key) is not str or len(key) >= 123 or key == '':
+                raise _YamlUnsupported()
+            text = _yaml_scalar(key)
+            if text is None:
+                raise _YamlUnsupported()
+            out.append('%s:' % text if inline and i == 0 else (
+                '%s%s:' % (pad, text)
+            ))
+            _yaml_node(v, indent, indent + len(text) + 1, out)
+        return
+    for i, v in enumerate(value):
+        out.append('- ' if inline and i == 0 else pad + '- ')
+        _yaml_node(v, indent + 2, indent + 2, out)
+
+
+@lru_cache(maxsize=1)
+def _literal_types():
+    import cfn_clean
+    return frozenset(dict(cfn_clean.UNCONVERTED_KEYS))
+
+
+def _emit_yaml(key, value, indent=0):
+    # yaml of {key: value} as cfn_flip writes it, None where the cfn_flip
+    # dumper is needed
+    out = []
+    try:
+        _yaml_block({key: value}, indent, out)
+    except (_YamlUnsupported, TypeError):
+        return None
+    return ''.join(out)
+
+
+def emit_template(template, fh, format='yaml'):
+    """stream template to file handle resource by resource
+
+    yaml output matches cfn_flip.to_yaml, json output matches
+    json.dumps(template, indent=4)
+
+    """
+    if format == 'json':
+        fh.write('{')
+        for i, (key, value) in enumerate(template.items()):
+            fh.write('%s\n    %s: ' % (',' if i > 0 else '', json.dumps(key)))
+            if key != 'Resources' or len(value) == 0:
+                fh.write(json.dumps(value, indent=4).replace('\n', '\n    '))
+                continue
+            fh.write('{')
+            for j, (name, resource) in enumerate(value.items()):
+                fh.write('%s\n        %s: %s' % (
+                    ',' if j > 0 else '', json.dumps(name),
+                    json.dumps(resource, indent=4).replace(
+                        '\n', '\n        '
+                    )
+                ))
+            fh.write('\n    }')
+        fh.write('\n}' if len(template) > 0 else '}')
+        return
+
+    import yaml
+    from cfn_flip import config as cfn_flip_config
+    dumper = yaml_dumper()
+
+    def _dump(key, value):
+        return yaml.dump(
+            {key: value},
+            Dumper=dumper,
+            default_flow_style=False,
+            allow_unicode=True,
+            sort_keys=False,
+            width=cfn_flip_config.max_col_width
+        )
+
+    # plain values, intrinsics and block strings are written directly,
+    # anything else, such as floats, by the cfn_flip dumper
+    for key, value in template.items():
+        if key != 'Resources' or len(value) == 0:
+            fh.write(_emit_yaml(key, value) or _dump(key, value))
+            continue
+        fh.write('%s:\n' % _yaml_scalar(key))
+        # a resource the dumper writes is dumped under Resources, keeping
+        # indent and line wrapping identical, without the Resources: line
+        for name, resource in value.items():
+            txt = _emit_yaml(name, resource, 2)
+            if txt is None:
+                txt = _dump(key, {name: resource})
+                txt = txt[txt.index('\n') + 1:]
+            fh.write(txt)
+
+
+class Watcher(object):
+    """keeps parsed terraform, config and transform results in memory and
+    re-transforms files when they or config change
+
+    """
+
+    def __init__(self, paths, filter=None, format='yaml'):
+        self.paths = paths
+        self.filter = filter
+        self.format = format
+        self.config_dir = os.path.join(ROOT_DIR, 'config')
+        self.config_manifest = None
+        # file -> (stat, pickled source, TransformCache)
+        self.files = {}
+
+    def _changed_config(self):
+        manifest = _config_manifest(self.config_dir)
+        changed = (
+            self.config_manifest is not None
+            and manifest != self.config_manifest
+        )
+        self.config_manifest = manifest
+        return changed
+
+    def poll(self):
+        """transform new or changed files, returns list of results
+
+        each result is (file, target file or None on error, re-transformed
+        resource count, total resource count, elapsed ms)
+
+        """
+        results = []
+        config_changed = self._changed_config()
+        if config_changed is True:
+            info('config changed, reloading')
+            reset_config()
+        files = _expand_files(self.paths)
+        for file in list(self.files.keys()):
+            if file not in files:
+                self.files.pop(file)
+        for file in files:
+            try:
+                st = os.stat(file)
+            except OSError:
+                continue
+            stat = (st.st_mtime_ns, st.st_size)
+            (_stat, source, cache) = self.files.get(file, (None, None, None))
+            if stat == _stat and config_changed is False:
+                continue
+            if cache is None or config_changed is True:
+                cache = TransformCache()
+            start = time.perf_counter()
+            misses = cache.misses
+            try:
+                if stat != _stat or source is None:
+                    data = load_source(file)
+                    source = pickle.dumps(
+                        data, protocol=pickle.HIGHEST_PROTOCOL
+                    )
+                else:
+                    # config change, reuse parsed terraform
+                    data = pickle.loads(source)
+                template = build_template(data, self.filter, cache)
+                cache.prune()
+                target = write_template(
+                    template, file, format=self.format
+                )
+            except SystemExit:
+                target = None
+            except Exception as e:
+                # report the file as failed and keep watching
+                error('%s: %s: %s' % (file, type(e).__name__, e))
+                target = None
+            self.files[file] = (stat, source, cache)
+            results.append((
+                file, target, cache.misses - misses, len(cache.entries),
+                (time.perf_counter() - start) * 1000
+            ))
+        return results
+
+
+def _init_worker(_shared_config, _shared_config_digest):
+    # share config loaded by the parent rather than reloading per worker
+    global _config, _config_digest
+    (_config, _config_digest) = (_shared_config, _shared_config_digest)
+
+
+def _transform_worker(file, options, stats=False):
+    # fatal() exits, so trap it to report per file rather than abort pool
+    if stats is True:
+        start_stats()
+    try:
+        return (file, True, transform_file(
+            file, **options._asdict()
+        ), _worker_stats())
+    except SystemExit:
+        return (file, False, None, _worker_stats())
+    except Exception as e:
+        print_exc()
+        return (file, False, str(e), _worker_stats())
+
+
+def _worker_stats():
+    stats = stop_stats()
+    return None if stats is None else stats.to_dict()
+
+
+@arg('files', nargs='+', help='terraform files, directories or glob patterns')
+@arg(
+    '-p', '--print-yaml',
+    help='print generated yaml instead of writing to file'
+)
+@arg(
+    '-f', '--filter',
+    help='filter resources on pattern'
+)
+@arg(
+    '-j', '--jobs', type=int,
+    help='number of worker processes, defaults to number of cpus'
+)
+@arg(
+    '-i', '--incremental',
+    help='only re-transform resources changed since the last run'
+)
+@arg(
+    '--format', choices=['yaml', 'json'],
+    help='template output format'
+)
+@arg(
+    '--profile',
+    help='print per phase, per type and hot path stats to stderr'
+)
+@arg('--stats-json', help='write per phase, per type and hot path stats')
+@arg(
+    '-r', '--root',
+    help='files are terraform root directories, transformed with their '
+    'local modules into one template each'
+)
+@arg(
+    '-m', '--max-resources', type=int,
+    help='split templates over this many resources into nested stacks'
+)
+@arg(
+    '--shards', type=int,
+    help='transform large resource types of a single file or root in this '
+    'many forked worker processes'
+)
+@arg(
+    '--reduce-depends-on',
+    help='drop DependsOn implied by other dependencies and report deploy '
+    'waves and the critical path'
+)
+@arg(
+    '--lint',
+    help='run cfn-lint on each template, reporting by terraform address'
+)
+@aliases('t')
+def transform(
+    files, print_yaml=False, filter=None, jobs=None, incremental=False,
+    format='yaml', profile=False, stats_json=None, root=False,
+    max_resources=None, shards=None, reduce_depends_on=False, lint=False
+):
+    'transform terraform .tf, state or plan json files to sam format'
+    if root is True:
+        for file in files:
+            if not os.path.isdir(file):
+                fatal('root %s must be a directory' % file)
+    else:
+        files = _expand_files(files)
+    if len(files) == 0:
+        fatal('no .tf files found')
+    if max_resources is not None and not (
+        0 < max_resources <= TEMPLATE_MAX_RESOURCES
+    ):
+        fatal('--max-resources must be between 1 and %s' % (
+            TEMPLATE_MAX_RESOURCES
+        ))
+    stats = None
+    if profile is True or stats_json is not None:
+        stats = start_stats()
+    options = TransformOptions(
+        print_yaml=print_yaml, filter=filter, incremental=incremental,
+        format=format, max_resources=max_resources, shards=shards,
+        reduce_depends_on=reduce_depends_on, lint=lint
+    )
+    start = time.perf_counter()
+    try:
+        if root is True:
+            _transform_roots(files, jobs, options)
+        else:
+            _transform_files(files, jobs, options)
+    finally:
+        if stats is not None:
+            stop_stats()
+            stats.seconds = time.perf_counter() - start
+            if profile is True:
+                stats.report()
+            if stats_json is not None:
+                with open(stats_json, 'w') as fh:
+                    json.dump(stats.to_dict(), fh, indent=2)
+
+
+def _transform_roots(roots, jobs, options):
+    # each root parses its files in parallel, so roots run one at a time
+    for root in roots:
+        target = transform_root(root, jobs, **options._asdict())
+        if options.print_yaml is not True:
+            print('written %s' % target)
+        elif len(roots) > 1:
+            print('# %s' % root)
+            print(target)
+        else:
+            print(target)
+
+
+def _transform_files(files, jobs, options):
+    # single file keeps running in process, several are already transformed
+    # in parallel so aren't sharded
+    if len(files) == 1:
+        target = transform_file(files[0], **options._asdict())
+        print(target if options.print_yaml is True else 'written %s' % target)
+        return
+    options = options._replace(shards=None)
+
+    # load config, and cfn-lint with its spec, once and share with workers.
+    # forked workers inherit both, otherwise the initializer installs the
+    # config and each worker loads its own spec
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    config('template')
+    if options.lint is True:
+        linter()
+    stats = _stats
+    jobs = min(jobs or os.cpu_count() or 1, len(files))
+    failed = []
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker,
+        initargs=(_config, _config_digest),
+        mp_context=multiprocessing.get_context(
+            'fork' if hasattr(os, 'fork') else None
+        )
+    ) as executor:
+        futures = [
+            executor.submit(
+                _transform_worker, file, options, stats is not None
+            )
+            for file in files
+        ]
+        for future in futures:
+            (file, ok, target, worker_stats) = future.result()
+            if worker_stats is not None:
+                stats.merge(worker_stats)
+            if ok is not True:
+                failed.append(file)
+                print(color.red('failed %s%s' % (
+                    file, '' if target is None else ': %s' % target
+                )))
+            elif options.print_yaml is True:
+                print('# %s' % file)
+                print(target)
+            else:
+                print('written %s' % target)
+    if len(failed) > 0:
+        fatal('%s of %s file(s) failed' % (len(failed), len(files)))
+
+
+@arg('files', nargs='+', help='terraform files, directories or glob patterns')
+@arg(
+    '-f', '--filter',
+    help='filter resources on pattern'
+)
+@arg(
+    '-n', '--interval', type=float,
+    help='seconds between checking files for changes'
+)
+@arg(
+    '--format', choices=['yaml', 'json'],
+    help='template output format'
+)
+@aliases('w')
+def watch(files, filter=None, interval=0.5, format='yaml'):
+    'watch terraform files and config, re-transforming on change'
+    watcher = Watcher(files, filter, format)
+    try:
+        while True:
+            for (file, target, changed, total, ms) in watcher.poll():
+                if target is None:
+                    print(color.red('failed %s' % file))
+                else:
+                    print('written %s (%s of %s resources in %.0fms)' % (
+                        target, changed, total, ms
+                    ))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def transform_request(request):
+    """transform a serve request, returns the response
+
+    request is a dict with source (terraform text) and optional id, format
+    and filter.  the response has the request id, ok, the template text,
+    diagnostics and timings in ms
+
+    """
+    start = time.perf_counter()
+    ms = {}
+    response = {'id': None, 'ok': False, 'template': None}
+    with capture_diagnostics() as diagnostics:
+        try:
+            if not isinstance(request, dict):
+                fatal('request must be an object')
+            response['id'] = request.get('id')
+            format = request.get('format', 'yaml')
+            if format not in ['yaml', 'json']:
+                fatal('format %s not supported' % format)
+            if not isinstance(request.get('source'), str):
+                fatal('source must be terraform text')
+            t = time.perf_counter()
+            data = _parse_source(request['source'])
+            ms['parse'] = time.perf_counter() - t
+            t = time.perf_counter()
+            result = transform_source(data, request.get('filter'), False)
+            ms['transform'] = time.perf_counter() - t
+            diagnostics += result.diagnostics
+            if result.template is not None:
+                t = time.perf_counter()
+                response['template'] = write_template(
+                    result.template, None, True, format
+                )
+                ms['emit'] = time.perf_counter() - t
+                response['ok'] = True
+        except Tf2SamError:
+            pass
+        except Exception as e:
+            diagnostics.append(_exception_diagnostic(e))
+    ms['total'] = time.perf_counter() - start
+    response['diagnostics'] = diagnostics
+    response['ms'] = {k: round(v * 1000, 3) for k, v in ms.items()}
+    return response
+
+
+def _exception_diagnostic(e):
+    return {'level': 'exception', 'message': '%s: %s' % (type(e).__name__, e)}
+
+
+def _error_response(diagnostic, request=None):
+    return {
+        'id': request.get('id') if isinstance(request, dict) else None,
+        'ok': False, 'template': None, 'diagnostics': [diagnostic]
+    }
+
+
+def _handle_request(text):
+    # response to a json request, errors included, never raises
+    try:
+        request = json.loads(text)
+    except ValueError as e:
+        return _error_response({
+            'level': 'fatal', 'message': 'invalid json: %s' % e
+        })
+    try:
+        return transform_request(request)
+    except Exception as e:
+        return _error_response(_exception_diagnostic(e), request)
+
+
+def _serve_stdio(jobs=None):
+    # responses are written in completion order, matched to requests by id,
+    # to stdout as it was on entry, messages while transforming are
+    # captured into the responses' diagnostics
+    from concurrent.futures import ThreadPoolExecutor
+    out = sys.stdout
+    lock = threading.Lock()
+
+    def _handle(line):
+        # errors are responses, the future's result is never read
+        text = json.dumps(_handle_request(line)) + '\n'
+        with lock:
+            out.write(text)
+            out.flush()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for line in sys.stdin:
+            if line.strip() != '':
+                executor.submit(_handle, line)
+
+
+def http_server(host='127.0.0.1', port=0):
+    """threading http server taking serve requests as json posts
+
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            try:
+                response = _handle_request(self.rfile.read(
+                    int(self.headers.get('Content-Length') or 0)
+                ))
+            except Exception as e:
+                response = _error_response(_exception_diagnostic(e))
+            status = 200 if response['ok'] is True else 422
+            if any(
+                d['level'] == 'exception' for d in response['diagnostics']
+            ):
+                status = 500
+            body = json.dumps(response).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            sys.stderr.write('%s %s\n' % (
+                self.address_string(), format % args
+            ))
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+@arg(
+    '--http', type=int, metavar='PORT',
+    help='serve http posts on port instead of json lines on stdin/stdout'
+)
+@arg('--host', help='http host to bind')
+@arg(
+    '-j', '--jobs', type=int,
+    help='concurrent json lines requests, defaults to number of cpus'
+)
+@aliases('s')
+def serve(http=None, host='127.0.0.1', jobs=None):
+    'serve transform requests as json lines on stdin/stdout or over http'
+    # load config, jmespath functions and the yaml emitter once for every
+    # request
+    config('template')
+    jmespath_options()
+    yaml_dumper()
+    if http is None:
+        _serve_stdio(jobs)
+        return
+    server = http_server(host, http)
+    print('serving on http://%s:%s' % server.server_address[0:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@arg(
+    '-f', '--force',
+    help='rebuild snapshot even if config is unchanged'
+)
+def build_config(force=False):
+    'validate config and prebuild the config snapshot'
+    snapshot = load_config(force=force)
+    print('config %s (%s files) snapshot %s' % (
+        snapshot['digest'][0:12], len(snapshot['manifest']),
+        config_snapshot_file()
+    ))
+
+
+def cli():
+    import argh
+    commands = [
+        transform,
+        watch,
+        serve,
+        build_config
+    ]
+    # apply recorded arguments in the order they were decorated
+    for command in commands:
+        for args, kwargs in command.__dict__.get('_cli_args', []):
+            argh.arg(*args, **kwargs)(command)
+        if hasattr(command, '_cli_aliases'):
+            argh.aliases(*command._cli_aliases)(command)
+    parser = argh.ArghParser()
+    parser.description = 'Transform Terraform to AWS SAM'
+    parser.add_commands(commands)
     argh.completion.autocomplete(parser)
     parser.dispatch()
 